@@ -1,9 +1,15 @@
+import asyncio
+import math
 import os
 import re
+import threading
+import time
+import weakref
 from datetime import datetime
-from typing import Optional
-from pydantic import BaseModel, Field
+from typing import Annotated, Dict, Optional, Tuple
+from pydantic import BaseModel, Field, StringConstraints, TypeAdapter, ValidationError
 from PIL import Image  # Importing PIL library for image resizing
+import io
 from io import BytesIO  # Importing BytesIO from io
 
 from dotenv import load_dotenv
@@ -14,19 +20,91 @@ from google.genai import types
 import httpx
 from typing import List
 
+import metrics
+from extraction_cache import ExtractionCache, cache_from_env, make_cache_key
+from image_download import (adownload_document, adownload_image, download_document, download_image,
+                            new_async_http_client, new_http_client)
+from model_backend import GeminiBackend, ModelBackend, fake_backend_from_env
+from rate_limiter import RateLimiter, current_priority, limiter_from_env
+from request_policy import RequestPolicy, policy_from_env
+from resolution import ResolutionController, controller_from_env
+# Validation and normalization live in the dependency-free validators module
+# and are re-exported here for existing callers
+from validators import (RAMQ_CHAR_VALUES, RAMQ_MULTIPLIERS, RAMQ_REASON_CHECK_DIGIT, RAMQ_REASON_FORMAT,
+                        RAMQ_REASON_LENGTH, OhipCheck, RamqCheck, RamqConsistency, RamqPrefixIndex,
+                        check_ohip, check_ramq, expected_ramq_prefixes,
+                        extract_birth_info_from_ramq, normalize_ohip, normalize_ramq, parse_date_string,
+                        ramq_birth_digits, ramq_name_prefix, ramq_name_prefixes, repair_ramq,
+                        score_ramq_consistency, validate_ohip, validate_ramq, validate_ramq_batch)
+
 # Load environment variables from the .env file in the current directory
 load_dotenv()
 gemini_api_key = os.environ.get("GEMINI_API_KEY")
 
-# Configure httpx client with timeouts
-http_client = httpx.Client(timeout=httpx.Timeout(30.0, connect=30.0))
+# The pooled keep-alive httpx client shared by every image download and the
+# Gemini client are created on first use, so importing this module stays cheap
+_http_client = None
+_gemini_client = None
+_clients_lock = threading.Lock()
+
+
+def get_http_client() -> httpx.Client:
+    global _http_client
+    if _http_client is None:
+        with _clients_lock:
+            if _http_client is None:
+                _http_client = new_http_client()
+    return _http_client
+
+
+def get_gemini_client() -> genai.Client:
+    global _gemini_client
+    if _gemini_client is None:
+        with _clients_lock:
+            if _gemini_client is None:
+                _gemini_client = genai.Client(api_key=gemini_api_key)
+    return _gemini_client
+
+
+def __getattr__(name):
+    # http_client and gemini_client used to be module attributes built at import
+    if name == "http_client":
+        return get_http_client()
+    if name == "gemini_client":
+        return get_gemini_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Configure Gemini client
-gemini_client = genai.Client(api_key=gemini_api_key)
 
 # Model to use
 GEMINI_MODEL = "gemini-flash-latest"
 
+# Backend used by every extraction function; MODEL_BACKEND=fake selects the
+# offline stand-in (see model_backend.fake_backend_from_env)
+if os.environ.get("MODEL_BACKEND", "gemini").lower() == "fake":
+    model_backend = fake_backend_from_env()
+else:
+    model_backend = GeminiBackend(model=GEMINI_MODEL, client_factory=get_gemini_client)
+
+# Deadlines, retries and hedging around every model call
+request_policy = policy_from_env()
+request_policy.on_attempt = metrics.record_model_attempt
+
+# Shared RPM/TPM quota in front of every model call, None when MODEL_RPM and
+# MODEL_TPM are unset (see rate_limiter.limiter_from_env)
+rate_limiter = limiter_from_env()
+if rate_limiter is not None:
+    rate_limiter.on_acquire = metrics.record_rate_limit
+
+# Maximum number of async extractions in flight per event loop
+EXTRACTION_CONCURRENCY = int(os.environ.get("EXTRACTION_CONCURRENCY", "32"))
+_async_resources_by_loop = weakref.WeakKeyDictionary()
+
+# Model response cache in front of get_ramq, see extraction_cache.cache_from_env
+extraction_cache = cache_from_env()
+
+# Width each card image is sent at, see resolution.controller_from_env
+resolution_controller = controller_from_env()
+
 
 class PersonInfo(BaseModel):
     first_name: str
@@ -42,134 +120,197 @@ class PatientInfo(BaseModel):
     first_name: str
     last_name: str
     patient_number: Optional[str] = None
-    room_number: Optional[str] = None
+    room_number: Optional[Annotated[str, StringConstraints(strip_whitespace=True)]] = None
 
 
 class PatientList(BaseModel):
     patients: List[PatientInfo]
 
 
-def validate_ramq(ramq: str) -> bool:
-    # Character to decimal value mapping
-    char_to_decimal = {
-        "A": 193,
-        "B": 194,
-        "C": 195,
-        "D": 196,
-        "E": 197,
-        "F": 198,
-        "G": 199,
-        "H": 200,
-        "I": 201,
-        "J": 209,
-        "K": 210,
-        "L": 211,
-        "M": 212,
-        "N": 213,
-        "O": 214,
-        "P": 215,
-        "Q": 216,
-        "R": 217,
-        "S": 226,
-        "T": 227,
-        "U": 228,
-        "V": 229,
-        "W": 230,
-        "X": 231,
-        "Y": 232,
-        "Z": 233,
-        "0": 240,
-        "1": 241,
-        "2": 242,
-        "3": 243,
-        "4": 244,
-        "5": 245,
-        "6": 246,
-        "7": 247,
-        "8": 248,
-        "9": 249,
-    }
-
-
-    # Updated multipliers for all 14 characters before the check digit
-    # Based on the example provided (NOMI-AAAA-SxMM-JJ-S gives 14 chars):
-    multipliers = [1, 3, 7, 9, 1, 7, 1, 3, 4, 5, 7, 6, 9, 1]
-
-    def calculate_check_digit(nam_decomposed: str) -> int:
-        total = 0
-        for char, mult in zip(nam_decomposed, multipliers):
-            total += char_to_decimal[char] * mult
-        return total % 10
-
-    if len(ramq) != 12:
-        return False
+# Response schema sent with person extractions: the PersonInfo fields as the
+# model returns them (date of birth as text, gender derived from the RAMQ).
+# The docstring below is passed to the model as the schema description.
+class PersonExtraction(BaseModel):
+    """One person read from a health card or patient document."""
+    first_name: str
+    last_name: str
+    date_of_birth: Optional[str] = None
+    ramq: Optional[str] = Field(None, description="RAMQ number, 4 letters followed by 8 digits")
+    ohip: Optional[str] = Field(None, description="OHIP number, 10 digits + optional 2-letter version code")
+    mrn: Optional[str] = Field(None, description="Medical Record Number (MRN)")
 
-    # Extract components
-    name = ramq[:4]
-    year = ramq[4:6]
-    month = ramq[6:8]
-    day = ramq[8:10]
-    sequence = ramq[10]
-    check_digit = int(ramq[11])
-
-    # Determine full year
-    current_year = datetime.now().year
-    if int(year) > 50:
-        full_year = f"19{year}"
-    else:
-        full_year = f"20{year}"
-    if int(full_year) > current_year:
-        # If year surpasses current year, subtract a century
-        full_year = str(int(full_year) - 100)
-
-    # Adjust month and determine sex
-    month_num = int(month)
-    if month_num > 50:
-        month_num -= 50
-        sex = "F"
-    else:
-        sex = "M"
-
-    # Construct the full string for validation (no check digit at this point)
-    nam_decomposed = (
-        name  # NOMI (4 chars)
-        + full_year  # AAAA (4 chars)
-        + sex  # Sx (1 char for sex)
-        + f"{month_num:02d}"  # MM (2 chars)
-        + day  # JJ (2 chars)
-        + sequence  # S (1 char)
-    )
 
-    # Calculate check digit with current assumption
-    calculated_check = calculate_check_digit(nam_decomposed)
+class RamqReading(BaseModel):
+    """The RAMQ number read from a Quebec health card."""
+    ramq: Optional[str] = Field(None, description="RAMQ number, 4 letters followed by 8 digits")
 
-    # If check fails, try previous century if we haven't already
-    if calculated_check != check_digit and full_year.startswith("20"):
-        full_year = str(int(full_year) - 100)
-        nam_decomposed = name + full_year + sex + f"{month_num:02d}" + day + sequence
-        calculated_check = calculate_check_digit(nam_decomposed)
 
-    return calculated_check == check_digit
+class DocumentPersonExtraction(PersonExtraction):
+    """One health card or patient identity block found on a document page."""
+    page: Optional[int] = Field(None, description="1-based page number the person was found on")
+    box_2d: Optional[list[int]] = Field(
+        None, description="Bounding box on the page as [ymin, xmin, ymax, xmax] normalized to 0-1000")
 
 
-def resize_image(image_data: bytes, max_size_mb: float = 5.0) -> bytes:
-    image = Image.open(BytesIO(image_data))
-    while len(image_data) > max_size_mb * 1024 * 1024:
+class DocumentExtraction(BaseModel):
+    """Every person found in a document."""
+    people: list[DocumentPersonExtraction]
+
+
+class DocumentPerson(PersonInfo):
+    """A person extracted from a multi-card or multi-page document."""
+    page: int = 1
+    bbox: Optional[Tuple[float, float, float, float]] = Field(
+        None, description="x_min, y_min, x_max, y_max as fractions of the page size")
+    valid_ramq: bool = False
+    valid_ohip: bool = False
+
+
+# Running totals of resize_image encode passes, see get_resize_stats
+_resize_totals = {"calls": 0, "resized": 0, "encodes": 0, "max_encodes": 0, "seconds": 0.0}
+_resize_totals_lock = threading.Lock()
+
+
+def resize_image_with_stats(image_data: bytes, max_size_mb: float = 5.0, quality: int = 75,
+                            min_quality: int = 50, max_encodes: int = 6) -> Tuple[bytes, dict]:
+    """Re-encode an image as JPEG under max_size_mb using as few encodes as possible.
+
+    A first encode at full size measures the bytes per pixel. Slightly
+    oversized images then binary-search the JPEG quality at full resolution;
+    larger ones predict the scale from the measured size (bytes grow with
+    pixel count) and refine it inside a fits / too-big bracket.
+
+    Args:
+        image_data: Original image bytes
+        max_size_mb: Size limit in megabytes
+        quality: JPEG quality used for scale search (and upper bound for quality search)
+        min_quality: Lowest quality tried before shrinking the image
+        max_encodes: Encode budget; once spent, the best fitting encode is returned
+
+    Returns:
+        (image bytes, stats) where stats holds encodes, scale, quality,
+        input_bytes, output_bytes and seconds.
+    """
+    start = time.perf_counter()
+    limit = int(max_size_mb * 1024 * 1024)
+    stats = {"encodes": 0, "scale": 1.0, "quality": None, "input_bytes": len(image_data)}
+
+    if len(image_data) <= limit:
+        result = image_data
+    else:
+        image = Image.open(BytesIO(image_data))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
         width, height = image.size
-        new_width = int(width * 0.9)
-        new_height = int(height * 0.9)
-        image = image.resize((new_width, new_height), Image.LANCZOS)
-        buffer = BytesIO()
-        image.save(buffer, format="JPEG")
-        image_data = buffer.getvalue()
+
+        def encode(scale: float, jpeg_quality: int) -> bytes:
+            new_size = (int(width * scale), int(height * scale))
+            if new_size[0] < 1 or new_size[1] < 1:
+                raise ValueError(f"Cannot encode image under {max_size_mb}MB")
+            resized = image if scale >= 1.0 else image.resize(new_size, Image.LANCZOS)
+            buffer = BytesIO()
+            resized.save(buffer, format="JPEG", quality=jpeg_quality)
+            stats["encodes"] += 1
+            return buffer.getvalue()
+
+        best = None  # (data, scale, quality) of the largest encode that fits
+        data = encode(1.0, quality)
+        if len(data) <= limit:
+            best = (data, 1.0, quality)
+        elif len(data) <= limit * 1.5:
+            # Close to the limit: trade quality for size at full resolution
+            fits, too_big = min_quality - 1, quality
+            while too_big - fits > 1 and stats["encodes"] < max_encodes:
+                jpeg_quality = (fits + too_big + 1) // 2
+                candidate = encode(1.0, jpeg_quality)
+                if len(candidate) <= limit:
+                    best = (candidate, 1.0, jpeg_quality)
+                    fits = jpeg_quality
+                else:
+                    too_big = jpeg_quality
+
+        if best is None:
+            fits, too_big = 0.0, 1.0
+            previous = (1.0, len(data))
+            # Encoded size starts out proportional to the pixel count (scale ** 2)
+            exponent = 2.0
+            scale = min(0.95, (limit * 0.95 / len(data)) ** (1 / exponent))
+            while True:
+                data = encode(scale, quality)
+                if len(data) <= limit:
+                    if best is None or scale > best[1]:
+                        best = (data, scale, quality)
+                    fits = scale
+                    if len(data) >= limit * 0.85:
+                        break
+                else:
+                    too_big = scale
+                if best is not None and stats["encodes"] >= max_encodes:
+                    break
+                # Fit size ~ scale ** exponent through the last two encodes and
+                # re-predict, staying inside the fits / too-big bracket
+                if scale != previous[0] and len(data) != previous[1]:
+                    measured = math.log(len(data) / previous[1]) / math.log(scale / previous[0])
+                    exponent = min(4.0, max(1.0, measured))
+                previous = (scale, len(data))
+                scale = scale * (limit * 0.95 / len(data)) ** (1 / exponent)
+                if not fits < scale < too_big:
+                    scale = (fits + too_big) / 2
+
+        result, stats["scale"], stats["quality"] = best
+
+    stats["output_bytes"] = len(result)
+    stats["seconds"] = time.perf_counter() - start
+
+    with _resize_totals_lock:
+        _resize_totals["calls"] += 1
+        _resize_totals["resized"] += stats["encodes"] > 0
+        _resize_totals["encodes"] += stats["encodes"]
+        _resize_totals["max_encodes"] = max(_resize_totals["max_encodes"], stats["encodes"])
+        _resize_totals["seconds"] += stats["seconds"]
+
+    return result, stats
+
+
+def resize_image(image_data: bytes, max_size_mb: float = 5.0) -> bytes:
+    image_data, _ = resize_image_with_stats(image_data, max_size_mb)
     return image_data
 
 
+def get_resize_stats() -> dict:
+    """Return resize_image encode pass totals since start (or the last reset)."""
+    with _resize_totals_lock:
+        totals = dict(_resize_totals)
+    resized = totals["resized"]
+    totals["avg_encodes"] = totals["encodes"] / resized if resized else 0.0
+    return totals
+
+
+def reset_resize_stats() -> None:
+    with _resize_totals_lock:
+        for key in _resize_totals:
+            _resize_totals[key] = 0.0 if key == "seconds" else 0
+
+
+def _percent_target_size(width: int, height: int, percent: int, min_width: int) -> Tuple[int, int]:
+    """Target size used by resize_image_percent and preprocess_image."""
+    new_width = int(width * percent / 100)
+    new_height = int(height * percent / 100)
+
+    # Ensure minimum width for OCR accuracy
+    if new_width < min_width:
+        ratio = min_width / new_width if new_width else min_width
+        new_width = min_width
+        new_height = int(new_height * ratio)
+
+    return new_width, new_height
+
+
 def resize_image_percent(image_data: bytes, percent: int = 40, min_width: int = 200) -> bytes:
     """Resize image to a percentage of original size.
 
     Args:
-        image_data: Original image bytes
+        image_data: Original image bytes, or a buffer such as a memoryview
         percent: Target percentage (default 40% for optimal accuracy/size balance)
         min_width: Minimum width in pixels (default 200px for OCR accuracy)
     """
@@ -177,14 +318,7 @@ def resize_image_percent(image_data: bytes, percent: int = 40, min_width: int =
     original_format = image.format or 'JPEG'
     width, height = image.size
 
-    new_width = int(width * percent / 100)
-    new_height = int(height * percent / 100)
-
-    # Ensure minimum width for OCR accuracy
-    if new_width < min_width:
-        ratio = min_width / new_width
-        new_width = min_width
-        new_height = int(new_height * ratio)
+    new_width, new_height = _percent_target_size(width, height, percent, min_width)
 
     # Don't upscale - return original if target is larger
     if new_width >= width:
@@ -224,167 +358,391 @@ def resize_image_to_width(image_data: bytes, target_width: int, output_format: s
     return buffer.getvalue()
 
 
-def normalize_ohip(ohip: Optional[str]) -> Optional[dict]:
-    """Normalize OHIP number to 10 digits + optional 2-letter version code."""
-    if not ohip:
-        return None
+# EXIF orientation tag and the transpose that makes each value upright
+_EXIF_ORIENTATION_TAG = 0x0112
+_EXIF_TRANSPOSE_METHODS = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+# Orientations that rotate the image by 90 or 270 degrees
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+# Formats the model accepts as-is when no preprocessing is needed
+_PASSTHROUGH_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "MPO": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+}
+
+
+class _BufferReader(io.RawIOBase):
+    """Seekable read-only file over a buffer, so PIL can parse it without a copy."""
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        chunk = self._view[self._position:self._position + len(target)]
+        target[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+def _open_image(image_data) -> Image.Image:
+    """Image.open over bytes, or over any buffer (e.g. a memory-mapped upload) without copying it."""
+    if isinstance(image_data, bytes):
+        return Image.open(BytesIO(image_data))
+    return Image.open(io.BufferedReader(_BufferReader(image_data)))
+
+
+def preprocess_image(image_data: bytes, percent: int = 40, min_width: int = 200,
+                     quality: int = 85, width: Optional[int] = None) -> Tuple[bytes, str]:
+    """Downscale, orient and encode an image for the model in a single pass.
+
+    Faster equivalent of resize_image_percent: JPEGs are decoded directly at
+    1/2, 1/4 or 1/8 scale with Image.draft, the remaining integer factor is
+    removed with Image.reduce and only the last step uses LANCZOS. The EXIF
+    orientation is applied so the model always sees an upright card.
+
+    Args:
+        image_data: Original image bytes
+        percent: Target percentage of the (oriented) original size
+        min_width: Minimum width in pixels (default 200px for OCR accuracy)
+        quality: JPEG quality of the output
+        width: Target width in pixels, overrides percent and min_width
 
-    compact = re.sub(r"[\s\-]+", "", str(ohip)).upper()
+    Returns:
+        (image bytes, mime type). Images with transparency or a palette are
+        encoded as PNG, everything else as JPEG. JPEG, PNG and WebP bytes are
+        returned unchanged when no resize or rotation is needed.
+    """
+    image = _open_image(image_data)
+    orientation = image.getexif().get(_EXIF_ORIENTATION_TAG, 1)
+    transposed = orientation in _TRANSPOSED_ORIENTATIONS
 
-    match = re.fullmatch(r"(\d{10})([A-Z]{2})?", compact)
-    if not match:
-        return None
+    target = width
+    width, height = image.size
+    if transposed:
+        width, height = height, width
+    if target is not None:
+        target_width, target_height = target, max(1, round(height * target / width))
+    else:
+        target_width, target_height = _percent_target_size(width, height, percent, min_width)
+
+    # Don't upscale - return original if target is larger
+    if target_width >= width:
+        if orientation == 1 and image.format in _PASSTHROUGH_MIME_TYPES:
+            return bytes(image_data), _PASSTHROUGH_MIME_TYPES[image.format]
+        target_width, target_height = width, height
+
+    # Decode size in the stored (pre-rotation) orientation
+    decode_size = (target_height, target_width) if transposed else (target_width, target_height)
+    if image.format in ("JPEG", "MPO"):
+        image.draft(None, decode_size)
+    with metrics.stage("decode"):
+        image.load()
+
+    with metrics.stage("resize"):
+        factor = min(image.size[0] // decode_size[0], image.size[1] // decode_size[1])
+        if factor >= 2:
+            image = image.reduce(factor)
+        if image.size != decode_size:
+            image = image.resize(decode_size, Image.LANCZOS)
+
+        if orientation in _EXIF_TRANSPOSE_METHODS:
+            image = image.transpose(_EXIF_TRANSPOSE_METHODS[orientation])
 
-    return {
-        "number": match.group(1),
-        "version_code": match.group(2) or None,
-    }
+    buffer = BytesIO()
+    with metrics.stage("encode"):
+        if image.mode in ("RGBA", "LA", "P", "PA", "1") or "transparency" in image.info:
+            image.save(buffer, format="PNG")
+            mime_type = "image/png"
+        else:
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(buffer, format="JPEG", quality=quality)
+            mime_type = "image/jpeg"
+    output = buffer.getvalue()
+    metrics.observe_bytes("encode", len(output))
+    return output, mime_type
+
+
+def image_dimensions(image_data: bytes) -> Tuple[int, int]:
+    """(width, height) after EXIF orientation, read from the header only."""
+    image = _open_image(image_data)
+    width, height = image.size
+    if image.getexif().get(_EXIF_ORIENTATION_TAG, 1) in _TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
 
 
-def validate_ohip(ohip: str) -> bool:
-    """Validate OHIP number format: 10 digits + optional 2-letter version code."""
-    compact = re.sub(r"[\s\-]+", "", str(ohip)).upper()
-    return bool(re.fullmatch(r"\d{10}([A-Z]{2})?", compact))
+# Opt-in verify-and-repair mode for get_ramq/aget_ramq
+RAMQ_REPAIR = os.environ.get("RAMQ_REPAIR", "0") == "1"
 
 
-def normalize_ramq(ramq: Optional[str]) -> Optional[str]:
-    """Normalize RAMQ to 4 letters + 8 digits when possible."""
-    if not ramq:
-        return None
+RAMQ_IMAGE_PROMPT = "Perform OCR. Extract the person's first name, last name, date of birth, RAMQ number (Quebec), OHIP number (Ontario), and MRN (Medical Record Number). Output JSON with keys: 'first_name', 'last_name', 'date_of_birth', 'ramq', 'ohip', and 'mrn'. If RAMQ is missing or unreadable, set 'ramq' to null. If OHIP is missing or unreadable, set 'ohip' to null. Still return all other fields. If date of birth is missing, set it to null. If MRN is missing, set it to null. When RAMQ is present, normalize it to 4 letters followed by 8 digits with no spaces. When OHIP is present, include the 10 digits and optional 2-letter version code with no spaces. Do not include text outside the JSON object."
 
-    compact = re.sub(r"\s+", "", str(ramq)).upper()
+RAMQ_TEXT_PROMPT = "From this text extract the person's first name, last name, date of birth, RAMQ number (Quebec), OHIP number (Ontario), and MRN (Medical Record Number). Output JSON with keys: 'first_name', 'last_name', 'date_of_birth', 'ramq', 'ohip', and 'mrn'. If RAMQ is missing or unreadable, set 'ramq' to null. If OHIP is missing or unreadable, set 'ohip' to null. Still return all other fields. If date of birth is missing, set it to null. If MRN is missing, set it to null. When RAMQ is present, normalize it to 4 letters followed by 8 digits with no spaces. When OHIP is present, include the 10 digits and optional 2-letter version code with no spaces. Do not include text outside the JSON object."
 
-    if re.fullmatch(r"[A-Z]{4}\d{8}", compact):
-        return compact
+RAMQ_BYTES_PROMPT = "Perform OCR. Extract the person's first name, last name, date of birth, and RAMQ number. Output JSON with keys: 'first_name', 'last_name', 'date_of_birth', and 'ramq'. If RAMQ is missing or unreadable set it to null and still return the other fields."
 
-    match = re.search(r"[A-Z]{4}\d{8}", compact)
-    return match.group(0) if match else None
+RAMQ_REQUERY_PROMPT = "Read only the RAMQ number (Quebec health insurance number, 4 letters followed by 8 digits) on this card. Output JSON with the key 'ramq' and no spaces in the number. If it is unreadable, set 'ramq' to null. Do not include text outside the JSON object."
 
+DOCUMENT_PROMPT = "Perform OCR on the document pages above. Find every person identified on them: each health card (RAMQ, OHIP) and each patient identity block. For each one extract the first name, last name, date of birth, RAMQ number, OHIP number and MRN, the 1-based page number it is on (the label before each page image, or the page of the PDF) and its bounding box on that page as [ymin, xmin, ymax, xmax] normalized to 0-1000. Output JSON with a 'people' key holding one object per card or identity block, with keys 'first_name', 'last_name', 'date_of_birth', 'ramq', 'ohip', 'mrn', 'page' and 'box_2d'. Set missing values to null. Normalize RAMQ to 4 letters followed by 8 digits and OHIP to 10 digits with an optional 2-letter version code, with no spaces. Do not include text outside the JSON object."
 
-def parse_date_string(date_text: Optional[str]) -> Optional[datetime]:
-    """Parse date from model output using several common formats."""
-    if not date_text:
-        return None
+PATIENT_LIST_PROMPT = "Extract a list of patients from the image or text. For each patient, provide their first name and last name. If available, also include their patient number and room number. Output as JSON with a 'patients' key containing a list of patient objects. Each patient object should have keys: first_name, last_name, and optionally patient_number and room_number. "
 
-    cleaned = str(date_text).strip()
-    if not cleaned:
-        return None
 
-    formats = [
-        "%Y-%m-%d",
-        "%Y/%m/%d",
-        "%d-%m-%Y",
-        "%d/%m/%Y",
-        "%m-%d-%Y",
-        "%m/%d/%Y",
+def _image_contents(image_data: bytes, content_type: str, prompt: str) -> list:
+    return [
+        types.Content(
+            role="user",
+            parts=[
+                types.Part.from_bytes(data=image_data, mime_type=content_type),
+                types.Part.from_text(text=prompt),
+            ],
+        ),
     ]
 
-    for fmt in formats:
-        try:
-            return datetime.strptime(cleaned, fmt)
-        except ValueError:
-            continue
 
-    return None
+def _text_contents(prompt: str) -> list:
+    return [
+        types.Content(
+            role="user",
+            parts=[
+                types.Part.from_text(text=prompt),
+            ],
+        ),
+    ]
 
 
-def extract_birth_info_from_ramq(ramq: str):
-    """Return (dob, gender, is_valid_ramq) for a normalized RAMQ."""
-    year = int(ramq[4:6])
-    month = int(ramq[6:8])
-    day = int(ramq[8:10])
+def _json_config(response_schema=None) -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=response_schema,
+    )
 
-    current_year = datetime.now().year
-    year += 1900 if year > 50 else 2000
-    if year > current_year:
-        year -= 100
 
-    if month > 50:
-        gender = "female"
-        month -= 50
-    else:
-        gender = "male"
+# Constrained output configs, built once per process
+PERSON_CONFIG = _json_config(PersonExtraction)
+PATIENT_LIST_CONFIG = _json_config(PatientList)
+RAMQ_REQUERY_CONFIG = _json_config(RamqReading)
+DOCUMENT_CONFIG = _json_config(DocumentExtraction)
+
+
+def set_model_backend(backend: ModelBackend) -> None:
+    """Replace the backend used by the extraction functions."""
+    global model_backend
+    model_backend = backend
+
+
+def get_model_backend() -> ModelBackend:
+    return model_backend
+
+
+def set_request_policy(policy: RequestPolicy) -> None:
+    """Replace the retry/deadline/hedging policy applied to model calls."""
+    global request_policy
+    request_policy = policy
+
+
+def get_request_policy() -> RequestPolicy:
+    return request_policy
 
+
+def set_rate_limiter(limiter: Optional[RateLimiter]) -> None:
+    """Replace the quota limiter applied to model calls (None: unlimited)."""
+    global rate_limiter
+    rate_limiter = limiter
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    return rate_limiter
+
+
+# Gemini bills an image as 258 tokens per 768x768 tile (one tile up to 384px)
+# and a PDF as 258 tokens per page; text is about 4 characters per token
+IMAGE_TILE_TOKENS = 258
+# Page objects, written "/Type /Page" or "/Type/Page"; pages inside compressed
+# object streams are not visible, hence the floor of one page
+_PDF_PAGE = re.compile(rb"/Type\s*/Page(?!s)")
+RESPONSE_TOKENS_ESTIMATE = int(os.environ.get("RATE_LIMIT_RESPONSE_TOKENS", "256"))
+
+
+def _part_tokens(part) -> int:
+    if getattr(part, "text", None):
+        return len(part.text) // 4 + 1
+    blob = getattr(part, "inline_data", None)
+    if blob is None or not blob.data:
+        return 0
+    if blob.mime_type == "application/pdf":
+        pages = len(_PDF_PAGE.findall(blob.data))
+        return IMAGE_TILE_TOKENS * max(pages, 1)
     try:
-        dob = datetime(year, month, day)
-    except ValueError:
-        dob = None
+        # Only the header is parsed
+        width, height = Image.open(BytesIO(blob.data)).size
+    except Exception:
+        return IMAGE_TILE_TOKENS
+    if width <= 384 and height <= 384:
+        return IMAGE_TILE_TOKENS
+    return IMAGE_TILE_TOKENS * math.ceil(width / 768) * math.ceil(height / 768)
 
-    return dob, gender, validate_ramq(ramq)
 
+def estimate_tokens(contents: list) -> int:
+    """Input tokens of request contents plus the expected response, for the TPM bucket."""
+    tokens = RESPONSE_TOKENS_ESTIMATE
+    for content in contents:
+        for part in getattr(content, "parts", None) or []:
+            tokens += _part_tokens(part)
+    return tokens
 
-def get_ramq(input_data, is_image=True):
-    if is_image:
-        try:
-            # Download image and convert to base64
-            image_response = http_client.get(input_data)
-            image_data = image_response.content
-
-            # Resize image to 40% for optimal accuracy/size/speed balance
-            image_data = resize_image_percent(image_data, percent=40)
-
-            # Determine media type based on content
-            content_type = image_response.headers.get('content-type', 'image/jpeg')
-
-            prompt = "Perform OCR. Extract the person's first name, last name, date of birth, RAMQ number (Quebec), OHIP number (Ontario), and MRN (Medical Record Number). Output JSON with keys: 'first_name', 'last_name', 'date_of_birth', 'ramq', 'ohip', and 'mrn'. If RAMQ is missing or unreadable, set 'ramq' to null. If OHIP is missing or unreadable, set 'ohip' to null. Still return all other fields. If date of birth is missing, set it to null. If MRN is missing, set it to null. When RAMQ is present, normalize it to 4 letters followed by 8 digits with no spaces. When OHIP is present, include the 10 digits and optional 2-letter version code with no spaces. Do not include text outside the JSON object."
-
-            # Build the content for Gemini
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part.from_bytes(data=image_data, mime_type=content_type),
-                        types.Part.from_text(text=prompt),
-                    ],
-                ),
-            ]
-
-            # Configure the generation
-            config = types.GenerateContentConfig(
-                response_mime_type="application/json",
-            )
 
-            # Call Gemini API
-            message = gemini_client.models.generate_content(
-                model=GEMINI_MODEL,
-                contents=contents,
-                config=config,
-            )
+def _quota_error(error: BaseException) -> bool:
+    return (getattr(error, "code", None) or getattr(error, "status_code", None)) == 429
+
+
+def _generate(contents: list, config: Optional[types.GenerateContentConfig] = None) -> str:
+    """Call the model backend under the quota and request policy and return the response text.
 
-            response = message.text
+    Every request sent counts against the quota, retries and hedges included.
+    The first is charged before the policy starts its clock, so waiting for
+    quota does not eat into the attempt deadline or trigger a hedge.
+    """
+    backend, config, limiter = model_backend, config or _json_config(), rate_limiter
+    tokens, priority_name = estimate_tokens(contents), current_priority()
+    prepaid = [True]
+    if limiter is not None:
+        limiter.acquire(tokens, priority_name)
+
+    def attempt():
+        if limiter is not None:
+            try:
+                prepaid.pop()
+            except IndexError:
+                # Attempts may run on policy worker threads, so the priority is passed explicitly
+                limiter.acquire(tokens, priority_name)
+        try:
+            return backend.generate(contents, config)
         except Exception as e:
-            raise ValueError(f"Error processing image: {str(e)}")
-    else:
-        prompt = f"From this text extract the person's first name, last name, date of birth, RAMQ number (Quebec), OHIP number (Ontario), and MRN (Medical Record Number). Output JSON with keys: 'first_name', 'last_name', 'date_of_birth', 'ramq', 'ohip', and 'mrn'. If RAMQ is missing or unreadable, set 'ramq' to null. If OHIP is missing or unreadable, set 'ohip' to null. Still return all other fields. If date of birth is missing, set it to null. If MRN is missing, set it to null. When RAMQ is present, normalize it to 4 letters followed by 8 digits with no spaces. When OHIP is present, include the 10 digits and optional 2-letter version code with no spaces. Do not include text outside the JSON object. Here is the text: {input_data}"
-
-        # Build the content for Gemini
-        contents = [
-            types.Content(
-                role="user",
-                parts=[
-                    types.Part.from_text(text=prompt),
-                ],
-            ),
-        ]
-
-        # Configure the generation
-        config = types.GenerateContentConfig(
-            response_mime_type="application/json",
-        )
-
-        # Call Gemini API
-        message = gemini_client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=contents,
-            config=config,
-        )
-        response = message.text
-
-    # Parse the JSON response
-    parsed = json.loads(response)
-    # Handle both array and object formats from Gemini
-    data = parsed[0] if isinstance(parsed, list) else parsed
+            if limiter is not None and _quota_error(e):
+                limiter.penalize()
+            raise
+
+    with metrics.stage("model_call"):
+        return request_policy.call(attempt)
+
+
+async def _agenerate(contents: list, config: Optional[types.GenerateContentConfig] = None) -> str:
+    """Async counterpart of _generate."""
+    backend, config, limiter = model_backend, config or _json_config(), rate_limiter
+    tokens, priority_name = estimate_tokens(contents), current_priority()
+    prepaid = [True]
+    if limiter is not None:
+        await limiter.aacquire(tokens, priority_name)
+
+    async def attempt():
+        if limiter is not None:
+            try:
+                prepaid.pop()
+            except IndexError:
+                await limiter.aacquire(tokens, priority_name)
+        try:
+            return await backend.agenerate(contents, config)
+        except Exception as e:
+            if limiter is not None and _quota_error(e):
+                limiter.penalize()
+            raise
+
+    with metrics.stage("model_call"):
+        return await request_policy.acall(attempt)
+
+
+def _download(url: str) -> Tuple[bytes, str]:
+    with metrics.stage("download"):
+        image_data, content_type = download_image(url, get_http_client())
+    metrics.observe_bytes("download", len(image_data))
+    return image_data, content_type
+
+
+async def _adownload(url: str, client: httpx.AsyncClient) -> Tuple[bytes, str]:
+    with metrics.stage("download"):
+        image_data, content_type = await adownload_image(url, client)
+    metrics.observe_bytes("download", len(image_data))
+    return image_data, content_type
+
+
+def _download_document(url: str) -> Tuple[bytes, str]:
+    with metrics.stage("download"):
+        document, content_type = download_document(url, get_http_client())
+    metrics.observe_bytes("download", len(document))
+    return document, content_type
 
+
+async def _adownload_document(url: str, client: httpx.AsyncClient) -> Tuple[bytes, str]:
+    with metrics.stage("download"):
+        document, content_type = await adownload_document(url, client)
+    metrics.observe_bytes("download", len(document))
+    return document, content_type
+
+
+def _person_data(response: str) -> dict:
+    """Parse one extracted person from a model response.
+
+    Schema-constrained responses validate in a single pydantic pass; anything
+    else (cached pre-schema responses, a list wrapper, numbers instead of
+    strings) goes through json.loads.
+    """
+    with metrics.stage("parse"):
+        try:
+            return PersonExtraction.model_validate_json(response).__dict__
+        except ValidationError:
+            parsed = json.loads(response)
+            # Handle both array and object formats from Gemini
+            return parsed[0] if isinstance(parsed, list) else parsed
+
+
+def _parse_ramq_response(response: str):
+    """Turn a model response into the tuple returned by get_ramq."""
+    return _ramq_result_from_data(_person_data(response))
+
+
+def _ramq_result_from_data(data: dict):
+    """Normalize and validate one extracted person into the get_ramq tuple."""
+    with metrics.stage("validate"):
+        result = _validate_person_data(data)
+    # result[5] / result[8]: RAMQ / OHIP validity, only counted when present
+    if result[0]:
+        metrics.record_validation("ramq", result[5])
+        if result[5]:
+            consistency = score_ramq_consistency(result[0], result[1], result[2],
+                                                 parse_date_string(data.get("date_of_birth")))
+            metrics.record_validation("ramq_consistency", consistency.consistent)
+    if result[7]:
+        metrics.record_validation("ohip", result[8])
+    return result
+
+
+def _validate_person_data(data: dict):
     ramq = normalize_ramq(data.get("ramq"))
     ohip_result = normalize_ohip(data.get("ohip"))
     ohip_str = None
@@ -442,43 +800,11 @@ def get_ramq(input_data, is_image=True):
     )
 
 
-def get_ramq_from_bytes(image_data: bytes, content_type: str = "image/jpeg"):
-    """
-    Extract RAMQ from image bytes directly (useful for testing different sizes).
-    """
-    try:
-        prompt = "Perform OCR. Extract the person's first name, last name, date of birth, and RAMQ number. Output JSON with keys: 'first_name', 'last_name', 'date_of_birth', and 'ramq'. If RAMQ is missing or unreadable set it to null and still return the other fields."
-
-        # Build the content for Gemini
-        contents = [
-            types.Content(
-                role="user",
-                parts=[
-                    types.Part.from_bytes(data=image_data, mime_type=content_type),
-                    types.Part.from_text(text=prompt),
-                ],
-            ),
-        ]
-
-        # Configure the generation
-        config = types.GenerateContentConfig(
-            response_mime_type="application/json",
-        )
-
-        # Call Gemini API
-        message = gemini_client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=contents,
-            config=config,
-        )
-
-        response = message.text
-
-        # Parse the JSON response
-        parsed = json.loads(response)
-        # Handle both array and object formats from Gemini
-        data = parsed[0] if isinstance(parsed, list) else parsed
+def _parse_ramq_bytes_response(response: str):
+    """Turn a model response into the tuple returned by get_ramq_from_bytes."""
+    data = _person_data(response)
 
+    with metrics.stage("validate"):
         ramq = normalize_ramq(data.get("ramq"))
         extracted_dob = parse_date_string(data.get("date_of_birth"))
 
@@ -489,92 +815,42 @@ def get_ramq_from_bytes(image_data: bytes, content_type: str = "image/jpeg"):
         if ramq:
             ramq_dob, gender, is_valid = extract_birth_info_from_ramq(ramq)
             dob = ramq_dob or extracted_dob
+            metrics.record_validation("ramq", is_valid)
 
-        person_info = PersonInfo(
-            first_name=data["first_name"],
-            last_name=data["last_name"],
-            date_of_birth=dob,
-            gender=gender,
-            ramq=ramq
-        )
-
-        return (
-            person_info.ramq,
-            person_info.last_name,
-            person_info.first_name,
-            person_info.date_of_birth,
-            person_info.gender,
-            is_valid
-        )
-    except Exception as e:
-        raise ValueError(f"Error processing image: {str(e)}") from e
+    person_info = PersonInfo(
+        first_name=data["first_name"],
+        last_name=data["last_name"],
+        date_of_birth=dob,
+        gender=gender,
+        ramq=ramq
+    )
 
+    return (
+        person_info.ramq,
+        person_info.last_name,
+        person_info.first_name,
+        person_info.date_of_birth,
+        person_info.gender,
+        is_valid
+    )
 
-def get_patient_list(input_data: str, is_image: bool = True, additional_prompt: str = ""):
-    base_prompt = "Extract a list of patients from the image or text. For each patient, provide their first name and last name. If available, also include their patient number and room number. Output as JSON with a 'patients' key containing a list of patient objects. Each patient object should have keys: first_name, last_name, and optionally patient_number and room_number. "
-    prompt = base_prompt + additional_prompt
 
-    if is_image:
+def _parse_patient_list_response(response: str) -> PatientList:
+    with metrics.stage("parse"):
         try:
-            # Get image data
-            image_response = httpx.get(input_data)
-            image_data = image_response.content
-            content_type = image_response.headers.get('content-type', 'image/jpeg')
-
-            # Build the content for Gemini
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part.from_bytes(data=image_data, mime_type=content_type),
-                        types.Part.from_text(text=prompt),
-                    ],
-                ),
-            ]
-
-            # Configure the generation
-            config = types.GenerateContentConfig(
-                response_mime_type="application/json",
-            )
+            patient_list = PatientList.model_validate_json(response)
+        except ValidationError:
+            return _parse_patient_list_fallback(response)
 
-            # Call Gemini API
-            message = gemini_client.models.generate_content(
-                model=GEMINI_MODEL,
-                contents=contents,
-                config=config,
-            )
-            response = message.text
+    for patient in patient_list.patients:
+        # Only keep room_number if it is not empty (already stripped)
+        if patient.room_number == "":
+            patient.room_number = None
+    return patient_list
 
-        except Exception as e:
-            raise ValueError(f"Error processing image: {str(e)}")
-    else:
-        # Text-only message
-        full_prompt = f"{prompt} Here is the text: {input_data}"
-
-        # Build the content for Gemini
-        contents = [
-            types.Content(
-                role="user",
-                parts=[
-                    types.Part.from_text(text=full_prompt),
-                ],
-            ),
-        ]
-
-        # Configure the generation
-        config = types.GenerateContentConfig(
-            response_mime_type="application/json",
-        )
-
-        # Call Gemini API
-        message = gemini_client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=contents,
-            config=config,
-        )
-        response = message.text
-
-    # Parse the JSON response
+
+def _parse_patient_list_fallback(response: str) -> PatientList:
+    """Lenient parser for responses that are not schema-shaped."""
     try:
         # Remove any leading/trailing whitespace and ensure we have valid JSON
         cleaned_response = response.strip()
@@ -609,3 +885,690 @@ def get_patient_list(input_data: str, is_image: bool = True, additional_prompt:
         return PatientList(patients=patients)
     except json.JSONDecodeError as e:
         raise ValueError(f"Failed to parse response as JSON: {str(e)}\nResponse was: {response}")
+
+
+def configure_extraction_cache(cache: Optional[ExtractionCache]) -> None:
+    """Replace the response cache used by get_ramq (None disables caching)."""
+    global extraction_cache
+    extraction_cache = cache
+
+
+def _cache_lookup(cache_key: str) -> Optional[str]:
+    if extraction_cache is None:
+        return None
+    response = extraction_cache.get(cache_key)
+    metrics.record_cache_lookup(response is not None)
+    return response
+
+
+def _cache_store(cache_key: str, response: str) -> None:
+    if extraction_cache is not None:
+        extraction_cache.set(cache_key, response)
+
+
+def set_resolution_controller(controller: ResolutionController) -> None:
+    """Replace the controller choosing the width card images are sent at."""
+    global resolution_controller
+    resolution_controller = controller
+
+
+def _needs_resolution_retry(response: str) -> bool:
+    """True when the response holds a RAMQ that fails its check digit."""
+    try:
+        ramq = normalize_ramq(_person_data(response).get("ramq"))
+    except (AttributeError, IndexError, TypeError, ValueError):
+        # Unparseable responses are reported by the caller's own parse
+        return False
+    return ramq is not None and not validate_ramq(ramq)
+
+
+def _record_resolution_retry(retry_response: str) -> None:
+    recovered = not _needs_resolution_retry(retry_response)
+    resolution_controller.record_retry(recovered)
+    metrics.RESOLUTION_RETRIES_TOTAL.labels("recovered" if recovered else "failed").inc()
+
+
+def _record_repair(result: str) -> None:
+    metrics.RAMQ_REPAIRS_TOTAL.labels(result).inc()
+
+
+def _local_repair(response: str) -> Tuple[str, Optional[dict]]:
+    """Fix an invalid RAMQ in a response from the card's own data.
+
+    Returns (response, data). data is the parsed person when the RAMQ is
+    still invalid and worth a re-query, otherwise None.
+    """
+    try:
+        data = _person_data(response)
+        raw_ramq = data.get("ramq")
+    except (AttributeError, IndexError, TypeError, ValueError):
+        return response, None
+    if not raw_ramq:
+        return response, None
+    ramq = normalize_ramq(raw_ramq)
+    if ramq is not None and validate_ramq(ramq):
+        return response, None
+
+    repaired = repair_ramq(raw_ramq, data.get("last_name"), data.get("first_name"),
+                           parse_date_string(data.get("date_of_birth")))
+    if repaired is None:
+        return response, data
+    _record_repair("local")
+    return json.dumps(dict(data, ramq=repaired)), None
+
+
+def _merge_ramq_reading(response: str, data: dict, reading: str) -> str:
+    """Put a targeted RAMQ re-read into the response when it validates."""
+    try:
+        raw_ramq = RamqReading.model_validate_json(reading).ramq
+    except ValidationError:
+        raw_ramq = None
+    ramq = normalize_ramq(raw_ramq)
+    if ramq is None or not validate_ramq(ramq):
+        ramq = repair_ramq(raw_ramq, data.get("last_name"), data.get("first_name"),
+                           parse_date_string(data.get("date_of_birth")))
+    if ramq is None:
+        _record_repair("failed")
+        return response
+    _record_repair("requery")
+    return json.dumps(dict(data, ramq=ramq))
+
+
+def _ramq_image_read(image_data: bytes, width: int) -> str:
+    """One RAMQ_IMAGE_PROMPT call on the card resized to width."""
+    resized, content_type = preprocess_image(image_data, width=width)
+    return _generate(_image_contents(resized, content_type, RAMQ_IMAGE_PROMPT), PERSON_CONFIG)
+
+
+def get_ramq_from_image_at_width(image_data: bytes, width: int):
+    """The first read of get_ramq_from_image at a fixed width: no resolution retry, repair or cache.
+
+    Used by tests/bench_sizes.py to record the resolution curves with the
+    production prompt and preprocessing.
+    """
+    try:
+        response = _ramq_image_read(image_data, width)
+    except Exception as e:
+        raise ValueError(f"Error processing image: {str(e)}") from e
+    return _parse_ramq_response(response)
+
+
+def _ramq_image_response(image_data: bytes, repair: bool = False) -> str:
+    """Send a card at the controller's width, once more wider if the RAMQ is invalid.
+
+    With repair, an invalid RAMQ is first corrected locally (repair_ramq) and
+    only then re-read on its own from a wider image.
+    """
+    controller = resolution_controller
+    source_width, source_height = image_dimensions(image_data)
+    width = controller.choose_width(source_width, source_height)
+    metrics.RESOLUTION_WIDTH.labels("first").observe(width)
+    response = _ramq_image_read(image_data, width)
+
+    if repair:
+        response, unresolved = _local_repair(response)
+        if unresolved is not None:
+            requery_width = controller.retry_width(source_width, width) or width
+            metrics.RESOLUTION_WIDTH.labels("requery").observe(requery_width)
+            resized, content_type = preprocess_image(image_data, width=requery_width)
+            reading = _generate(_image_contents(resized, content_type, RAMQ_REQUERY_PROMPT), RAMQ_REQUERY_CONFIG)
+            response = _merge_ramq_reading(response, unresolved, reading)
+        return response
+
+    retry_width = _needs_resolution_retry(response) and controller.retry_width(source_width, width)
+    if retry_width:
+        metrics.RESOLUTION_WIDTH.labels("retry").observe(retry_width)
+        # The wider read is kept even if it still fails validation
+        response = _ramq_image_read(image_data, retry_width)
+        _record_resolution_retry(response)
+    return response
+
+
+async def _aramq_image_response(image_data: bytes, repair: bool = False) -> str:
+    """Async counterpart of _ramq_image_response; resizing runs off the event loop."""
+    controller = resolution_controller
+    source_width, source_height = image_dimensions(image_data)
+    width = controller.choose_width(source_width, source_height)
+    metrics.RESOLUTION_WIDTH.labels("first").observe(width)
+    resized, content_type = await asyncio.to_thread(preprocess_image, image_data, width=width)
+    response = await _agenerate(_image_contents(resized, content_type, RAMQ_IMAGE_PROMPT), PERSON_CONFIG)
+
+    if repair:
+        response, unresolved = _local_repair(response)
+        if unresolved is not None:
+            requery_width = controller.retry_width(source_width, width) or width
+            metrics.RESOLUTION_WIDTH.labels("requery").observe(requery_width)
+            resized, content_type = await asyncio.to_thread(preprocess_image, image_data, width=requery_width)
+            reading = await _agenerate(_image_contents(resized, content_type, RAMQ_REQUERY_PROMPT),
+                                       RAMQ_REQUERY_CONFIG)
+            response = _merge_ramq_reading(response, unresolved, reading)
+        return response
+
+    retry_width = _needs_resolution_retry(response) and controller.retry_width(source_width, width)
+    if retry_width:
+        metrics.RESOLUTION_WIDTH.labels("retry").observe(retry_width)
+        resized, content_type = await asyncio.to_thread(preprocess_image, image_data, width=retry_width)
+        response = await _agenerate(_image_contents(resized, content_type, RAMQ_IMAGE_PROMPT), PERSON_CONFIG)
+        _record_resolution_retry(response)
+    return response
+
+
+def _ramq_cache_prompt(prompt: str, repair: bool) -> str:
+    # Repaired responses are cached apart from plain ones
+    return prompt + "\0repair" if repair else prompt
+
+
+def _text_local_repair(response: str) -> str:
+    response, unresolved = _local_repair(response)
+    if unresolved is not None:
+        _record_repair("failed")
+    return response
+
+
+def _ramq_image_cached(image_data: bytes, repair: bool) -> Tuple[str, bool, str]:
+    """(response, cached, cache key) for a card image."""
+    cache_key = make_cache_key(image_data, _ramq_cache_prompt(RAMQ_IMAGE_PROMPT, repair), model_backend.model)
+    response = _cache_lookup(cache_key)
+    cached = response is not None
+    if not cached:
+        response = _ramq_image_response(image_data, repair)
+    return response, cached, cache_key
+
+
+def get_ramq(input_data, is_image=True, repair=None):
+    """Extract a person from a card image URL or from text.
+
+    With repair (default: RAMQ_REPAIR env), a RAMQ failing validation is
+    corrected locally when possible and otherwise re-read once by the model.
+    """
+    repair = RAMQ_REPAIR if repair is None else repair
+    if is_image:
+        try:
+            # Download image
+            image_data, _ = _download(input_data)
+            response, cached, cache_key = _ramq_image_cached(image_data, repair)
+        except Exception as e:
+            raise ValueError(f"Error processing image: {str(e)}")
+    else:
+        cache_key = make_cache_key(input_data, _ramq_cache_prompt(RAMQ_TEXT_PROMPT, repair), model_backend.model)
+        response = _cache_lookup(cache_key)
+        cached = response is not None
+        if not cached:
+            response = _generate(_text_contents(f"{RAMQ_TEXT_PROMPT} Here is the text: {input_data}"), PERSON_CONFIG)
+            if repair:
+                response = _text_local_repair(response)
+
+    result = _parse_ramq_response(response)
+    # Only responses that parse are worth replaying
+    if not cached:
+        _cache_store(cache_key, response)
+    return result
+
+
+def get_ramq_from_image(image_data: bytes, repair=None):
+    """get_ramq for card image bytes already in hand, e.g. an upload.
+
+    Same preprocessing, resolution choice, cache and result tuple as the URL
+    path, without the download.
+    """
+    repair = RAMQ_REPAIR if repair is None else repair
+    try:
+        response, cached, cache_key = _ramq_image_cached(image_data, repair)
+    except Exception as e:
+        raise ValueError(f"Error processing image: {str(e)}") from e
+    result = _parse_ramq_response(response)
+    if not cached:
+        _cache_store(cache_key, response)
+    return result
+
+
+RAMQ_BATCH_TEXT_PROMPT = "Each snippet below describes one person and starts with its id in square brackets. For every snippet extract the person's first name, last name, date of birth, RAMQ number (Quebec), OHIP number (Ontario), and MRN (Medical Record Number). Output a JSON array with exactly one object per snippet, with keys: 'id', 'first_name', 'last_name', 'date_of_birth', 'ramq', 'ohip', and 'mrn'. Set 'id' to the snippet id. If a value is missing or unreadable, set it to null. When RAMQ is present, normalize it to 4 letters followed by 8 digits with no spaces. When OHIP is present, include the 10 digits and optional 2-letter version code with no spaces. Do not include text outside the JSON array."
+
+# Rough prompt and response sizes used to pack text batches
+TEXT_BATCH_MAX_TOKENS = 8000
+TEXT_BATCH_MAX_ITEMS = 50
+_RESPONSE_TOKENS_PER_ITEM = 80
+
+
+class BatchPersonRecord(PersonExtraction):
+    id: str
+
+
+_BATCH_RECORDS = TypeAdapter(List[BatchPersonRecord])
+BATCH_TEXT_CONFIG = _json_config(list[BatchPersonRecord])
+
+
+def _estimate_tokens(text: str) -> int:
+    # About four characters per token for Latin text
+    return len(text) // 4 + 1
+
+
+def _pack_text_batches(snippets: List[str], max_tokens: int, max_items: int) -> List[List[int]]:
+    """Greedily group snippet indexes so each call stays within the token budget."""
+    budget = max_tokens - _estimate_tokens(RAMQ_BATCH_TEXT_PROMPT)
+    batches, current, used = [], [], 0
+    for index, snippet in enumerate(snippets):
+        cost = _estimate_tokens(snippet) + _RESPONSE_TOKENS_PER_ITEM
+        if current and (used + cost > budget or len(current) >= max_items):
+            batches.append(current)
+            current, used = [], 0
+        current.append(index)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _batch_position(snippet_id) -> int:
+    """Snippet position from a returned id such as "3" or "[3]" (-1 if unreadable)."""
+    try:
+        return int(str(snippet_id).strip("[] "))
+    except ValueError:
+        return -1
+
+
+def _extract_text_batch(snippets: List[str]) -> Dict[int, dict]:
+    """Run one packed call and return the extracted object per snippet position."""
+    lines = [f"[{position}] {' '.join(str(snippet).split())}" for position, snippet in enumerate(snippets)]
+    prompt = RAMQ_BATCH_TEXT_PROMPT + "\n\n" + "\n".join(lines)
+    response = _generate(_text_contents(prompt), BATCH_TEXT_CONFIG)
+
+    with metrics.stage("parse"):
+        try:
+            items = [record.model_dump() for record in _BATCH_RECORDS.validate_json(response)]
+        except ValidationError:
+            # Not schema-shaped: keep every record that still has a name
+            parsed = json.loads(response)
+            items = [parsed] if isinstance(parsed, dict) else parsed
+
+    results = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        position = _batch_position(item.get("id"))
+        if 0 <= position < len(snippets) and item.get("first_name") is not None:
+            results[position] = {key: value for key, value in item.items() if key != "id"}
+    return results
+
+
+def get_ramq_batch_text(snippets: List[str], max_tokens: int = TEXT_BATCH_MAX_TOKENS,
+                        max_items: int = TEXT_BATCH_MAX_ITEMS) -> list:
+    """Extract many text snippets with as few model calls as possible.
+
+    Snippets are packed into calls sized to the token budget, and the JSON
+    array the model returns is split back per snippet id. A batch whose
+    response cannot be parsed is split in half and retried; snippets still
+    missing afterwards, or from a batch whose call failed, fall back to a
+    single get_ramq call. Batch records are cached per snippet under the
+    batch prompt, apart from the single-snippet entries of get_ramq.
+
+    Returns:
+        One get_ramq-style tuple per snippet, in input order, or None for a
+        snippet whose single call also failed (e.g. no name in the text).
+    """
+    results = [None] * len(snippets)
+    keys = [make_cache_key(snippet, RAMQ_BATCH_TEXT_PROMPT, model_backend.model) for snippet in snippets]
+
+    pending = []
+    for index, key in enumerate(keys):
+        cached = _cache_lookup(key)
+        if cached is not None:
+            results[index] = _parse_ramq_response(cached)
+        else:
+            pending.append(index)
+
+    pending_snippets = [snippets[index] for index in pending]
+    queue = [[pending[i] for i in batch]
+             for batch in _pack_text_batches(pending_snippets, max_tokens, max_items)]
+    missing = []
+    while queue:
+        batch = queue.pop()
+        try:
+            extracted = _extract_text_batch([snippets[index] for index in batch])
+        except ValueError:
+            if len(batch) > 1:
+                # Likely a truncated response, retry with smaller calls
+                middle = len(batch) // 2
+                queue.extend([batch[:middle], batch[middle:]])
+            else:
+                missing.extend(batch)
+            continue
+        except Exception:
+            # Backend error: keep the finished batches, retry these one by one
+            missing.extend(batch)
+            continue
+
+        for position, index in enumerate(batch):
+            data = extracted.get(position)
+            try:
+                results[index] = _ramq_result_from_data(data)
+            except (AttributeError, KeyError, TypeError, ValueError):
+                # Dropped or incomplete record
+                missing.append(index)
+                continue
+            _cache_store(keys[index], json.dumps(data))
+
+    for index in sorted(missing):
+        try:
+            results[index] = get_ramq(snippets[index], is_image=False)
+        except Exception:
+            # One unusable snippet must not discard the rest of the batch
+            results[index] = None
+
+    return results
+
+
+def get_ramq_from_bytes(image_data: bytes, content_type: str = "image/jpeg"):
+    """
+    Extract RAMQ from image bytes directly (useful for testing different sizes).
+    """
+    try:
+        response = _generate(_image_contents(image_data, content_type, RAMQ_BYTES_PROMPT), PERSON_CONFIG)
+        return _parse_ramq_bytes_response(response)
+    except Exception as e:
+        raise ValueError(f"Error processing image: {str(e)}") from e
+
+
+def get_patient_list(input_data: str, is_image: bool = True, additional_prompt: str = ""):
+    prompt = PATIENT_LIST_PROMPT + additional_prompt
+
+    if is_image:
+        try:
+            # Get image data
+            image_data, content_type = _download(input_data)
+
+            response = _generate(_image_contents(image_data, content_type, prompt), PATIENT_LIST_CONFIG)
+        except Exception as e:
+            raise ValueError(f"Error processing image: {str(e)}")
+    else:
+        # Text-only message
+        response = _generate(_text_contents(f"{prompt} Here is the text: {input_data}"), PATIENT_LIST_CONFIG)
+
+    return _parse_patient_list_response(response)
+
+
+# Widest page image sent for documents, and pages sent per model call
+DOCUMENT_PAGE_WIDTH = int(os.environ.get("DOCUMENT_PAGE_WIDTH", "1600"))
+DOCUMENT_PAGES_PER_CALL = int(os.environ.get("DOCUMENT_PAGES_PER_CALL", "10"))
+
+
+def document_pages(document: bytes, width: Optional[int] = None) -> List[Tuple[bytes, str]]:
+    """Split a document into the (bytes, mime type) parts sent to the model.
+
+    PDFs are sent whole since the model reads them natively. Multi-frame
+    images (fax TIFFs, animated GIF/WebP) become one image per frame, and a
+    single photo, possibly of several cards, stays one image. Pages wider
+    than width (default DOCUMENT_PAGE_WIDTH) are downscaled.
+    """
+    width = width or DOCUMENT_PAGE_WIDTH
+    if document[:5] == b"%PDF-":
+        return [(document, "application/pdf")]
+
+    image = Image.open(BytesIO(document))
+    if getattr(image, "n_frames", 1) == 1:
+        return [preprocess_image(document, width=width)]
+
+    pages = []
+    for index in range(image.n_frames):
+        image.seek(index)
+        # Bilevel and grayscale scans stay grayscale and compress best as PNG
+        grayscale = image.mode in ("1", "L", "I;16")
+        with metrics.stage("decode"):
+            frame = image.convert("L" if grayscale else "RGB")
+        if frame.width > width:
+            with metrics.stage("resize"):
+                frame = frame.resize((width, max(1, round(frame.height * width / frame.width))), Image.LANCZOS)
+        buffer = BytesIO()
+        with metrics.stage("encode"):
+            if grayscale:
+                frame.save(buffer, format="PNG", optimize=False)
+            else:
+                frame.save(buffer, format="JPEG", quality=85)
+        pages.append((buffer.getvalue(), "image/png" if grayscale else "image/jpeg"))
+    return pages
+
+
+def _document_chunks(pages: List[Tuple[bytes, str]]) -> List[Tuple[int, List[Tuple[bytes, str]]]]:
+    """(first page number, pages) for each model call."""
+    size = max(1, DOCUMENT_PAGES_PER_CALL)
+    return [(start + 1, pages[start:start + size]) for start in range(0, len(pages), size)]
+
+
+def _document_contents(first_page: int, chunk: List[Tuple[bytes, str]]) -> list:
+    parts = []
+    for number, (data, content_type) in enumerate(chunk, first_page):
+        if content_type != "application/pdf":
+            parts.append(types.Part.from_text(text=f"Page {number}:"))
+        parts.append(types.Part.from_bytes(data=data, mime_type=content_type))
+    parts.append(types.Part.from_text(text=DOCUMENT_PROMPT))
+    return [types.Content(role="user", parts=parts)]
+
+
+def _document_cache_key(document: bytes, first_page: int) -> str:
+    prompt = f"{DOCUMENT_PROMPT}\0{first_page}\0{DOCUMENT_PAGES_PER_CALL}\0{DOCUMENT_PAGE_WIDTH}"
+    return make_cache_key(document, prompt, model_backend.model)
+
+
+def _normalized_bbox(box_2d) -> Optional[Tuple[float, float, float, float]]:
+    """Model [ymin, xmin, ymax, xmax] on a 0-1000 grid to (x_min, y_min, x_max, y_max) fractions."""
+    if not box_2d or len(box_2d) != 4:
+        return None
+    y_min, x_min, y_max, x_max = (min(max(value, 0), 1000) / 1000 for value in box_2d)
+    if x_max <= x_min or y_max <= y_min:
+        return None
+    return x_min, y_min, x_max, y_max
+
+
+def _document_people(response: str) -> List[DocumentPersonExtraction]:
+    try:
+        return DocumentExtraction.model_validate_json(response).people
+    except ValidationError:
+        pass
+    # Lenient path: a bare list, or entries the schema rejects are skipped
+    data = json.loads(response)
+    items = data.get("people", []) if isinstance(data, dict) else data
+    people = []
+    for item in items if isinstance(items, list) else []:
+        try:
+            people.append(DocumentPersonExtraction.model_validate(item))
+        except ValidationError:
+            continue
+    return people
+
+
+def _parse_document_response(response: str, first_page: int, page_count: Optional[int]) -> List[DocumentPerson]:
+    """DocumentPerson records of one call; page_count is None for PDFs."""
+    with metrics.stage("parse"):
+        people = _document_people(response)
+    results = []
+    for person in people:
+        (ramq, last_name, first_name, dob, gender, valid_ramq, mrn,
+         ohip, valid_ohip, _, _) = _ramq_result_from_data(person.__dict__)
+        page = person.page or first_page
+        if page_count is not None and not first_page <= page < first_page + page_count:
+            # Page numbers relative to the call instead of the labels
+            page = first_page + min(max(page, 1), page_count) - 1
+        results.append(DocumentPerson(
+            first_name=first_name, last_name=last_name, date_of_birth=dob, gender=gender,
+            ramq=ramq, ohip=ohip, mrn=mrn, page=max(page, 1), bbox=_normalized_bbox(person.box_2d),
+            valid_ramq=valid_ramq, valid_ohip=valid_ohip,
+        ))
+    return results
+
+
+def _document_chunk_result(document: bytes, first_page: int, chunk, generate) -> List[DocumentPerson]:
+    cache_key = _document_cache_key(document, first_page)
+    response = _cache_lookup(cache_key)
+    cached = response is not None
+    if not cached:
+        response = generate(_document_contents(first_page, chunk), DOCUMENT_CONFIG)
+    page_count = None if chunk[0][1] == "application/pdf" else len(chunk)
+    results = _parse_document_response(response, first_page, page_count)
+    if not cached:
+        _cache_store(cache_key, response)
+    return results
+
+
+def get_people_from_document(document) -> List[DocumentPerson]:
+    """Extract every person from a multi-card photo or a multi-page PDF/TIFF.
+
+    Args:
+        document: Document URL, or the document bytes
+
+    Pages are sent DOCUMENT_PAGES_PER_CALL at a time (a PDF in a single
+    call). Returns one DocumentPerson per card or identity block found, with
+    its page number and bounding box, in page order.
+    """
+    try:
+        if isinstance(document, str):
+            document, _ = _download_document(document)
+        pages = document_pages(document)
+        results = []
+        for first_page, chunk in _document_chunks(pages):
+            results.extend(_document_chunk_result(document, first_page, chunk, _generate))
+    except Exception as e:
+        raise ValueError(f"Error processing document: {str(e)}") from e
+    return sorted(results, key=lambda person: person.page)
+
+
+class _AsyncResources:
+    """HTTP client and concurrency limit bound to one event loop."""
+
+    def __init__(self, limit: int):
+        self.http_client = new_async_http_client()
+        self.semaphore = asyncio.Semaphore(limit)
+
+
+def _async_resources() -> _AsyncResources:
+    # httpx.AsyncClient and asyncio.Semaphore must not be shared across event
+    # loops, so each running loop gets its own pair.
+    loop = asyncio.get_running_loop()
+    resources = _async_resources_by_loop.get(loop)
+    if resources is None:
+        resources = _AsyncResources(EXTRACTION_CONCURRENCY)
+        _async_resources_by_loop[loop] = resources
+    return resources
+
+
+def set_extraction_concurrency(limit: int) -> None:
+    """Set how many async extractions may be in flight per event loop."""
+    global EXTRACTION_CONCURRENCY
+    if limit < 1:
+        raise ValueError("Concurrency limit must be at least 1")
+    EXTRACTION_CONCURRENCY = limit
+    for resources in _async_resources_by_loop.values():
+        resources.semaphore = asyncio.Semaphore(limit)
+
+
+async def aclose_async_clients() -> None:
+    """Close the async HTTP client bound to the running event loop."""
+    resources = _async_resources_by_loop.pop(asyncio.get_running_loop(), None)
+    if resources is not None:
+        await resources.http_client.aclose()
+
+
+async def _aramq_image_cached(image_data: bytes, repair: bool) -> Tuple[str, bool, str]:
+    cache_key = make_cache_key(image_data, _ramq_cache_prompt(RAMQ_IMAGE_PROMPT, repair), model_backend.model)
+    response = _cache_lookup(cache_key)
+    cached = response is not None
+    if not cached:
+        response = await _aramq_image_response(image_data, repair)
+    return response, cached, cache_key
+
+
+async def aget_ramq(input_data, is_image=True, repair=None):
+    """Async version of get_ramq, limited to EXTRACTION_CONCURRENCY in flight."""
+    repair = RAMQ_REPAIR if repair is None else repair
+    resources = _async_resources()
+    async with resources.semaphore:
+        if is_image:
+            try:
+                image_data, _ = await _adownload(input_data, resources.http_client)
+                response, cached, cache_key = await _aramq_image_cached(image_data, repair)
+            except Exception as e:
+                raise ValueError(f"Error processing image: {str(e)}")
+        else:
+            cache_key = make_cache_key(input_data, _ramq_cache_prompt(RAMQ_TEXT_PROMPT, repair), model_backend.model)
+            response = _cache_lookup(cache_key)
+            cached = response is not None
+            if not cached:
+                response = await _agenerate(_text_contents(f"{RAMQ_TEXT_PROMPT} Here is the text: {input_data}"), PERSON_CONFIG)
+                if repair:
+                    response = _text_local_repair(response)
+
+    result = _parse_ramq_response(response)
+    if not cached:
+        _cache_store(cache_key, response)
+    return result
+
+
+async def aget_ramq_from_image(image_data: bytes, repair=None):
+    """Async version of get_ramq_from_image."""
+    repair = RAMQ_REPAIR if repair is None else repair
+    async with _async_resources().semaphore:
+        try:
+            response, cached, cache_key = await _aramq_image_cached(image_data, repair)
+        except Exception as e:
+            raise ValueError(f"Error processing image: {str(e)}") from e
+    result = _parse_ramq_response(response)
+    if not cached:
+        _cache_store(cache_key, response)
+    return result
+
+
+async def aget_ramq_from_bytes(image_data: bytes, content_type: str = "image/jpeg"):
+    """Async version of get_ramq_from_bytes."""
+    async with _async_resources().semaphore:
+        try:
+            response = await _agenerate(_image_contents(image_data, content_type, RAMQ_BYTES_PROMPT), PERSON_CONFIG)
+            return _parse_ramq_bytes_response(response)
+        except Exception as e:
+            raise ValueError(f"Error processing image: {str(e)}") from e
+
+
+async def aget_patient_list(input_data: str, is_image: bool = True, additional_prompt: str = ""):
+    """Async version of get_patient_list."""
+    prompt = PATIENT_LIST_PROMPT + additional_prompt
+    resources = _async_resources()
+
+    async with resources.semaphore:
+        if is_image:
+            try:
+                image_data, content_type = await _adownload(input_data, resources.http_client)
+
+                response = await _agenerate(_image_contents(image_data, content_type, prompt), PATIENT_LIST_CONFIG)
+            except Exception as e:
+                raise ValueError(f"Error processing image: {str(e)}")
+        else:
+            response = await _agenerate(_text_contents(f"{prompt} Here is the text: {input_data}"), PATIENT_LIST_CONFIG)
+
+    return _parse_patient_list_response(response)
+
+
+async def aget_people_from_document(document) -> List[DocumentPerson]:
+    """Async version of get_people_from_document; page chunks are sent concurrently."""
+    resources = _async_resources()
+    try:
+        if isinstance(document, str):
+            async with resources.semaphore:
+                document, _ = await _adownload_document(document, resources.http_client)
+        pages = await asyncio.to_thread(document_pages, document)
+
+        async def chunk_result(first_page, chunk):
+            async with resources.semaphore:
+                cache_key = _document_cache_key(document, first_page)
+                response = _cache_lookup(cache_key)
+                cached = response is not None
+                if not cached:
+                    response = await _agenerate(_document_contents(first_page, chunk), DOCUMENT_CONFIG)
+            page_count = None if chunk[0][1] == "application/pdf" else len(chunk)
+            results = _parse_document_response(response, first_page, page_count)
+            if not cached:
+                _cache_store(cache_key, response)
+            return results
+
+        chunk_results = await asyncio.gather(*(chunk_result(first_page, chunk)
+                                               for first_page, chunk in _document_chunks(pages)))
+    except Exception as e:
+        raise ValueError(f"Error processing document: {str(e)}") from e
+    return sorted((person for results in chunk_results for person in results), key=lambda person: person.page)
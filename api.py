@@ -1,14 +1,118 @@
+import asyncio
+import codecs
+import json
+import mmap
 import os
-import re
-from flask import Flask,jsonify,request
-from anthropic_vision_script import get_ramq, validate_ramq, validate_ohip, normalize_ohip
+import tempfile
+import threading
+import time
+from typing import Union
+from flask import Flask,Response,g,jsonify,request,stream_with_context
+import job_queue as job_queue_module
+import metrics
+import patient_registry
+import rate_limiter
+from dotenv import load_dotenv
+from validators import (RAMQ_REASON_FORMAT, RAMQ_REASON_LENGTH, check_ohip, check_ramq, normalize_ohip,
+                        parse_date_string, score_ramq_consistency)
+
+load_dotenv()
 
 app = Flask(__name__)
 
+# Event loop shared by all request threads of this process; extraction
+# coroutines run there so many Gemini-bound requests overlap
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def _extraction_loop():
+    global _loop, _loop_pid
+    with _loop_lock:
+        # Worker processes forked by gunicorn start their own loop thread
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name="extraction-loop", daemon=True).start()
+        return _loop
+
+
+# The extraction module (Gemini client, Pillow, pydantic) is imported by the
+# first extraction request, so workers start and serve validation without it
+def _extraction():
+    import anthropic_vision_script
+    return anthropic_vision_script
+
+
+async def aget_ramq(input_data, is_image=True, repair=None):
+    return await _extraction().aget_ramq(input_data, is_image, repair=repair)
+
+
+async def aget_ramq_from_image(image_data, repair=None):
+    return await _extraction().aget_ramq_from_image(image_data, repair)
+
+
+async def aget_people_from_document(document):
+    return await _extraction().aget_people_from_document(document)
+
+
+def run_async(coro, priority=rate_limiter.INTERACTIVE):
+    """Run a coroutine on the shared extraction loop and wait for its result.
+
+    Model calls made by the coroutine are queued for quota at this priority.
+    A call shed by the rate limiter raises RateLimitExceeded, even when the
+    extraction function wrapped it in a ValueError.
+    """
+    future = asyncio.run_coroutine_threadsafe(rate_limiter.with_priority(priority, coro), _extraction_loop())
+    try:
+        return future.result()
+    except Exception as e:
+        cause = e
+        while cause is not None:
+            if isinstance(cause, rate_limiter.RateLimitExceeded):
+                raise cause from None
+            cause = cause.__cause__ or cause.__context__
+        raise
+
+
+def _quota_response(error: rate_limiter.RateLimitExceeded):
+    response = jsonify({"error": str(error)})
+    response.headers["Retry-After"] = str(max(1, int(error.retry_after + 0.999)))
+    return response, 503
+
+RAMQ_FORMAT_ERROR = "Invalid RAMQ format. Must be 4 letters followed by 8 digits"
+BATCH_READ_SIZE = 64 * 1024
+# Longest single value accepted in a streamed JSON array
+BATCH_MAX_ITEM_CHARS = 64 * 1024
+# A value or decode error this close to the end of the buffer may be cut by a chunk boundary
+_JSON_TRUNCATION_SLACK = 16
+# Uploads above UPLOAD_SPOOL_BYTES are received into a memory-mapped temp file instead of memory
+UPLOAD_MAX_BYTES = int(float(os.environ.get('UPLOAD_MAX_MB', '20')) * 1024 * 1024)
+UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_BYTES', str(1024 * 1024)))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    metrics.ensure_snapshot_writer()
+
+
+@app.after_request
+def observe_request(response):
+    # Streaming responses are timed up to the first byte
+    start = g.get("request_start")
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.REQUEST_SECONDS.labels(endpoint, str(response.status_code)).observe(time.perf_counter() - start)
+    return response
+
+
 @app.before_request
 def check_token():
     if request.path == "/":
         return
+    if request.path == "/metrics" and os.environ.get('METRICS_PUBLIC') == '1':
+        return
     token = request.headers.get('RAMQ-Billr-API-Key')
     headerToken = os.environ.get('HEADER_TOKEN')
     if token is None or token != headerToken:
@@ -19,51 +123,80 @@ def check_token():
 def hello():
     return jsonify(alive='true')
 
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render_latest(), content_type=metrics.CONTENT_TYPE)
+
+def _extraction_input(request_data):
+    """(input_data, is_image, repair) from an extraction request body, or an error message."""
+    is_image = request_data.get('is_image')
+    image_url = request_data.get('image_url')
+    text = request_data.get('text')
+    repair = request_data.get('repair')
+
+    if is_image is None:
+        return None, "Missing 'is_image' field in request"
+
+    if is_image and not image_url:
+        return None, "Missing 'image_url' field for image processing"
+
+    if not is_image and not text:
+        return None, "Missing 'text' field for text processing"
+
+    input_data = text
+    if is_image:
+        input_data = image_url
+    return (input_data, is_image, repair), None
+
+
+def _extraction_body(result) -> dict:
+    """JSON body of an extraction, as returned by /extract_json_from_image and /jobs."""
+    (ramq, last_name, first_name, dob, gender, valid_ramq, mrn,
+     ohip, valid_ohip, insurance_type, insurance_id) = result
+
+    # Format date correctly
+    formatted_date = dob.strftime("%Y-%m-%d") if dob else None
+
+    body = {
+        "ramq": ramq,
+        "ohip": ohip,
+        "insurance_type": insurance_type,
+        "insurance_id": insurance_id,
+        "last_name": last_name,
+        "first_name": first_name,
+        "dob": formatted_date,
+        "gender": gender,
+        "valid_ramq": valid_ramq,
+        "ramq_name_match": score_ramq_consistency(ramq, last_name, first_name).name_match if valid_ramq else None,
+        "valid_ohip": valid_ohip,
+        "mrn": mrn
+    }
+    registry = patient_registry.get_registry()
+    if registry is not None:
+        with metrics.stage("registry_lookup"):
+            match = registry.match(ramq if valid_ramq else None, ohip if valid_ohip else None, mrn)
+        body["registry_match"] = None if match is None else {"matched_on": match[0], "record": match[1]}
+    return body
+
+
 @app.route('/extract_json_from_image',methods=['POST'])
 def extract_json_from_image():
     try:
         request_data = request.get_json()
         if not request_data:
             return jsonify({"error": "Invalid or missing JSON in request body"}), 400
-            
-        is_image = request_data.get('is_image')
-        image_url = request_data.get('image_url')
-        text = request_data.get('text')
-        
-        if is_image is None:
-            return jsonify({"error": "Missing 'is_image' field in request"}), 400
-        
-        if is_image and not image_url:
-            return jsonify({"error": "Missing 'image_url' field for image processing"}), 400
-            
-        if not is_image and not text:
-            return jsonify({"error": "Missing 'text' field for text processing"}), 400
 
-        input_data = text
-        if is_image:
-            input_data = image_url
+        extraction, error = _extraction_input(request_data)
+        if error:
+            return jsonify({"error": error}), 400
 
         try:
-            (ramq, last_name, first_name, dob, gender, valid_ramq, mrn,
-             ohip, valid_ohip, insurance_type, insurance_id) = get_ramq(input_data, is_image)
-
-            # Format date correctly
-            formatted_date = dob.strftime("%Y-%m-%d") if dob else None
-
-            return jsonify({
-                "ramq": ramq,
-                "ohip": ohip,
-                "insurance_type": insurance_type,
-                "insurance_id": insurance_id,
-                "last_name": last_name,
-                "first_name": first_name,
-                "dob": formatted_date,
-                "gender": gender,
-                "valid_ramq": valid_ramq,
-                "valid_ohip": valid_ohip,
-                "mrn": mrn
-            })
+            input_data, is_image, repair = extraction
+            return jsonify(_extraction_body(run_async(aget_ramq(input_data, is_image, repair=repair))))
 
+        except rate_limiter.RateLimitExceeded as e:
+            return _quota_response(e)
         except ValueError as e:
             print(f"Error processing data: {str(e)}", flush=True)
             return jsonify({"error": str(e)}), 500
@@ -76,6 +209,191 @@ def extract_json_from_image():
         return jsonify({"error": "An error occurred while processing the request"}), 500
 
 
+class UploadTooLarge(ValueError):
+    pass
+
+
+def _read_upload(stream) -> Union[bytes, memoryview]:
+    """Receive an upload body, enforcing UPLOAD_MAX_BYTES.
+
+    Bodies up to UPLOAD_SPOOL_BYTES are returned as bytes. Larger ones are
+    written to an unlinked temp file and returned as a read-only memoryview of
+    its memory map, which the extraction reads and hashes in place; the map is
+    released with the last reference to the view.
+    """
+    chunks, size, spill = [], 0, None
+    try:
+        while True:
+            chunk = stream.read(BATCH_READ_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > UPLOAD_MAX_BYTES:
+                raise UploadTooLarge(f"Upload larger than {UPLOAD_MAX_BYTES} bytes")
+            if spill is None and size > UPLOAD_SPOOL_BYTES:
+                spill = tempfile.TemporaryFile()
+                spill.writelines(chunks)
+                chunks = None
+            if spill is None:
+                chunks.append(chunk)
+            else:
+                spill.write(chunk)
+        if spill is None:
+            return b"".join(chunks)
+        spill.flush()
+        return memoryview(mmap.mmap(spill.fileno(), 0, access=mmap.ACCESS_READ))
+    finally:
+        if spill is not None:
+            # The map keeps its own handle on the file
+            spill.close()
+
+
+def _flag(value):
+    if value is None:
+        return None
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+@app.route('/extract_upload', methods=['POST'])
+def extract_upload():
+    """Extract a card uploaded as the request body instead of an image URL.
+
+    Accepts multipart/form-data (file field 'image') or the raw image with an
+    image/* or application/octet-stream content type. Returns the same body
+    as /extract_json_from_image.
+    """
+    if request.content_length is not None and request.content_length > UPLOAD_MAX_BYTES:
+        return jsonify({"error": f"Upload larger than {UPLOAD_MAX_BYTES} bytes"}), 413
+
+    try:
+        if request.mimetype == 'multipart/form-data':
+            # Werkzeug already spools file parts to disk while parsing the form
+            upload = request.files.get('image') or next(iter(request.files.values()), None)
+            if upload is None:
+                return jsonify({"error": "Missing 'image' file in multipart upload"}), 400
+            image_data = _read_upload(upload.stream)
+            repair = _flag(request.form.get('repair'))
+        elif request.mimetype == 'application/octet-stream' or request.mimetype.startswith('image/'):
+            image_data = _read_upload(request.stream)
+            repair = _flag(request.args.get('repair'))
+        else:
+            return jsonify({"error": "Upload as multipart/form-data, image/* or application/octet-stream"}), 415
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+
+    if not image_data:
+        return jsonify({"error": "Empty upload"}), 400
+    metrics.observe_bytes("upload", len(image_data))
+
+    try:
+        return jsonify(_extraction_body(run_async(aget_ramq_from_image(image_data, repair))))
+    except rate_limiter.RateLimitExceeded as e:
+        return _quota_response(e)
+    except ValueError as e:
+        print(f"Error processing upload: {str(e)}", flush=True)
+        return jsonify({"error": str(e)}), 500
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}", flush=True)
+        return jsonify({"error": "An unexpected error occurred during processing"}), 500
+
+
+def run_extraction_job(payload: dict) -> dict:
+    """job_queue handler: the /extract_json_from_image body for a queued request."""
+    extraction, error = _extraction_input(payload)
+    if error:
+        raise ValueError(error)
+    input_data, is_image, repair = extraction
+    return _extraction_body(run_async(aget_ramq(input_data, is_image, repair=repair), rate_limiter.BACKGROUND))
+
+
+_job_queue = None
+_job_runner = None
+_job_pid = None
+_job_lock = threading.Lock()
+
+
+def job_queue():
+    """This process's job queue, with its runner threads started on first use."""
+    global _job_queue, _job_runner, _job_pid
+    if _job_pid == os.getpid():
+        return _job_queue
+    with _job_lock:
+        if _job_pid != os.getpid():
+            # sqlite connections and threads do not survive a fork
+            _job_queue = job_queue_module.queue_from_env()
+            _job_runner = job_queue_module.runner_from_env(_job_queue, run_extraction_job)
+            _job_runner.start()
+            _job_pid = os.getpid()
+        return _job_queue
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue an extraction and answer at once; poll GET /jobs/<id> or pass a webhook."""
+    request_data = request.get_json(silent=True)
+    if not request_data:
+        return jsonify({"error": "Invalid or missing JSON in request body"}), 400
+    _, error = _extraction_input(request_data)
+    if error:
+        return jsonify({"error": error}), 400
+    webhook = request_data.get('webhook')
+    if webhook is not None and not str(webhook).startswith(("http://", "https://")):
+        return jsonify({"error": "'webhook' must be an http(s) URL"}), 400
+
+    payload = {key: request_data.get(key) for key in ('is_image', 'image_url', 'text', 'repair')}
+    job_id = job_queue().submit(payload, webhook)
+    response = jsonify({"id": job_id, "status": job_queue_module.QUEUED})
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response, 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job_queue_module.public_view(job))
+
+
+@app.route('/extract_document', methods=['POST'])
+def extract_document():
+    """Every person on a multi-card photo or a multi-page PDF/TIFF."""
+    request_data = request.get_json(silent=True)
+    if not request_data:
+        return jsonify({"error": "Invalid or missing JSON in request body"}), 400
+    document_url = request_data.get('document_url')
+    if not document_url:
+        return jsonify({"error": "Missing 'document_url' field in request"}), 400
+
+    try:
+        people = run_async(aget_people_from_document(document_url))
+    except rate_limiter.RateLimitExceeded as e:
+        return _quota_response(e)
+    except ValueError as e:
+        print(f"Error processing document: {str(e)}", flush=True)
+        return jsonify({"error": str(e)}), 500
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}", flush=True)
+        return jsonify({"error": "An unexpected error occurred during processing"}), 500
+
+    return jsonify({"people": [
+        {
+            "page": person.page,
+            "bbox": list(person.bbox) if person.bbox else None,
+            "ramq": person.ramq,
+            "ohip": person.ohip,
+            "last_name": person.last_name,
+            "first_name": person.first_name,
+            "dob": person.date_of_birth.strftime("%Y-%m-%d") if person.date_of_birth else None,
+            "gender": person.gender,
+            "valid_ramq": person.valid_ramq,
+            "valid_ohip": person.valid_ohip,
+            "mrn": person.mrn,
+        }
+        for person in people
+    ]})
+
+
 @app.route('/validate_ramq', methods=['GET'])
 def ramq_validation():
     try:
@@ -84,12 +402,25 @@ def ramq_validation():
             return jsonify({"error": "Missing ramq query parameter"}), 400
             
         # Validate RAMQ format first
-        if not re.match(r"^[A-Z]{4}\d{8}$", ramq):
-            return jsonify({"error": "Invalid RAMQ format. Must be 4 letters followed by 8 digits", "valid": False}), 400
+        check = check_ramq(ramq)
+        if check.reason in (RAMQ_REASON_LENGTH, RAMQ_REASON_FORMAT):
+            metrics.record_validation("ramq", False, source="api")
+            return jsonify({"error": RAMQ_FORMAT_ERROR, "valid": False}), 400
             
         try:
-            valid_ramq = validate_ramq(ramq)
-            return jsonify({"valid": valid_ramq})
+            valid_ramq = check.valid
+            metrics.record_validation("ramq", valid_ramq, source="api")
+            result = {"valid": valid_ramq}
+            # Optional cross-check against the name, birth date and sex on file
+            last_name = request.args.get('last_name')
+            first_name = request.args.get('first_name')
+            if last_name and first_name:
+                consistency = score_ramq_consistency(ramq, last_name, first_name,
+                                                     parse_date_string(request.args.get('dob')),
+                                                     request.args.get('sex'))
+                result["consistent"] = consistency.consistent
+                result["consistency"] = consistency._asdict()
+            return jsonify(result)
         except Exception as e:
             print(f"RAMQ validation error: {str(e)}", flush=True)
             return jsonify({"error": str(e), "valid": False}), 500
@@ -107,6 +438,7 @@ def ohip_validation():
             return jsonify({"error": "Missing ohip query parameter"}), 400
 
         result = normalize_ohip(ohip)
+        metrics.record_validation("ohip", result is not None, source="api")
         if result is None:
             return jsonify({"valid": False, "number": None, "version_code": None})
 
@@ -121,5 +453,121 @@ def ohip_validation():
         return jsonify({"error": "An error occurred while processing the request"}), 500
 
 
+def _iter_json_array(stream):
+    """Yield the items of a JSON array read incrementally from a byte stream."""
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer, pos, eof = "", 0, False
+    expecting = "start"
+
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+
+        if pos >= len(buffer) or expecting == "more":
+            if eof:
+                raise ValueError("Unterminated JSON array")
+            if len(buffer) - pos > BATCH_MAX_ITEM_CHARS:
+                raise ValueError("JSON array value too large")
+            buffer, pos = buffer[pos:], 0
+            chunk = stream.read(BATCH_READ_SIZE)
+            eof = not chunk
+            buffer += text_decoder.decode(chunk, final=eof)
+            expecting = "value" if expecting == "more" else expecting
+            continue
+
+        char = buffer[pos]
+        if expecting == "start":
+            if char != "[":
+                raise ValueError("Request body must be a JSON array")
+            pos += 1
+            expecting = "first"
+        elif expecting == "separator":
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' in JSON array, got {char!r}")
+            pos += 1
+            expecting = "value"
+        elif expecting == "first" and char == "]":
+            return
+        else:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # Only an error at the buffer edge (or an open string) can be
+                # fixed by reading more; anything else is malformed input
+                truncated = (e.msg.startswith("Unterminated string")
+                             or e.pos >= len(buffer) - _JSON_TRUNCATION_SLACK)
+                if eof or not truncated:
+                    raise ValueError("Invalid JSON value in array")
+                expecting = "more"
+                continue
+            # A value ending near the buffer edge may be a truncated number ("1." of "1.5")
+            if not eof and len(buffer) - end < _JSON_TRUNCATION_SLACK:
+                expecting = "more"
+                continue
+            yield value
+            pos = end
+            expecting = "separator"
+
+
+def _iter_batch_values():
+    """Yield values from a JSON array or newline-delimited request body.
+
+    The body is consumed in chunks so memory stays bounded regardless of size.
+    """
+    if request.mimetype == "application/json":
+        yield from _iter_json_array(request.stream)
+        return
+
+    for raw_line in request.stream:
+        line = raw_line.decode("utf-8").strip()
+        if line:
+            yield line
+
+
+def _stream_batch_results(validate):
+    """Stream one NDJSON line per input value, computed as the body is read."""
+    def generate():
+        try:
+            for value in _iter_batch_values():
+                yield json.dumps(validate(value)) + "\n"
+        except ValueError as e:
+            print(f"Batch validation error: {str(e)}", flush=True)
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def _ramq_batch_result(value):
+    if not isinstance(value, str):
+        result = {"ramq": value, "valid": False, "error": "RAMQ must be a string"}
+    else:
+        check = check_ramq(value)
+        result = {"ramq": value, "valid": check.valid}
+        if check.reason in (RAMQ_REASON_LENGTH, RAMQ_REASON_FORMAT):
+            result["error"] = RAMQ_FORMAT_ERROR
+    metrics.record_validation("ramq", result["valid"], source="api_batch")
+    return result
+
+
+def _ohip_batch_result(value):
+    check = check_ohip(value)
+    metrics.record_validation("ohip", check.valid, source="api_batch")
+    return check.to_dict()
+
+
+@app.route('/validate_ramq/batch', methods=['POST'])
+def ramq_batch_validation():
+    return _stream_batch_results(_ramq_batch_result)
+
+
+@app.route('/validate_ohip/batch', methods=['POST'])
+def ohip_batch_validation():
+    return _stream_batch_results(_ohip_batch_result)
+
+
 if __name__ == '__main__':
-    app.run(debug=True, port = 9000)
+    # Development only, production runs gunicorn with gunicorn.conf.py
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', port = 9000)
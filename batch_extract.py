@@ -0,0 +1,218 @@
+"""Batch patient-card extraction over directories, globs and URL lists.
+
+Every finished item is appended to an NDJSON checkpoint so an interrupted
+run resumes where it stopped; the output file (CSV, NDJSON or Parquet) is
+written from the checkpoint once all items are done.
+"""
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+import rate_limiter
+from anthropic_vision_script import get_ramq, get_ramq_from_image
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".tif", ".tiff", ".bmp"}
+OUTPUT_FORMATS = ("csv", "ndjson", "parquet")
+
+FIELDS = [
+    "source",
+    "ramq",
+    "last_name",
+    "first_name",
+    "dob",
+    "gender",
+    "valid_ramq",
+    "mrn",
+    "ohip",
+    "valid_ohip",
+    "insurance_type",
+    "insurance_id",
+    "error",
+]
+
+
+def _is_url(text: str) -> bool:
+    return text.startswith(("http://", "https://"))
+
+
+def collect_inputs(spec: str) -> List[str]:
+    """Expand a directory, glob pattern or file of URLs into item sources."""
+    if os.path.isdir(spec):
+        paths = []
+        for root, _, files in os.walk(spec):
+            paths.extend(os.path.join(root, name) for name in files)
+    elif any(char in spec for char in "*?["):
+        paths = glob.glob(spec, recursive=True)
+    elif os.path.isfile(spec):
+        with open(spec, "r", encoding="utf-8") as handle:
+            return [line.strip() for line in handle if line.strip() and not line.startswith("#")]
+    else:
+        raise ValueError(f"Batch input not found: {spec}")
+
+    return sorted(path for path in paths if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS)
+
+
+def extract_item(source: str) -> Dict:
+    """Extract one card from a URL (get_ramq) or a local file (get_ramq_from_image).
+
+    Both give the same record: the production prompt, preprocessing and
+    resolution choice, with OHIP and MRN. Model calls run at batch priority,
+    behind interactive intake sharing the quota.
+    """
+    record = dict.fromkeys(FIELDS)
+    record["source"] = source
+    try:
+        with rate_limiter.priority(rate_limiter.BATCH):
+            if _is_url(source):
+                extraction = get_ramq(source, is_image=True)
+            else:
+                with open(source, "rb") as handle:
+                    extraction = get_ramq_from_image(handle.read())
+        (record["ramq"], record["last_name"], record["first_name"], dob, record["gender"],
+         record["valid_ramq"], record["mrn"], record["ohip"], record["valid_ohip"],
+         record["insurance_type"], record["insurance_id"]) = extraction
+        record["dob"] = dob.strftime("%Y-%m-%d") if dob else None
+    except Exception as e:
+        record["error"] = str(e)
+    return record
+
+
+def load_checkpoint(path: str) -> Dict[str, Dict]:
+    """Return the latest checkpointed record per source."""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write leaves a truncated last line
+                continue
+            records[record["source"]] = record
+    return records
+
+
+def _parquet_modules():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet output requires pyarrow (pip install pyarrow)")
+    return pa, pq
+
+
+def write_output(records: List[Dict], path: str, fmt: str) -> None:
+    if fmt == "csv":
+        with open(path, "w", newline="", encoding="utf-8") as handle:
+            writer = csv.DictWriter(handle, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+    elif fmt == "ndjson":
+        with open(path, "w", encoding="utf-8") as handle:
+            for record in records:
+                handle.write(json.dumps(record) + "\n")
+    elif fmt == "parquet":
+        pa, pq = _parquet_modules()
+        columns = {field: [record.get(field) for record in records] for field in FIELDS}
+        pq.write_table(pa.table(columns), path)
+    else:
+        raise ValueError(f"Unknown output format: {fmt}")
+
+
+def output_format_for(path: str, fmt: Optional[str] = None) -> str:
+    """Resolve the output format, failing early if it cannot be written."""
+    if not fmt:
+        extension = os.path.splitext(path)[1].lower().lstrip(".")
+        if extension in ("jsonl", "json"):
+            fmt = "ndjson"
+        else:
+            fmt = extension if extension in OUTPUT_FORMATS else "csv"
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {fmt}")
+    if fmt == "parquet":
+        _parquet_modules()
+    return fmt
+
+
+class _Progress:
+    def __init__(self, total: int, stream=sys.stderr):
+        self.total = total
+        self.done = 0
+        self.errors = 0
+        self.start = time.perf_counter()
+        self.stream = stream
+        self.every = max(1, total // 100)
+
+    def update(self, record: Dict) -> None:
+        self.done += 1
+        self.errors += record["error"] is not None
+        if self.done % self.every == 0 or self.done == self.total:
+            elapsed = time.perf_counter() - self.start
+            rate = self.done / elapsed if elapsed else 0.0
+            print(
+                f"[{self.done}/{self.total}] errors={self.errors} {rate:.1f} items/s",
+                file=self.stream,
+                flush=True,
+            )
+
+
+def run_batch(spec: str, output: str, fmt: Optional[str] = None, workers: int = 8,
+              checkpoint: Optional[str] = None,
+              extract: Callable[[str], Dict] = extract_item) -> List[Dict]:
+    """Process every item of a batch and write the combined results.
+
+    Args:
+        spec: Directory, glob pattern or text file with one image URL per line
+        output: Output file path
+        fmt: csv, ndjson or parquet (default: from the output extension)
+        workers: Number of extractions run in parallel
+        checkpoint: NDJSON checkpoint path (default: <output>.checkpoint.ndjson)
+        extract: Function turning one source into a result record
+
+    Items that completed without an error in a previous run are skipped. An
+    output format that cannot be written (Parquet without pyarrow) raises
+    ValueError before any item is extracted.
+    """
+    fmt = output_format_for(output, fmt)
+    checkpoint = checkpoint or f"{output}.checkpoint.ndjson"
+    sources = collect_inputs(spec)
+
+    records = load_checkpoint(checkpoint)
+    pending = [source for source in sources if source not in records or records[source]["error"]]
+    if len(pending) < len(sources):
+        print(f"Resuming: {len(sources) - len(pending)} of {len(sources)} items already done",
+              file=sys.stderr, flush=True)
+
+    progress = _Progress(len(pending))
+    with open(checkpoint, "a", encoding="utf-8") as checkpoint_file, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        remaining = iter(pending)
+        in_flight = set()
+        while True:
+            # Keep at most two items per worker queued to bound memory
+            for source in remaining:
+                in_flight.add(executor.submit(extract, source))
+                if len(in_flight) >= workers * 2:
+                    break
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                records[record["source"]] = record
+                checkpoint_file.write(json.dumps(record) + "\n")
+                checkpoint_file.flush()
+                progress.update(record)
+
+    results = [records[source] for source in sources if source in records]
+    write_output(results, output, fmt)
+    return results
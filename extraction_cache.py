@@ -0,0 +1,260 @@
+"""Content-addressed cache for model extraction responses.
+
+Keys are a SHA-256 of the model name, the prompt and the input (image bytes
+or whitespace-normalized text), so re-submitted cards skip the model call.
+Values are the raw model response text.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Optional, Union
+
+
+def normalize_cache_text(text: str) -> str:
+    """Collapse whitespace so trivially different text shares a cache entry."""
+    return " ".join(str(text).split())
+
+
+def make_cache_key(payload: Union[bytes, str], prompt: str, model: str) -> str:
+    """Hash the input payload together with the prompt and model name."""
+    if isinstance(payload, str):
+        payload = normalize_cache_text(payload).encode("utf-8")
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(prompt.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(payload)
+    return digest.hexdigest()
+
+
+class CacheBackend(ABC):
+    """Storage interface used by ExtractionCache.
+
+    Subclasses store string values with an optional absolute expiry time and
+    must treat expired entries as missing.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: str, expires_at: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+
+class MemoryBackend(CacheBackend):
+    """Thread-safe in-memory LRU bounded by entry count and total bytes."""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024,
+                 clock: Callable[[], float] = time.time):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at <= self.clock():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, expires_at: Optional[float] = None) -> None:
+        size = len(key) + len(value.encode("utf-8"))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, expires_at, size)
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self.total_bytes -= size
+
+
+class SqliteBackend(CacheBackend):
+    """On-disk LRU in a sqlite database, shareable between processes."""
+
+    def __init__(self, path: str, max_entries: int = 100_000, max_bytes: int = 512 * 1024 * 1024,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = self.clock()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key: str, value: str, expires_at: Optional[float] = None) -> None:
+        now = self.clock()
+        size = len(key) + len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, expires_at, size, now),
+            )
+            self._evict(now)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM cache").fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        count, total_bytes = self._conn.execute("SELECT count(*), total(size) FROM cache").fetchone()
+        while count > self.max_entries or total_bytes > self.max_bytes:
+            # Drop the least recently used tenth (at least one row) per round
+            batch = max(1, count // 10, count - self.max_entries)
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY last_access LIMIT ?)",
+                (batch,),
+            )
+            count, total_bytes = self._conn.execute("SELECT count(*), total(size) FROM cache").fetchone()
+
+
+class ExtractionCache:
+    """TTL cache of model responses with hit/miss counters."""
+
+    def __init__(self, backend: Optional[CacheBackend] = None, ttl: Optional[float] = 3600.0,
+                 clock: Callable[[], float] = time.time):
+        self.backend = backend if backend is not None else MemoryBackend(clock=clock)
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        expires_at = self.clock() + self.ttl if self.ttl is not None else None
+        self.backend.set(key, value, expires_at)
+
+    def clear(self) -> None:
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.backend),
+        }
+
+
+def cache_from_env() -> Optional[ExtractionCache]:
+    """Build the cache configured by the environment.
+
+    EXTRACTION_CACHE: "off" (default), "memory" or "sqlite:<path>". Responses
+        hold patient identities, so caching them is opt-in.
+    EXTRACTION_CACHE_TTL: seconds an entry stays valid (default 3600)
+    EXTRACTION_CACHE_MAX_ENTRIES / EXTRACTION_CACHE_MAX_MB: eviction limits
+    """
+    spec = os.environ.get("EXTRACTION_CACHE", "off").strip()
+    if spec.lower() in ("", "off", "none", "0", "false"):
+        return None
+
+    ttl = float(os.environ.get("EXTRACTION_CACHE_TTL", "3600"))
+    max_entries = os.environ.get("EXTRACTION_CACHE_MAX_ENTRIES")
+    max_mb = os.environ.get("EXTRACTION_CACHE_MAX_MB")
+    limits = {}
+    if max_entries:
+        limits["max_entries"] = int(max_entries)
+    if max_mb:
+        limits["max_bytes"] = int(float(max_mb) * 1024 * 1024)
+
+    if spec.lower() == "memory":
+        backend = MemoryBackend(**limits)
+    elif spec.lower().startswith("sqlite:"):
+        backend = SqliteBackend(spec[len("sqlite:"):], **limits)
+    else:
+        raise ValueError(f"Unknown EXTRACTION_CACHE backend: {spec}")
+
+    return ExtractionCache(backend, ttl=ttl)
@@ -0,0 +1,76 @@
+"""Gunicorn settings for serving api:app in production.
+
+    gunicorn -c gunicorn.conf.py api:app
+
+Every value can be overridden from the environment. Extraction requests
+are I/O bound (image download and Gemini call) and run on a per-process
+event loop, so a few processes with many threads each keep dozens of
+requests in flight per container.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+
+# Worker processes; default to one per CPU
+workers = int(os.environ.get("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+
+# Threads per worker; each one holds a request while its extraction runs
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+
+# Seconds to keep idle client connections open
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+
+# Download plus model call can take a while on large scans
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+# Recycle workers periodically to bound memory growth
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", "500"))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+
+def on_starting(server):
+    # With METRICS_DIR set, /metrics sums per-worker snapshots; start clean
+    metrics_dir = os.environ.get("METRICS_DIR")
+    if metrics_dir:
+        import metrics
+        metrics.clear_snapshots(metrics_dir)
+
+
+def post_worker_init(worker):
+    # Resume queued background jobs without waiting for a first request
+    if os.environ.get("JOBS_DB"):
+        import api
+        api.job_queue()
+    # Load the extraction module behind the worker's back: the worker serves
+    # at once and the first extraction request usually finds it imported
+    if os.environ.get("EXTRACTION_WARMUP", "1") == "1":
+        import threading
+        import api
+        threading.Thread(target=api._extraction, name="extraction-warmup", daemon=True).start()
+
+
+def worker_exit(server, worker):
+    # Flush the values recorded since the last periodic snapshot
+    metrics_dir = os.environ.get("METRICS_DIR")
+    if metrics_dir:
+        import metrics
+        try:
+            metrics.write_snapshot(metrics_dir)
+        except OSError:
+            pass
+
+
+def child_exit(server, worker):
+    # Fold the exited worker into the archive so recycled workers do not
+    # pile up snapshot files that every scrape has to read
+    metrics_dir = os.environ.get("METRICS_DIR")
+    if metrics_dir:
+        import metrics
+        metrics.archive_snapshot(metrics_dir, worker.pid)
@@ -0,0 +1,217 @@
+"""Streaming image (and document) downloads with size caps and early header sniffing.
+
+The body is read in chunks with a hard byte limit. The format and pixel
+dimensions are sniffed from the first bytes, so HTML error pages, unknown
+payloads and decompression bombs are rejected before they are fully read.
+"""
+import os
+from io import BytesIO
+from typing import Optional, Tuple
+
+import httpx
+from PIL import Image
+
+# Hard limits for downloaded card images
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", str(60_000_000)))
+
+# Stop waiting for the header after this many bytes (large EXIF blocks
+# can push a JPEG frame header past the first few KB)
+SNIFF_LIMIT = 256 * 1024
+
+# Leading bytes of the formats accepted for extraction
+_MAGIC_PREFIXES = {
+    b"\xff\xd8\xff": "JPEG",
+    b"\x89PNG\r\n\x1a\n": "PNG",
+    b"GIF87a": "GIF",
+    b"GIF89a": "GIF",
+    b"II*\x00": "TIFF",
+    b"MM\x00*": "TIFF",
+    b"BM": "BMP",
+}
+
+# Leading bytes of a PDF, accepted by the document downloads only
+_PDF_MAGIC = b"%PDF-"
+
+_FORMAT_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "MPO": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+    "TIFF": "image/tiff",
+    "BMP": "image/bmp",
+}
+
+
+class ImageDownloadError(ValueError):
+    """Raised when a download is too large or is not a supported image."""
+
+
+def _magic_format(head: bytes) -> Optional[str]:
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for prefix, fmt in _MAGIC_PREFIXES.items():
+        if head.startswith(prefix):
+            return fmt
+    return None
+
+
+class ImageSniffer:
+    """Incrementally inspect the start of an image body.
+
+    feed() returns True once the format and dimensions are known and raises
+    ImageDownloadError as soon as the payload can be rejected.
+    """
+
+    def __init__(self, max_pixels: int = MAX_IMAGE_PIXELS):
+        self.max_pixels = max_pixels
+        self.format = None
+        self.size = None
+        self._head = bytearray()
+
+    @property
+    def identified(self) -> bool:
+        return self.size is not None
+
+    @property
+    def mime_type(self) -> str:
+        return _FORMAT_MIME_TYPES.get(self.format, "image/jpeg")
+
+    def feed(self, chunk: bytes) -> bool:
+        if self.size is not None:
+            return True
+
+        self._head += chunk
+        if len(self._head) < 12:
+            return False
+        if _magic_format(self._head) is None:
+            raise ImageDownloadError("Downloaded content is not a supported image")
+
+        try:
+            # Image.open only parses the header, the pixel data is not decoded
+            image = Image.open(BytesIO(self._head))
+        except Exception:
+            if len(self._head) >= SNIFF_LIMIT:
+                raise ImageDownloadError("Could not read image header")
+            return False
+
+        self.format = image.format
+        self.size = image.size
+        self._head = bytearray()
+        if self.size[0] * self.size[1] > self.max_pixels:
+            raise ImageDownloadError(
+                f"Image is {self.size[0]}x{self.size[1]}, above the {self.max_pixels} pixel limit"
+            )
+        return True
+
+
+def _check_declared_length(response: httpx.Response, max_bytes: int) -> None:
+    declared = response.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise ImageDownloadError(f"Image is {declared} bytes, above the {max_bytes} byte limit")
+
+
+class DocumentSniffer(ImageSniffer):
+    """ImageSniffer that also accepts PDF documents, recognised by their %PDF- header.
+
+    PDF pages are rasterized by the model, so only the byte cap applies to them.
+    """
+
+    def __init__(self, max_pixels: int = MAX_IMAGE_PIXELS):
+        super().__init__(max_pixels)
+        self.is_pdf = False
+
+    @property
+    def identified(self) -> bool:
+        return self.is_pdf or self.size is not None
+
+    @property
+    def mime_type(self) -> str:
+        return "application/pdf" if self.is_pdf else super().mime_type
+
+    def feed(self, chunk: bytes) -> bool:
+        if self.identified:
+            return True
+        head = self._head + chunk
+        if len(head) >= len(_PDF_MAGIC) and head.startswith(_PDF_MAGIC):
+            self.is_pdf = True
+            self.format = "PDF"
+            self._head = bytearray()
+            return True
+        if len(head) < len(_PDF_MAGIC) and _PDF_MAGIC.startswith(bytes(head)):
+            self._head = head
+            return False
+        return super().feed(chunk)
+
+
+def _stream(url: str, client: httpx.Client, sniffer: ImageSniffer, max_bytes: int) -> Tuple[bytes, str]:
+    body = bytearray()
+    with client.stream("GET", url) as response:
+        response.raise_for_status()
+        _check_declared_length(response, max_bytes)
+        for chunk in response.iter_bytes():
+            body += chunk
+            if len(body) > max_bytes:
+                raise ImageDownloadError(f"Image is larger than the {max_bytes} byte limit")
+            sniffer.feed(chunk)
+
+    if not sniffer.identified:
+        raise ImageDownloadError("Downloaded content is not a supported image")
+    return bytes(body), sniffer.mime_type
+
+
+async def _astream(url: str, client: httpx.AsyncClient, sniffer: ImageSniffer, max_bytes: int) -> Tuple[bytes, str]:
+    body = bytearray()
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        _check_declared_length(response, max_bytes)
+        async for chunk in response.aiter_bytes():
+            body += chunk
+            if len(body) > max_bytes:
+                raise ImageDownloadError(f"Image is larger than the {max_bytes} byte limit")
+            sniffer.feed(chunk)
+
+    if not sniffer.identified:
+        raise ImageDownloadError("Downloaded content is not a supported image")
+    return bytes(body), sniffer.mime_type
+
+
+def download_image(url: str, client: httpx.Client, max_bytes: int = MAX_IMAGE_BYTES,
+                   max_pixels: int = MAX_IMAGE_PIXELS) -> Tuple[bytes, str]:
+    """Stream an image into memory and return (bytes, sniffed mime type)."""
+    return _stream(url, client, ImageSniffer(max_pixels), max_bytes)
+
+
+async def adownload_image(url: str, client: httpx.AsyncClient, max_bytes: int = MAX_IMAGE_BYTES,
+                          max_pixels: int = MAX_IMAGE_PIXELS) -> Tuple[bytes, str]:
+    """Async version of download_image."""
+    return await _astream(url, client, ImageSniffer(max_pixels), max_bytes)
+
+
+def download_document(url: str, client: httpx.Client, max_bytes: int = MAX_IMAGE_BYTES,
+                      max_pixels: int = MAX_IMAGE_PIXELS) -> Tuple[bytes, str]:
+    """Stream an image or a PDF into memory and return (bytes, sniffed mime type)."""
+    return _stream(url, client, DocumentSniffer(max_pixels), max_bytes)
+
+
+async def adownload_document(url: str, client: httpx.AsyncClient, max_bytes: int = MAX_IMAGE_BYTES,
+                             max_pixels: int = MAX_IMAGE_PIXELS) -> Tuple[bytes, str]:
+    """Async version of download_document."""
+    return await _astream(url, client, DocumentSniffer(max_pixels), max_bytes)
+
+
+def new_http_client() -> httpx.Client:
+    """Pooled keep-alive client shared by every download."""
+    return httpx.Client(
+        timeout=httpx.Timeout(30.0, connect=30.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0),
+    )
+
+
+def new_async_http_client() -> httpx.AsyncClient:
+    """Async counterpart of new_http_client."""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(30.0, connect=30.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0),
+    )
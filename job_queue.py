@@ -0,0 +1,316 @@
+"""Durable background jobs for extractions submitted without waiting.
+
+Jobs live in a sqlite database (WAL mode), so every gunicorn worker process
+can submit and claim from the same queue and queued jobs survive restarts.
+A claim takes a lease, which the runner renews while the job runs; a job
+whose worker died is claimed again once the lease expires, up to
+max_attempts times. Only the latest claim of a job can record its outcome.
+When a job finishes, its result is kept for polling and optionally POSTed
+to a webhook.
+"""
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    import httpx
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Next to the code rather than in the temp directory, so queued jobs survive reboots
+DEFAULT_JOBS_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ramq-jobs.sqlite3")
+
+
+class JobQueue:
+    """sqlite-backed queue shared by threads and processes."""
+
+    def __init__(self, path: str, lease_seconds: float = 300.0, max_attempts: int = 3,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, "
+            "result TEXT, error TEXT, webhook TEXT, webhook_status TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, "
+            "started_at REAL, finished_at REAL, lease_until REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+        # Set by submit so idle runners in this process start at once
+        self.submitted = threading.Event()
+
+    def submit(self, payload: dict, webhook: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, payload, webhook, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(payload), webhook, self.clock()),
+            )
+        self.submitted.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            names = [column[0] for column in cursor.description]
+        if row is None:
+            return None
+        job = dict(zip(names, row))
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def claim(self) -> Optional[dict]:
+        """Take the oldest queued job (or one whose lease expired) and mark it running."""
+        now = self.clock()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock, so two processes never claim the same job
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs out of attempts after a lost lease fail instead of looping
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_until = NULL "
+                    "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                    (FAILED, "Worker lost", now, RUNNING, now, self.max_attempts),
+                )
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED, RUNNING, now),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, lease_until = ? "
+                        "WHERE id = ?",
+                        (RUNNING, now, now + self.lease_seconds, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row[0]) if row is not None else None
+
+    def renew(self, job_id: str, attempt: int) -> bool:
+        """Extend the lease of a claim; False once the job was finished or claimed again."""
+        now = self.clock()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ? AND attempts = ?",
+                (now + self.lease_seconds, job_id, RUNNING, attempt),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: str, result: dict, attempt: Optional[int] = None) -> bool:
+        return self._finish(job_id, DONE, json.dumps(result), None, attempt)
+
+    def fail(self, job_id: str, error: str, attempt: Optional[int] = None) -> bool:
+        return self._finish(job_id, FAILED, None, error, attempt)
+
+    def _finish(self, job_id: str, status: str, result: Optional[str], error: Optional[str],
+                attempt: Optional[int]) -> bool:
+        """Record the outcome of a running job.
+
+        With attempt (the claim's "attempts"), only that claim may finish the
+        job: a run that lost its lease to a newer claim returns False.
+        """
+        query = ("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL "
+                 "WHERE id = ? AND status = ?")
+        params = [status, result, error, self.clock(), job_id, RUNNING]
+        if attempt is not None:
+            query += " AND attempts = ?"
+            params.append(attempt)
+        with self._lock:
+            return self._conn.execute(query, params).rowcount == 1
+
+    def set_webhook_status(self, job_id: str, status: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET webhook_status = ? WHERE id = ?", (status, job_id))
+
+    def purge(self, older_than: float) -> int:
+        """Delete finished jobs that finished more than older_than seconds ago."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, self.clock() - older_than),
+            )
+            return cursor.rowcount
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, count(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def public_view(job: dict) -> dict:
+    """The fields of a job returned by GET /jobs/<id> and sent to webhooks."""
+    view = {"id": job["id"], "status": job["status"]}
+    if job["status"] == DONE:
+        view["result"] = job["result"]
+    elif job["status"] == FAILED:
+        view["error"] = job["error"]
+    return view
+
+
+def deliver_webhook(url: str, body: dict, secret: Optional[str] = None, attempts: int = 3,
+                    client: Optional["httpx.Client"] = None) -> bool:
+    """POST a job to its webhook, retrying transient failures.
+
+    With a secret, the body is signed with HMAC-SHA256 in the X-Job-Signature header.
+    """
+    # Imported here so the API does not load httpx at start-up
+    import httpx
+
+    data = json.dumps(body).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Job-Signature"] = "sha256=" + hmac.new(secret.encode("utf-8"), data, hashlib.sha256).hexdigest()
+    owned = client is None
+    client = client or httpx.Client(timeout=10.0)
+    try:
+        for attempt in range(attempts):
+            try:
+                response = client.post(url, content=data, headers=headers)
+                if response.status_code < 500:
+                    return response.is_success
+            except httpx.TransportError:
+                pass
+            if attempt + 1 < attempts:
+                time.sleep(0.5 * 2 ** attempt)
+        return False
+    finally:
+        if owned:
+            client.close()
+
+
+class JobRunner:
+    """Threads that claim jobs and run them through handler(payload) -> result.
+
+    A handler exception fails the job with its message. The lease is renewed
+    every third of lease_seconds while the handler runs, so slow jobs (quota
+    waits, retries) are not claimed a second time. Other processes'
+    submissions are picked up within poll_interval seconds.
+    """
+
+    def __init__(self, queue: JobQueue, handler: Callable[[dict], dict], concurrency: int = 4,
+                 poll_interval: float = 0.5, webhook_secret: Optional[str] = None,
+                 retention_seconds: float = 7 * 24 * 3600):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.webhook_secret = webhook_secret
+        self.retention_seconds = retention_seconds
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_purge = 0.0
+
+    def start(self) -> None:
+        for index in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name=f"job-runner-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        self.queue.submitted.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run_one(self) -> bool:
+        """Claim and run a single job; False when the queue is empty."""
+        job = self.queue.claim()
+        if job is None:
+            return False
+        job_id, attempt = job["id"], job["attempts"]
+        finished = threading.Event()
+        keeper = threading.Thread(target=self._keep_lease, args=(job_id, attempt, finished),
+                                  name=f"job-lease-{job_id[:8]}", daemon=True)
+        keeper.start()
+        try:
+            try:
+                result = self.handler(job["payload"])
+            except Exception as e:
+                recorded = self.queue.fail(job_id, str(e) or type(e).__name__, attempt)
+            else:
+                recorded = self.queue.complete(job_id, result, attempt)
+        finally:
+            finished.set()
+            keeper.join()
+        # A run that lost its claim leaves the outcome and the webhook to the newer one
+        if recorded and job["webhook"]:
+            delivered = deliver_webhook(job["webhook"], public_view(self.queue.get(job_id)), self.webhook_secret)
+            self.queue.set_webhook_status(job_id, "delivered" if delivered else "failed")
+        return True
+
+    def _keep_lease(self, job_id: str, attempt: int, finished: threading.Event) -> None:
+        while not finished.wait(self.queue.lease_seconds / 3):
+            try:
+                if not self.queue.renew(job_id, attempt):
+                    return
+            except sqlite3.Error as e:
+                print(f"Job queue error: {str(e)}", flush=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.run_one():
+                    continue
+                self._purge_old()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {str(e)}", flush=True)
+            self.queue.submitted.wait(self.poll_interval)
+            self.queue.submitted.clear()
+
+    def _purge_old(self) -> None:
+        now = time.monotonic()
+        if now - self._last_purge >= 3600:
+            self._last_purge = now
+            self.queue.purge(self.retention_seconds)
+
+
+def queue_from_env() -> JobQueue:
+    """Queue configured by the environment.
+
+    JOBS_DB: sqlite path, on persistent storage (default DEFAULT_JOBS_DB, next to this module)
+    JOB_LEASE_SECONDS: time a claimed job may run before it is retried (default 300)
+    JOB_MAX_ATTEMPTS: claims per job (default 3)
+    """
+    return JobQueue(
+        os.environ.get("JOBS_DB") or DEFAULT_JOBS_DB,
+        lease_seconds=float(os.environ.get("JOB_LEASE_SECONDS", "300")),
+        max_attempts=int(os.environ.get("JOB_MAX_ATTEMPTS", "3")),
+    )
+
+
+def runner_from_env(queue: JobQueue, handler: Callable[[dict], dict]) -> JobRunner:
+    """Runner configured by the environment.
+
+    JOB_CONCURRENCY: jobs run at once per process (default 4)
+    JOB_WEBHOOK_SECRET: HMAC key signing webhook bodies (optional)
+    JOB_RETENTION_SECONDS: how long finished jobs stay pollable (default 7 days)
+    """
+    return JobRunner(
+        queue,
+        handler,
+        concurrency=int(os.environ.get("JOB_CONCURRENCY", "4")),
+        webhook_secret=os.environ.get("JOB_WEBHOOK_SECRET") or None,
+        retention_seconds=float(os.environ.get("JOB_RETENTION_SECONDS", str(7 * 24 * 3600))),
+    )
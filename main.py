@@ -1,14 +1,55 @@
-from anthropic_vision_script import get_ramq, get_patient_list
 import argparse
 
 def main():
     parser = argparse.ArgumentParser(description='Get RAMQ details or patient list from an image URL or text.')
-    parser.add_argument('input', type=str, help='The URL of the image or text to process.')
+    parser.add_argument('input', type=str, help='The URL of the image or text to process (with --batch: a directory, glob or file of image URLs).')
     parser.add_argument('--is_image', type=str, required=False, help='Specify if the input is an image URL (True/False).')
-    parser.add_argument('--mode', type=str, choices=['ramq', 'list'], default='ramq',
-                      help='Mode of operation: ramq (get RAMQ details) or list (get patient list)')
+    parser.add_argument('--mode', type=str, choices=['ramq', 'list', 'validate'], default='ramq',
+                      help='Mode of operation: ramq (get RAMQ details), list (get patient list) or validate (check a RAMQ or OHIP number)')
+    parser.add_argument('--batch', action='store_true',
+                      help='Extract every card from a directory, glob pattern or file of image URLs.')
+    parser.add_argument('--output', type=str, help='Batch output file (required with --batch).')
+    parser.add_argument('--format', type=str, choices=['csv', 'ndjson', 'parquet'],
+                      help='Batch output format (default: from the output file extension).')
+    parser.add_argument('--workers', type=int, default=8, help='Number of parallel batch extractions.')
+    parser.add_argument('--checkpoint', type=str,
+                      help='Batch checkpoint file used to resume (default: <output>.checkpoint.ndjson).')
     args = parser.parse_args()
 
+    if args.batch:
+        if not args.output:
+            parser.error('--output is required with --batch')
+        if args.mode != 'ramq':
+            parser.error(f'--batch extracts cards only; --mode {args.mode} cannot be combined with it')
+        from batch_extract import run_batch
+        try:
+            results = run_batch(args.input, args.output, fmt=args.format,
+                                workers=args.workers, checkpoint=args.checkpoint)
+        except ValueError as e:
+            print(e)
+            return
+        errors = sum(1 for record in results if record["error"])
+        print(f"Processed {len(results)} items ({errors} errors), results written to {args.output}")
+        return
+
+    if args.mode == 'validate':
+        # Validation needs none of the extraction dependencies
+        from validators import normalize_ohip, normalize_ramq, validate_ramq
+        ramq = normalize_ramq(args.input)
+        ohip = None if ramq else normalize_ohip(args.input)
+        if ramq:
+            print(f"RAMQ: {ramq}")
+            print(f"Valid: {validate_ramq(ramq)}")
+        elif ohip:
+            print(f"OHIP: {ohip['number']}")
+            print(f"Version Code: {ohip['version_code']}")
+            print("Valid: True")
+        else:
+            print("Valid: False")
+        return
+
+    from anthropic_vision_script import get_ramq, get_patient_list
+
     # Determine if input_data is an image URL or a string
     if args.is_image is None:
         import re
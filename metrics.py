@@ -0,0 +1,406 @@
+"""In-process metrics with Prometheus text exposition.
+
+Stage latencies, byte counts and validation outcomes are recorded on the hot
+path with a lock-protected counter update (about a microsecond), so the
+instrumentation stays on in production. Only the standard library is used.
+
+Each process keeps its own values. When METRICS_DIR is set, every process
+also writes a snapshot there every METRICS_FLUSH_SECONDS and /metrics sums
+the snapshots of all processes (gunicorn workers included). Snapshots of
+exited workers are folded into a single archive file.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond parsing up to slow model calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTE_BUCKETS = (1024, 10 * 1024, 50 * 1024, 100 * 1024, 250 * 1024, 500 * 1024,
+                1024 * 1024, 2 * 1024 * 1024, 5 * 1024 * 1024, 10 * 1024 * 1024, 20 * 1024 * 1024)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def state(self):
+        return self.value
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def state(self):
+        with self._lock:
+            return {"counts": list(self.counts), "sum": self.sum}
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        ...
+
+    @abstractmethod
+    def render(self, states: dict) -> Iterable[str]:
+        ...
+
+    def snapshot(self) -> List[list]:
+        with self._lock:
+            children = list(self._children.items())
+        return [[list(values), child.state()] for values, child in children]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def render(self, states: Dict[tuple, float]) -> Iterable[str]:
+        for values, value in sorted(states.items()):
+            yield f"{self.name}{_label_text(self.labelnames, values)} {_format_value(value)}"
+
+    @staticmethod
+    def merge(total, state):
+        return (total or 0.0) + state
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def render(self, states: Dict[tuple, dict]) -> Iterable[str]:
+        for values, state in sorted(states.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state["counts"]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_label_text(self.labelnames, values, le)} {cumulative}"
+            labels = _label_text(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(state['sum'])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+    @staticmethod
+    def merge(total, state):
+        if total is None:
+            return {"counts": list(state["counts"]), "sum": state["sum"]}
+        total["counts"] = [a + b for a, b in zip(total["counts"], state["counts"])]
+        total["sum"] += state["sum"]
+        return total
+
+
+class Registry:
+    """Named metrics of one process, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def _merged_states(self, name: str, snapshots: List[dict]) -> dict:
+        metric = self._metrics[name]
+        states = {}
+        for snapshot in snapshots:
+            for values, state in snapshot.get(name, []):
+                key = tuple(values)
+                states[key] = metric.merge(states.get(key), state)
+        return states
+
+    def merge(self, snapshots: List[dict]) -> dict:
+        """Sum several snapshots into one, in snapshot format."""
+        return {name: [[list(values), state] for values, state in self._merged_states(name, snapshots).items()]
+                for name in self._metrics}
+
+    def render(self, snapshots: Optional[List[dict]] = None) -> str:
+        """Render this process, or the sum of the given snapshots."""
+        if snapshots is None:
+            snapshots = [self.snapshot()]
+        lines = []
+        for name, metric in self._metrics.items():
+            states = self._merged_states(name, snapshots)
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(states))
+        return "\n".join(lines) + "\n"
+
+
+# -- multi-process snapshots --------------------------------------------------
+
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+# Totals of workers that have exited, so recycled workers leave one file behind
+_ARCHIVE_NAME = "metrics-archive.json"
+
+
+def _snapshot_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"metrics-{pid}.json")
+
+
+def _write_json(path: str, data: dict) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".metrics-", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as handle:
+        json.dump(data, handle)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(directory: str, registry: Optional[Registry] = None) -> None:
+    """Atomically write this process's values into the snapshot directory."""
+    registry = registry or REGISTRY
+    _write_json(_snapshot_path(directory, os.getpid()), registry.snapshot())
+
+
+def archive_snapshot(directory: str, pid: int, registry: Optional[Registry] = None) -> None:
+    """Fold the snapshot of an exited process into the archive and remove it.
+
+    Called by the gunicorn master when a worker exits (max_requests recycling
+    included), so the directory and every scrape stay bounded by the number
+    of live workers.
+    """
+    registry = registry or REGISTRY
+    path = _snapshot_path(directory, pid)
+    snapshot = _read_json(path)
+    if snapshot is not None:
+        archive_path = os.path.join(directory, _ARCHIVE_NAME)
+        snapshots = [snapshot]
+        archive = _read_json(archive_path)
+        if archive is not None:
+            snapshots.insert(0, archive)
+        _write_json(archive_path, registry.merge(snapshots))
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def read_snapshots(directory: str) -> List[dict]:
+    snapshots = []
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith("metrics-") and name.endswith(".json")):
+            continue
+        snapshot = _read_json(os.path.join(directory, name))
+        if snapshot is not None:
+            snapshots.append(snapshot)
+    return snapshots
+
+
+def clear_snapshots(directory: str) -> None:
+    """Remove the snapshots of a previous server run (call before forking workers)."""
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.startswith("metrics-") and name.endswith(".json"):
+            os.remove(os.path.join(directory, name))
+
+
+def ensure_snapshot_writer() -> None:
+    """Start the per-process snapshot thread when METRICS_DIR is set."""
+    global _writer_pid
+    directory = os.environ.get("METRICS_DIR")
+    if not directory or _writer_pid == os.getpid():
+        return
+    with _writer_lock:
+        if _writer_pid == os.getpid():
+            return
+        _writer_pid = os.getpid()
+        interval = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+        os.makedirs(directory, exist_ok=True)
+
+        def flush_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    write_snapshot(directory)
+                except OSError:
+                    pass
+
+        threading.Thread(target=flush_forever, name="metrics-writer", daemon=True).start()
+
+
+def render_latest() -> str:
+    """Text exposition for /metrics: all processes when METRICS_DIR is set."""
+    directory = os.environ.get("METRICS_DIR")
+    if not directory:
+        return REGISTRY.render()
+    os.makedirs(directory, exist_ok=True)
+    write_snapshot(directory)
+    return REGISTRY.render(read_snapshots(directory))
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# -- extraction metrics -------------------------------------------------------
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "ramq_stage_seconds", "Time spent per extraction stage", ("stage",))
+STAGE_BYTES = REGISTRY.histogram(
+    "ramq_stage_bytes", "Payload size per stage (downloaded or encoded image)", ("stage",), BYTE_BUCKETS)
+BYTES_TOTAL = REGISTRY.counter(
+    "ramq_bytes_total", "Bytes processed per stage", ("stage",))
+VALIDATIONS_TOTAL = REGISTRY.counter(
+    "ramq_validations_total", "Health number validations by kind, source and result",
+    ("kind", "source", "result"))
+MODEL_ATTEMPTS_TOTAL = REGISTRY.counter(
+    "ramq_model_attempts_total", "Model call attempts by outcome", ("outcome", "hedged"))
+CACHE_LOOKUPS_TOTAL = REGISTRY.counter(
+    "ramq_cache_lookups_total", "Extraction cache lookups by result", ("result",))
+RESOLUTION_WIDTH = REGISTRY.histogram(
+    "ramq_resolution_width_pixels", "Image width sent to the model by attempt", ("attempt",),
+    (100, 200, 300, 400, 600, 800, 1200, 1600, 2400, 4000))
+RESOLUTION_RETRIES_TOTAL = REGISTRY.counter(
+    "ramq_resolution_retries_total", "Higher-resolution retries after a failed RAMQ validation", ("result",))
+RAMQ_REPAIRS_TOTAL = REGISTRY.counter(
+    "ramq_repairs_total", "Invalid RAMQ reads by repair outcome (local, requery, failed)", ("result",))
+RATE_LIMIT_TOTAL = REGISTRY.counter(
+    "ramq_rate_limit_total", "Model calls admitted or shed by the quota limiter", ("priority", "result"))
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    "ramq_rate_limit_wait_seconds", "Time model calls waited for quota by priority", ("priority",))
+REQUEST_SECONDS = REGISTRY.histogram(
+    "ramq_http_request_seconds", "HTTP request latency by endpoint and status", ("endpoint", "status"))
+
+
+class _StageTimer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child: _HistogramChild):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+
+def stage(name: str) -> _StageTimer:
+    """Context manager timing one pipeline stage."""
+    return _StageTimer(STAGE_SECONDS.labels(name))
+
+
+def observe_bytes(stage_name: str, size: int) -> None:
+    STAGE_BYTES.labels(stage_name).observe(size)
+    BYTES_TOTAL.labels(stage_name).inc(size)
+
+
+def record_validation(kind: str, valid: bool, source: str = "extraction") -> None:
+    VALIDATIONS_TOTAL.labels(kind, source, "valid" if valid else "invalid").inc()
+
+
+def record_model_attempt(timing) -> None:
+    """RequestPolicy.on_attempt hook."""
+    MODEL_ATTEMPTS_TOTAL.labels(timing.outcome, "true" if timing.hedged else "false").inc()
+    STAGE_SECONDS.labels("model_attempt").observe(timing.seconds)
+
+
+def record_cache_lookup(hit: bool) -> None:
+    CACHE_LOOKUPS_TOTAL.labels("hit" if hit else "miss").inc()
+
+
+def record_rate_limit(priority: str, result: str, waited: float) -> None:
+    """RateLimiter.on_acquire hook."""
+    RATE_LIMIT_TOTAL.labels(priority, result).inc()
+    if result == "ok":
+        RATE_LIMIT_WAIT_SECONDS.labels(priority).observe(waited)
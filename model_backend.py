@@ -0,0 +1,201 @@
+"""Model backends used by the extraction functions.
+
+GeminiBackend calls the real API. FakeBackend is an in-process stand-in
+with configurable latency, error rate and canned JSON responses, so the
+download -> resize -> infer -> parse pipeline can be load-tested and
+profiled deterministically without network access to Gemini.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, List, Optional, Union
+
+
+class ModelBackend(ABC):
+    """Interface for generating a JSON response from request contents."""
+
+    model = "unknown"
+
+    @abstractmethod
+    def generate(self, contents: list, config) -> str:
+        ...
+
+    async def agenerate(self, contents: list, config) -> str:
+        return await asyncio.to_thread(self.generate, contents, config)
+
+
+class GeminiBackend(ModelBackend):
+    """Backend calling the Gemini API through a google.genai client.
+
+    With client_factory instead of a client, the client is created on the
+    first call rather than when the backend is constructed.
+    """
+
+    def __init__(self, client=None, model: str = "", client_factory: Optional[Callable[[], object]] = None):
+        if client is None and client_factory is None:
+            raise ValueError("GeminiBackend needs a client or a client_factory")
+        self._client = client
+        self._client_factory = client_factory
+        self.model = model
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+    def generate(self, contents: list, config) -> str:
+        message = self.client.models.generate_content(
+            model=self.model,
+            contents=contents,
+            config=config,
+        )
+        return message.text
+
+    async def agenerate(self, contents: list, config) -> str:
+        message = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=contents,
+            config=config,
+        )
+        return message.text
+
+
+class FakeBackendError(Exception):
+    """Injected failure, shaped like a transient server error."""
+
+    def __init__(self, message: str = "Fake backend unavailable", code: int = 503):
+        super().__init__(message)
+        self.code = code
+
+
+FAKE_PERSON = {
+    "first_name": "Jean",
+    "last_name": "Tremblay",
+    "date_of_birth": "1964-05-05",
+    "ramq": "TREJ64050519",
+    "ohip": None,
+    "mrn": "MRN-0001",
+}
+
+
+def prompt_text(contents: list) -> str:
+    """Concatenate the text parts of request contents."""
+    texts = []
+    for content in contents:
+        for part in getattr(content, "parts", None) or []:
+            if getattr(part, "text", None):
+                texts.append(part.text)
+    return "\n".join(texts)
+
+
+def default_fake_response(contents: list) -> str:
+    """Canned answer shaped after the prompt: patient list, document, text batch or one person."""
+    text = prompt_text(contents)
+    if "'people' key" in text:
+        return json.dumps({"people": [dict(FAKE_PERSON, page=1, box_2d=[100, 100, 400, 600])]})
+    if "'patients' key" in text:
+        return json.dumps({"patients": [
+            {"first_name": "Jean", "last_name": "Tremblay", "patient_number": "1", "room_number": "12"},
+            {"first_name": "Marie", "last_name": "Roy", "patient_number": "2", "room_number": None},
+        ]})
+    snippet_ids = re.findall(r"^\[(\d+)\] ", text, flags=re.M)
+    if snippet_ids:
+        return json.dumps([dict(FAKE_PERSON, id=snippet_id) for snippet_id in snippet_ids])
+    return json.dumps(FAKE_PERSON)
+
+
+class FakeBackend(ModelBackend):
+    """In-process model stand-in for offline benchmarking and tests.
+
+    Args:
+        responses: None for default_fake_response, a JSON string, a list of
+            strings returned in turn, or a callable(contents) -> str
+        latency: Base seconds each call takes
+        jitter: Extra uniformly random seconds added to each call
+        error_rate: Probability that a call raises FakeBackendError
+        seed: Seed for the jitter and error draws
+    """
+
+    def __init__(self, responses: Union[None, str, List[str], Callable[[list], str]] = None,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 seed: Optional[int] = None, model: str = "fake-model"):
+        self.responses = responses
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.model = model
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _start(self, contents: list):
+        """Draw this call's delay and outcome; returns (delay, response or error)."""
+        with self._lock:
+            index = self.calls
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.errors += 1
+                return delay, FakeBackendError()
+
+        # A failing responses callable is returned as the outcome, so _finish
+        # still runs and in_flight stays accurate
+        try:
+            if self.responses is None:
+                return delay, default_fake_response(contents)
+            if isinstance(self.responses, str):
+                return delay, self.responses
+            if callable(self.responses):
+                return delay, self.responses(contents)
+            return delay, self.responses[index % len(self.responses)]
+        except Exception as e:
+            return delay, e
+
+    def _finish(self, outcome) -> str:
+        with self._lock:
+            self.in_flight -= 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def generate(self, contents: list, config) -> str:
+        delay, outcome = self._start(contents)
+        if delay:
+            time.sleep(delay)
+        return self._finish(outcome)
+
+    async def agenerate(self, contents: list, config) -> str:
+        delay, outcome = self._start(contents)
+        if delay:
+            await asyncio.sleep(delay)
+        return self._finish(outcome)
+
+
+def fake_backend_from_env() -> FakeBackend:
+    """FakeBackend configured by FAKE_MODEL_LATENCY, FAKE_MODEL_JITTER,
+    FAKE_MODEL_ERROR_RATE, FAKE_MODEL_SEED and FAKE_MODEL_RESPONSE (path to
+    a JSON file returned for every call)."""
+    responses = None
+    response_path = os.environ.get("FAKE_MODEL_RESPONSE")
+    if response_path:
+        with open(response_path, "r", encoding="utf-8") as handle:
+            responses = handle.read()
+    seed = os.environ.get("FAKE_MODEL_SEED")
+    return FakeBackend(
+        responses=responses,
+        latency=float(os.environ.get("FAKE_MODEL_LATENCY", "0")),
+        jitter=float(os.environ.get("FAKE_MODEL_JITTER", "0")),
+        error_rate=float(os.environ.get("FAKE_MODEL_ERROR_RATE", "0")),
+        seed=int(seed) if seed else None,
+    )
@@ -0,0 +1,331 @@
+"""Local patient registry lookup by RAMQ, OHIP or MRN.
+
+A CSV or Parquet export is compiled once into a single index file:
+
+    header    b"RAMQREG1", uint32 length, JSON (columns, rows, section offsets)
+    keys      one table per key kind, fixed-width entries (key, uint32 row) sorted by key
+    offsets   uint64 per row (+1), start of each record in the records blob
+    records   one JSON array of column values per row
+
+The file is opened with mmap read-only, so a lookup is a binary search over
+the key table (O(log n)) plus decoding one record, and every worker process
+mapping the same file shares its pages through the OS page cache. Rebuilds
+write a new file and rename it into place; open readers keep the old
+mapping until they notice the change and reopen.
+
+    python patient_registry.py build export.csv registry.idx
+    python patient_registry.py lookup registry.idx --ramq TREJ64050519
+"""
+import argparse
+import csv
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+MAGIC = b"RAMQREG1"
+KEY_KINDS = ("ramq", "ohip", "mrn")
+# Export column names tried for each key kind (case-insensitive)
+DEFAULT_COLUMNS = {
+    "ramq": ("ramq", "nam", "health_number"),
+    "ohip": ("ohip", "ohip_number", "hcn"),
+    "mrn": ("mrn", "medical_record_number", "patient_number"),
+}
+_OFFSET = struct.Struct("<Q")
+_LENGTH = struct.Struct("<I")
+
+
+def normalize_key(kind: str, value) -> Optional[str]:
+    """Registry key for a RAMQ, OHIP (10 digits, version code dropped) or MRN."""
+    if value is None:
+        return None
+    key = re.sub(r"[^0-9A-Za-z]", "", str(value)).upper()
+    if kind == "ohip":
+        digits = re.match(r"\d{10}", key)
+        return digits.group(0) if digits else None
+    return key or None
+
+
+def _read_csv(path: str) -> Tuple[List[str], Iterator[list]]:
+    handle = open(path, "r", newline="", encoding="utf-8-sig")
+    reader = csv.reader(handle)
+    columns = next(reader, [])
+
+    def rows():
+        with handle:
+            yield from reader
+
+    return columns, rows()
+
+
+def _read_parquet(path: str) -> Tuple[List[str], Iterator[list]]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet input requires pyarrow (pip install pyarrow)")
+    parquet = pq.ParquetFile(path)
+    columns = list(parquet.schema_arrow.names)
+
+    def rows():
+        for batch in parquet.iter_batches():
+            values = batch.to_pydict()
+            for index in range(batch.num_rows):
+                yield [values[column][index] for column in columns]
+
+    return columns, rows()
+
+
+def read_export(path: str) -> Tuple[List[str], Iterator[list]]:
+    """Column names and a row iterator for a CSV or Parquet export."""
+    if path.lower().endswith((".parquet", ".pq")):
+        return _read_parquet(path)
+    return _read_csv(path)
+
+
+def _key_columns(columns: List[str], overrides: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+    lowered = {column.strip().lower(): index for index, column in enumerate(columns)}
+    positions = {}
+    for kind in KEY_KINDS:
+        names = (overrides[kind],) if overrides and overrides.get(kind) else DEFAULT_COLUMNS[kind]
+        for name in names:
+            if name.lower() in lowered:
+                positions[kind] = lowered[name.lower()]
+                break
+        else:
+            if overrides and overrides.get(kind):
+                raise ValueError(f"Column {overrides[kind]!r} not found in export")
+    if not positions:
+        raise ValueError("Export has no RAMQ, OHIP or MRN column")
+    return positions
+
+
+def build_registry(source: str, output: str, columns: Optional[Dict[str, str]] = None) -> dict:
+    """Compile an export into an index file, replacing output atomically.
+
+    Args:
+        source: CSV or Parquet export, one patient per row
+        output: Index file to write
+        columns: Export column to use per key kind (default: DEFAULT_COLUMNS)
+
+    Returns the header written (column names, row and key counts).
+    """
+    names, rows = read_export(source)
+    positions = _key_columns(names, columns)
+    keys = {kind: [] for kind in positions}
+    offsets = array("Q", [0])
+    directory = os.path.dirname(os.path.abspath(output))
+
+    with tempfile.TemporaryFile(dir=directory) as blob:
+        for row_number, row in enumerate(rows):
+            for kind, position in positions.items():
+                key = normalize_key(kind, row[position] if position < len(row) else None)
+                if key:
+                    keys[kind].append((key.encode("ascii", "ignore"), row_number))
+            blob.write(json.dumps(row, default=str, separators=(",", ":")).encode("utf-8"))
+            offsets.append(blob.tell())
+
+        header = {"columns": names, "rows": len(offsets) - 1, "built": time.time(), "keys": {}}
+        tables = {}
+        for kind, entries in keys.items():
+            entries.sort()
+            width = max((len(key) for key, _ in entries), default=1)
+            entry = struct.Struct(f"<{width}sI")
+            tables[kind] = b"".join(entry.pack(key, row) for key, row in entries)
+            header["keys"][kind] = {"width": width, "count": len(entries)}
+
+        # Section offsets depend on the header length, so size the header first
+        sizes = {kind: len(table) for kind, table in tables.items()}
+        for _ in range(2):
+            encoded = json.dumps(header).encode("utf-8")
+            position = len(MAGIC) + _LENGTH.size + len(encoded)
+            for kind in tables:
+                header["keys"][kind]["offset"] = position
+                position += sizes[kind]
+            header["offsets"] = position
+            header["records"] = position + len(offsets) * _OFFSET.size
+        encoded = json.dumps(header).encode("utf-8")
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".registry-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(MAGIC + _LENGTH.pack(len(encoded)) + encoded)
+                for kind in tables:
+                    handle.write(tables[kind])
+                if sys.byteorder != "little":
+                    offsets.byteswap()
+                offsets.tofile(handle)
+                blob.seek(0)
+                while True:
+                    chunk = blob.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    handle.write(chunk)
+            # mkstemp creates 0600; workers may run as another user
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, output)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return header
+
+
+class PatientRegistry:
+    """Read-only, memory-mapped view of an index file built by build_registry."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as handle:
+            stat = os.fstat(handle.fileno())
+            self._mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._identity = (stat.st_ino, stat.st_mtime_ns)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self._mm.close()
+            raise ValueError(f"Not a patient registry file: {path}")
+        (length,) = _LENGTH.unpack_from(self._mm, len(MAGIC))
+        start = len(MAGIC) + _LENGTH.size
+        self.header = json.loads(self._mm[start:start + length])
+        self.columns = self.header["columns"]
+        self._tables = {
+            kind: (spec["offset"], spec["count"], spec["width"], struct.Struct(f"<{spec['width']}sI"))
+            for kind, spec in self.header["keys"].items()
+        }
+
+    def __len__(self) -> int:
+        return self.header["rows"]
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def changed_on_disk(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns) != self._identity
+
+    def _find(self, kind: str, key: bytes) -> Optional[int]:
+        table = self._tables.get(kind)
+        if table is None:
+            return None
+        offset, count, width, entry = table
+        if len(key) > width:
+            return None
+        key = key.ljust(width, b"\0")
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            position = offset + middle * entry.size
+            if self._mm[position:position + width] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == count:
+            return None
+        found, row = entry.unpack_from(self._mm, offset + low * entry.size)
+        return row if found == key else None
+
+    def record(self, row: int) -> dict:
+        position = self.header["offsets"] + row * _OFFSET.size
+        start, end = struct.unpack_from("<2Q", self._mm, position)
+        base = self.header["records"]
+        return dict(zip(self.columns, json.loads(self._mm[base + start:base + end])))
+
+    def lookup(self, kind: str, value) -> Optional[dict]:
+        """The first registry row whose key of this kind matches, or None."""
+        key = normalize_key(kind, value)
+        if not key:
+            return None
+        row = self._find(kind, key.encode("ascii", "ignore"))
+        return None if row is None else self.record(row)
+
+    def match(self, ramq=None, ohip=None, mrn=None) -> Optional[Tuple[str, dict]]:
+        """(kind, record) for the first identifier found, tried as RAMQ, OHIP, MRN."""
+        for kind, value in (("ramq", ramq), ("ohip", ohip), ("mrn", mrn)):
+            record = self.lookup(kind, value)
+            if record is not None:
+                return kind, record
+        return None
+
+
+_registry = None
+_registry_pid = None
+_registry_checked = 0.0
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> Optional[PatientRegistry]:
+    """Registry at PATIENT_REGISTRY for this process, or None when unset.
+
+    The file is mapped lazily in each process (after gunicorn forks), and
+    checked for a rebuild every PATIENT_REGISTRY_RELOAD_SECONDS (default 60).
+    """
+    global _registry, _registry_pid, _registry_checked
+    path = os.environ.get("PATIENT_REGISTRY")
+    if not path:
+        return None
+    now = time.monotonic()
+    interval = float(os.environ.get("PATIENT_REGISTRY_RELOAD_SECONDS", "60"))
+    current = _registry
+    if (current is not None and _registry_pid == os.getpid() and current.path == path
+            and now - _registry_checked < interval):
+        return current
+    with _registry_lock:
+        if (_registry is None or _registry_pid != os.getpid() or _registry.path != path
+                or _registry.changed_on_disk()):
+            # The replaced mapping is left to the garbage collector, since
+            # lookups in other threads may still be reading from it
+            _registry = PatientRegistry(path)
+            _registry_pid = os.getpid()
+        _registry_checked = now
+        return _registry
+
+
+def _parse_columns(values: Iterable[str]) -> Dict[str, str]:
+    columns = {}
+    for value in values:
+        kind, _, column = value.partition("=")
+        if kind not in KEY_KINDS or not column:
+            raise argparse.ArgumentTypeError(f"--column expects kind=column with kind in {KEY_KINDS}")
+        columns[kind] = column
+    return columns
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build or query the local patient registry index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Compile a CSV or Parquet export into an index file.")
+    build.add_argument("source", help="CSV or Parquet export, one patient per row.")
+    build.add_argument("output", help="Index file to write (replaced atomically).")
+    build.add_argument("--column", action="append", default=[],
+                       help="Export column for a key, e.g. ramq=NAM (repeatable).")
+
+    lookup = commands.add_parser("lookup", help="Look a patient up in an index file.")
+    lookup.add_argument("index", help="Index file built with the build command.")
+    for kind in KEY_KINDS:
+        lookup.add_argument(f"--{kind}")
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        start = time.perf_counter()
+        header = build_registry(args.source, args.output, _parse_columns(args.column))
+        counts = ", ".join(f"{kind}: {spec['count']}" for kind, spec in header["keys"].items())
+        print(f"Indexed {header['rows']} rows ({counts}) in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        return 0
+
+    registry = PatientRegistry(args.index)
+    result = registry.match(args.ramq, args.ohip, args.mrn)
+    print(json.dumps(None if result is None else {"matched_on": result[0], "record": result[1]}))
+    return 0 if result else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,329 @@
+"""Client-side rate limiting of model calls against the Gemini quota.
+
+Two token buckets, requests per minute and estimated tokens per minute, are
+refilled continuously and shared by every thread, and with a state file by
+every process on the host (gunicorn workers, job runners and batch runs
+together). A call that does not fit waits for the buckets to refill instead
+of being sent and failing with 429, so sustained throughput stays at the
+quota rather than collapsing into retry storms.
+
+Calls carry a priority. Interactive intake may drain the buckets; lower
+priorities must leave a reserve for it and wait behind it in this process.
+Each priority has a longest acceptable wait, and a call expected to wait
+longer is shed with RateLimitExceeded instead of queueing. A 429 that gets
+through anyway empties the buckets for a short penalty so every process
+backs off at once.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+BATCH = "batch"
+# Lower rank is served first
+PRIORITY_RANKS = {INTERACTIVE: 0, BACKGROUND: 1, BATCH: 2}
+# Share of each bucket a priority must leave untouched for the ones above it
+DEFAULT_RESERVE = {INTERACTIVE: 0.0, BACKGROUND: 0.1, BATCH: 0.25}
+# Longest expected wait a priority accepts before the call is shed
+DEFAULT_MAX_WAIT = {INTERACTIVE: 10.0, BACKGROUND: 120.0, BATCH: 900.0}
+
+_priority = contextvars.ContextVar("extraction_priority", default=INTERACTIVE)
+
+# rpm tokens, tpm tokens, last refill, blocked until
+_STATE = struct.Struct("<4d")
+
+
+class RateLimitExceeded(Exception):
+    """The call would wait longer than its priority allows; retry after retry_after seconds."""
+
+    def __init__(self, priority: str, retry_after: float):
+        super().__init__(f"Model quota exhausted for {priority} calls, retry after {retry_after:.1f}s")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+@contextmanager
+def priority(name: str):
+    """Run the calls made inside the block at this priority."""
+    if name not in PRIORITY_RANKS:
+        raise ValueError(f"Unknown priority {name!r}, expected one of {tuple(PRIORITY_RANKS)}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+async def with_priority(name: str, coro):
+    """Await coro at this priority (for coroutines handed to another thread's loop)."""
+    with priority(name):
+        return await coro
+
+
+class MemoryState:
+    """Bucket state of this process only."""
+
+    def __init__(self):
+        self._values = None
+        self._lock = threading.Lock()
+
+    def update(self, fn: Callable[[Optional[list]], tuple]):
+        """Apply fn to the state under the lock; fn returns (new_state, result)."""
+        with self._lock:
+            self._values, result = fn(self._values)
+            return result
+
+
+class FileState:
+    """Bucket state in a small file locked with flock, shared by every process.
+
+    /dev/shm keeps the file in memory on Linux; any local path works.
+    """
+
+    def __init__(self, path: str):
+        import fcntl
+        self._fcntl = fcntl
+        self.path = path
+        self._fd = None
+        self._pid = None
+        # flock is held per open file, so threads sharing it also need a lock
+        self._lock = threading.Lock()
+
+    def _file(self) -> int:
+        if self._pid != os.getpid():
+            # A descriptor inherited across fork would share the parent's lock
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            self._pid = os.getpid()
+        return self._fd
+
+    def update(self, fn: Callable[[Optional[list]], tuple]):
+        with self._lock:
+            fd = self._file()
+            self._fcntl.flock(fd, self._fcntl.LOCK_EX)
+            try:
+                data = os.pread(fd, _STATE.size, 0)
+                values = list(_STATE.unpack(data)) if len(data) == _STATE.size else None
+                values, result = fn(values)
+                os.pwrite(fd, _STATE.pack(*values), 0)
+                return result
+            finally:
+                self._fcntl.flock(fd, self._fcntl.LOCK_UN)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets with priorities.
+
+    Args:
+        rpm: Requests per minute (0: unlimited)
+        tpm: Estimated tokens per minute (0: unlimited)
+        state: MemoryState or FileState holding the buckets
+        burst_seconds: Bucket capacity in seconds of quota
+        reserve / max_wait: Per-priority overrides of DEFAULT_RESERVE / DEFAULT_MAX_WAIT
+        penalty_seconds: Pause after a 429 reaches the caller
+        poll_interval: Longest sleep between checks of the shared buckets
+    """
+
+    def __init__(self, rpm: float = 0, tpm: float = 0, state=None, burst_seconds: float = 60.0,
+                 reserve: Optional[Dict[str, float]] = None, max_wait: Optional[Dict[str, float]] = None,
+                 penalty_seconds: float = 5.0, poll_interval: float = 0.25,
+                 clock: Callable[[], float] = time.time):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.state = state or MemoryState()
+        self.capacity = (rpm * burst_seconds / 60.0, tpm * burst_seconds / 60.0)
+        self.reserve = {**DEFAULT_RESERVE, **(reserve or {})}
+        self.max_wait = {**DEFAULT_MAX_WAIT, **(max_wait or {})}
+        self.penalty_seconds = penalty_seconds
+        self.poll_interval = poll_interval
+        self.clock = clock
+        # Called as on_acquire(priority, result, waited) with result "ok" or "shed"
+        self.on_acquire = None
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def _refilled(self, values: Optional[list], now: float) -> list:
+        if values is None:
+            return [self.capacity[0], self.capacity[1], now, 0.0]
+        rpm_tokens, tpm_tokens, updated, blocked_until = values
+        elapsed = max(0.0, now - updated)
+        return [
+            min(self.capacity[0], rpm_tokens + elapsed * self.rpm / 60.0),
+            min(self.capacity[1], tpm_tokens + elapsed * self.tpm / 60.0),
+            now,
+            blocked_until,
+        ]
+
+    def try_acquire(self, tokens: float, priority_name: str = INTERACTIVE) -> float:
+        """Take one request and tokens from the buckets if they fit.
+
+        Returns 0.0 when taken, otherwise the expected seconds until they fit.
+        """
+        reserve = self.reserve[priority_name]
+        # A call larger than the bucket could never fit; let it through when full
+        tokens = min(tokens, self.capacity[1] * (1.0 - reserve))
+
+        def take(values):
+            now = self.clock()
+            values = self._refilled(values, now)
+            if values[3] > now:
+                return values, values[3] - now
+            wait = 0.0
+            if self.rpm:
+                missing = 1.0 + reserve * self.capacity[0] - values[0]
+                wait = max(wait, missing * 60.0 / self.rpm)
+            if self.tpm:
+                missing = tokens + reserve * self.capacity[1] - values[1]
+                wait = max(wait, missing * 60.0 / self.tpm)
+            if wait > 0:
+                return values, wait
+            if self.rpm:
+                values[0] -= 1.0
+            if self.tpm:
+                values[1] -= tokens
+            return values, 0.0
+
+        return self.state.update(take)
+
+    def penalize(self, seconds: Optional[float] = None) -> None:
+        """Empty the buckets and block every process for seconds (after a 429)."""
+        seconds = self.penalty_seconds if seconds is None else seconds
+
+        def block(values):
+            now = self.clock()
+            values = self._refilled(values, now)
+            return [0.0, 0.0, now, max(values[3], now + seconds)], None
+
+        self.state.update(block)
+
+    # Waiters of this process queue by (rank, arrival); only the head polls the buckets
+
+    def _enqueue(self, priority_name: str) -> tuple:
+        ticket = (PRIORITY_RANKS[priority_name], next(self._sequence))
+        with self._lock:
+            heapq.heappush(self._waiters, ticket)
+        return ticket
+
+    def _dequeue(self, ticket: tuple) -> None:
+        with self._lock:
+            self._waiters.remove(ticket)
+            heapq.heapify(self._waiters)
+            self._changed.notify_all()
+
+    def _is_head(self, ticket: tuple) -> bool:
+        with self._lock:
+            return self._waiters[0] == ticket
+
+    def _next_step(self, ticket: tuple, tokens: float, priority_name: str, deadline: float) -> float:
+        """0.0 once acquired, else seconds to sleep; raises when the wait is too long."""
+        remaining = deadline - time.monotonic()
+        if self._is_head(ticket):
+            wait = self.try_acquire(tokens, priority_name)
+            if wait == 0.0:
+                return 0.0
+            if wait > remaining:
+                raise RateLimitExceeded(priority_name, wait)
+            return min(wait, self.poll_interval)
+        if remaining <= 0:
+            raise RateLimitExceeded(priority_name, self.poll_interval)
+        return min(self.poll_interval, remaining)
+
+    def _report(self, priority_name: str, result: str, start: float) -> None:
+        if self.on_acquire is not None:
+            self.on_acquire(priority_name, result, time.monotonic() - start)
+
+    def acquire(self, tokens: float = 0.0, priority_name: Optional[str] = None,
+                max_wait: Optional[float] = None) -> float:
+        """Block until the call fits the quota; returns the seconds waited.
+
+        priority_name defaults to the context's priority, max_wait to that
+        priority's limit. Raises RateLimitExceeded instead of waiting longer.
+        """
+        priority_name = priority_name or current_priority()
+        start = time.monotonic()
+        deadline = start + (self.max_wait[priority_name] if max_wait is None else max_wait)
+        ticket = self._enqueue(priority_name)
+        try:
+            while True:
+                delay = self._next_step(ticket, tokens, priority_name, deadline)
+                if delay == 0.0:
+                    break
+                with self._lock:
+                    self._changed.wait(delay)
+        except RateLimitExceeded:
+            self._report(priority_name, "shed", start)
+            raise
+        finally:
+            self._dequeue(ticket)
+        self._report(priority_name, "ok", start)
+        return time.monotonic() - start
+
+    async def aacquire(self, tokens: float = 0.0, priority_name: Optional[str] = None,
+                       max_wait: Optional[float] = None) -> float:
+        """Async counterpart of acquire, sleeping on the event loop."""
+        priority_name = priority_name or current_priority()
+        start = time.monotonic()
+        deadline = start + (self.max_wait[priority_name] if max_wait is None else max_wait)
+        ticket = self._enqueue(priority_name)
+        try:
+            while True:
+                delay = self._next_step(ticket, tokens, priority_name, deadline)
+                if delay == 0.0:
+                    break
+                await asyncio.sleep(delay)
+        except RateLimitExceeded:
+            self._report(priority_name, "shed", start)
+            raise
+        finally:
+            self._dequeue(ticket)
+        self._report(priority_name, "ok", start)
+        return time.monotonic() - start
+
+
+def limiter_from_env() -> Optional[RateLimiter]:
+    """Limiter configured by the environment, or None when no quota is set.
+
+    MODEL_RPM: requests per minute across all processes (default 0, unlimited)
+    MODEL_TPM: estimated tokens per minute (default 0, unlimited)
+    RATE_LIMIT_STATE: shared state file (default ramq-rate-limit in /dev/shm,
+    or the temp directory); "memory" limits each process separately
+    RATE_LIMIT_BURST_SECONDS: bucket capacity in seconds of quota (default 60)
+    RATE_LIMIT_PENALTY_SECONDS: pause of all callers after a 429 (default 5)
+    RATE_LIMIT_MAX_WAIT_INTERACTIVE / _BACKGROUND / _BATCH: longest wait before
+    a call is shed (defaults 10, 120 and 900 seconds)
+    """
+    rpm = float(os.environ.get("MODEL_RPM", "0"))
+    tpm = float(os.environ.get("MODEL_TPM", "0"))
+    if rpm <= 0 and tpm <= 0:
+        return None
+    path = os.environ.get("RATE_LIMIT_STATE")
+    if not path:
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        path = os.path.join(directory, "ramq-rate-limit")
+    state = MemoryState() if path == "memory" else FileState(path)
+    max_wait = {
+        name: float(os.environ[f"RATE_LIMIT_MAX_WAIT_{name.upper()}"])
+        for name in PRIORITY_RANKS if f"RATE_LIMIT_MAX_WAIT_{name.upper()}" in os.environ
+    }
+    return RateLimiter(
+        rpm=max(rpm, 0.0),
+        tpm=max(tpm, 0.0),
+        state=state,
+        burst_seconds=float(os.environ.get("RATE_LIMIT_BURST_SECONDS", "60")),
+        max_wait=max_wait,
+        penalty_seconds=float(os.environ.get("RATE_LIMIT_PENALTY_SECONDS", "5")),
+    )
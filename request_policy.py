@@ -0,0 +1,403 @@
+"""Retry, deadline and hedging policy for model calls.
+
+Every call is split into attempts with their own deadline. Transient
+failures (timeouts, 408/429/5xx) are retried with exponential backoff and
+full jitter within an overall deadline. With hedging enabled, a second
+request is fired once an attempt has been running longer than the recent
+p95 latency, and the first good answer wins.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, List, NamedTuple, Optional, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class AttemptTimeoutError(TimeoutError):
+    """Raised when an attempt does not answer within its deadline."""
+
+
+class AttemptTiming(NamedTuple):
+    call: int
+    attempt: int
+    hedged: bool
+    started: float  # seconds since the call started
+    seconds: float
+    outcome: str  # "ok", "error", "timeout" or "cancelled"
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Timeouts, connection errors and 408/429/5xx responses are transient."""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    return code in RETRYABLE_STATUS_CODES
+
+
+class LatencyTracker:
+    """Rolling window of successful attempt latencies."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * percent / 100))
+        return samples[index]
+
+
+class RequestPolicy:
+    """Deadlines, retries with backoff and optional hedging around a call.
+
+    Args:
+        attempt_timeout: Seconds one attempt may take (None: no limit)
+        deadline: Seconds for the whole call including retries (None: no limit)
+        max_attempts: Attempts per call, hedged requests not counted
+        backoff_base: First retry waits up to this many seconds, doubling per retry
+        backoff_max: Upper bound of the backoff before jitter
+        hedge: Fire a second request when an attempt runs longer than hedge_after
+        hedge_after: Fixed hedge delay in seconds (None: the tracked p95)
+        hedge_min_samples: Latencies needed before the p95 is trusted
+        on_attempt: Called with an AttemptTiming after every attempt
+    """
+
+    def __init__(self, attempt_timeout: Optional[float] = 30.0, deadline: Optional[float] = 90.0,
+                 max_attempts: int = 3, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 hedge: bool = False, hedge_after: Optional[float] = None, hedge_min_samples: int = 20,
+                 max_workers: int = 64, seed: Optional[int] = None,
+                 on_attempt: Optional[Callable[[AttemptTiming], None]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.hedge_min_samples = hedge_min_samples
+        self.max_workers = max_workers
+        self.on_attempt = on_attempt
+        self.clock = clock
+        self.latency = LatencyTracker()
+        self.history = deque(maxlen=1000)
+        self.counters = dict.fromkeys(
+            ("calls", "attempts", "retries", "hedges", "hedge_wins", "timeouts", "errors", "failures"), 0)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    # -- bookkeeping --------------------------------------------------------
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += amount
+
+    def _record(self, timing: AttemptTiming) -> None:
+        with self._lock:
+            self.counters["attempts"] += 1
+            if timing.outcome == "timeout":
+                self.counters["timeouts"] += 1
+            elif timing.outcome == "error":
+                self.counters["errors"] += 1
+            self.history.append(timing)
+        if timing.outcome == "ok":
+            self.latency.add(timing.seconds)
+        if self.on_attempt is not None:
+            self.on_attempt(timing)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+        stats["p50"] = self.latency.percentile(50)
+        stats["p95"] = self.latency.percentile(95)
+        return stats
+
+    def attempts(self, call: Optional[int] = None) -> List[AttemptTiming]:
+        """Recorded attempt timings, optionally for one call number."""
+        with self._lock:
+            return [timing for timing in self.history if call is None or timing.call == call]
+
+    # -- timing decisions ---------------------------------------------------
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if len(self.latency) < self.hedge_min_samples:
+            return None
+        return self.latency.percentile(95)
+
+    def backoff(self, retry: int) -> float:
+        """Full-jitter exponential backoff before retry number `retry` (1-based)."""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (retry - 1)))
+        with self._lock:
+            return self._rng.uniform(0, ceiling)
+
+    def _attempt_budget(self, deadline_at: Optional[float]) -> Optional[float]:
+        budget = self.attempt_timeout
+        if deadline_at is not None:
+            remaining = max(0.0, deadline_at - self.clock())
+            budget = remaining if budget is None else min(budget, remaining)
+        return budget
+
+    def _start_call(self):
+        with self._lock:
+            self.counters["calls"] += 1
+            call = self.counters["calls"]
+        start = self.clock()
+        deadline_at = start + self.deadline if self.deadline is not None else None
+        return call, start, deadline_at
+
+    def _next_delay(self, retry: int, deadline_at: Optional[float]) -> Optional[float]:
+        """Backoff before the next attempt, or None when the deadline leaves no room."""
+        delay = self.backoff(retry)
+        if deadline_at is not None and self.clock() + delay >= deadline_at:
+            return None
+        return delay
+
+    # -- sync ---------------------------------------------------------------
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Threads do not survive a fork, so each worker process builds its own pool
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix="model-call")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def call(self, func: Callable[[], T]) -> T:
+        """Run func under the policy, from a synchronous caller.
+
+        An attempt that misses its deadline is abandoned, not interrupted:
+        its worker thread finishes in the background and the result is dropped.
+        """
+        call, start, deadline_at = self._start_call()
+        last_error = None
+        for attempt in range(1, self.max_attempts + 1):
+            if attempt > 1:
+                delay = self._next_delay(attempt - 1, deadline_at)
+                if delay is None:
+                    break
+                self._count("retries")
+                time.sleep(delay)
+            try:
+                return self._run_attempt(func, call, attempt, start, deadline_at)
+            except Exception as e:
+                last_error = e
+                if not is_retryable(e):
+                    break
+        self._count("failures")
+        raise last_error or AttemptTimeoutError("Model call deadline exceeded")
+
+    def _run_attempt(self, func, call, attempt, start, deadline_at):
+        budget = self._attempt_budget(deadline_at)
+        if budget is not None and budget <= 0:
+            raise AttemptTimeoutError("Model call deadline exceeded")
+        hedge_delay = self.hedge_delay()
+        if budget is None and hedge_delay is None:
+            # Nothing to time out or hedge: call inline
+            return self._finish_inline(func, call, attempt, start)
+
+        executor = self._get_executor()
+        attempt_start = self.clock()
+        started = {executor.submit(self._timed, func): (False, attempt_start)}
+        pending = set(started)
+        first_error = None
+        while pending:
+            elapsed = self.clock() - attempt_start
+            waits = []
+            if budget is not None:
+                waits.append(budget - elapsed)
+            if hedge_delay is not None and len(started) == 1:
+                waits.append(hedge_delay - elapsed)
+            timeout = max(0.0, min(waits)) if waits else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                hedged, future_start = started[future]
+                seconds, result, error = future.result()
+                outcome = "ok" if error is None else "error"
+                self._record(AttemptTiming(call, attempt, hedged, future_start - start, seconds, outcome))
+                if error is None:
+                    if hedged:
+                        self._count("hedge_wins")
+                    self._cancel(started, pending, call, attempt, start)
+                    return result
+                first_error = first_error or error
+
+            if done:
+                continue
+            elapsed = self.clock() - attempt_start
+            if hedge_delay is not None and len(started) == 1 and elapsed >= hedge_delay \
+                    and (budget is None or elapsed < budget):
+                self._count("hedges")
+                hedge = executor.submit(self._timed, func)
+                started[hedge] = (True, self.clock())
+                pending.add(hedge)
+            elif budget is not None and elapsed >= budget:
+                for future in pending:
+                    hedged, future_start = started[future]
+                    self._record(AttemptTiming(call, attempt, hedged, future_start - start,
+                                               self.clock() - future_start, "timeout"))
+                raise AttemptTimeoutError(f"Model call attempt {attempt} timed out after {budget:.1f}s")
+
+        raise first_error
+
+    def _finish_inline(self, func, call, attempt, start):
+        attempt_start = self.clock()
+        seconds, result, error = self._timed(func)
+        self._record(AttemptTiming(call, attempt, False, attempt_start - start, seconds,
+                                   "ok" if error is None else "error"))
+        if error is not None:
+            raise error
+        return result
+
+    def _timed(self, func):
+        started = self.clock()
+        try:
+            result = func()
+        except Exception as e:
+            return self.clock() - started, None, e
+        return self.clock() - started, result, None
+
+    def _cancel(self, started, pending, call, attempt, start):
+        for future in pending:
+            future.cancel()
+            hedged, future_start = started[future]
+            self._record(AttemptTiming(call, attempt, hedged, future_start - start,
+                                       self.clock() - future_start, "cancelled"))
+
+    # -- async --------------------------------------------------------------
+
+    async def acall(self, func: Callable[[], Awaitable[T]]) -> T:
+        """Run the coroutine factory func under the policy; losers are cancelled."""
+        call, start, deadline_at = self._start_call()
+        last_error = None
+        for attempt in range(1, self.max_attempts + 1):
+            if attempt > 1:
+                delay = self._next_delay(attempt - 1, deadline_at)
+                if delay is None:
+                    break
+                self._count("retries")
+                await asyncio.sleep(delay)
+            try:
+                return await self._arun_attempt(func, call, attempt, start, deadline_at)
+            except Exception as e:
+                last_error = e
+                if not is_retryable(e):
+                    break
+        self._count("failures")
+        raise last_error or AttemptTimeoutError("Model call deadline exceeded")
+
+    async def _arun_attempt(self, func, call, attempt, start, deadline_at):
+        budget = self._attempt_budget(deadline_at)
+        if budget is not None and budget <= 0:
+            raise AttemptTimeoutError("Model call deadline exceeded")
+        hedge_delay = self.hedge_delay()
+
+        attempt_start = self.clock()
+        started = {asyncio.ensure_future(self._atimed(func)): (False, attempt_start)}
+        pending = set(started)
+        first_error = None
+        try:
+            while pending:
+                elapsed = self.clock() - attempt_start
+                waits = []
+                if budget is not None:
+                    waits.append(budget - elapsed)
+                if hedge_delay is not None and len(started) == 1:
+                    waits.append(hedge_delay - elapsed)
+                timeout = max(0.0, min(waits)) if waits else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for task in done:
+                    hedged, task_start = started[task]
+                    seconds, result, error = task.result()
+                    outcome = "ok" if error is None else "error"
+                    self._record(AttemptTiming(call, attempt, hedged, task_start - start, seconds, outcome))
+                    if error is None:
+                        if hedged:
+                            self._count("hedge_wins")
+                        self._cancel(started, pending, call, attempt, start)
+                        return result
+                    first_error = first_error or error
+
+                if done:
+                    continue
+                elapsed = self.clock() - attempt_start
+                if hedge_delay is not None and len(started) == 1 and elapsed >= hedge_delay \
+                        and (budget is None or elapsed < budget):
+                    self._count("hedges")
+                    hedge = asyncio.ensure_future(self._atimed(func))
+                    started[hedge] = (True, self.clock())
+                    pending.add(hedge)
+                elif budget is not None and elapsed >= budget:
+                    for task in pending:
+                        hedged, task_start = started[task]
+                        self._record(AttemptTiming(call, attempt, hedged, task_start - start,
+                                                   self.clock() - task_start, "timeout"))
+                    raise AttemptTimeoutError(f"Model call attempt {attempt} timed out after {budget:.1f}s")
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise first_error
+
+    async def _atimed(self, func):
+        started = self.clock()
+        try:
+            result = await func()
+        except Exception as e:
+            return self.clock() - started, None, e
+        return self.clock() - started, result, None
+
+
+def _optional_float(name: str, default: Optional[str]) -> Optional[float]:
+    value = os.environ.get(name, default)
+    if value is None or value.strip().lower() in ("", "none", "off", "0"):
+        return None
+    return float(value)
+
+
+def policy_from_env() -> RequestPolicy:
+    """Build the policy configured by the environment.
+
+    MODEL_ATTEMPT_TIMEOUT: seconds per attempt (default 30, "off" for none)
+    MODEL_DEADLINE: seconds per call including retries (default 90)
+    MODEL_MAX_ATTEMPTS: attempts per call (default 3)
+    MODEL_BACKOFF_BASE / MODEL_BACKOFF_MAX: backoff bounds in seconds (0.5 / 8)
+    MODEL_HEDGE: "1" to hedge slow attempts (default off)
+    MODEL_HEDGE_AFTER: fixed hedge delay in seconds (default: tracked p95)
+    """
+    return RequestPolicy(
+        attempt_timeout=_optional_float("MODEL_ATTEMPT_TIMEOUT", "30"),
+        deadline=_optional_float("MODEL_DEADLINE", "90"),
+        max_attempts=int(os.environ.get("MODEL_MAX_ATTEMPTS", "3")),
+        backoff_base=float(os.environ.get("MODEL_BACKOFF_BASE", "0.5")),
+        backoff_max=float(os.environ.get("MODEL_BACKOFF_MAX", "8")),
+        hedge=os.environ.get("MODEL_HEDGE", "0").strip().lower() in ("1", "true", "yes", "on"),
+        hedge_after=_optional_float("MODEL_HEDGE_AFTER", None),
+    )
@@ -0,0 +1,185 @@
+"""Adaptive choice of the image width sent to the model.
+
+Accuracy/latency curves measured by the size sweep benchmark (tests/bench_sizes.py
+--save-curves) are stored per band of source widths. For each image the
+controller picks the smallest width whose measured accuracy meets the
+target; without curves it falls back to the fixed percentage resize. When
+the extracted RAMQ fails validation, one retry at a higher width is allowed.
+"""
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+DEFAULT_CURVES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resolution_curves.json")
+
+# Source-width bands the harness aggregates into (None: no upper bound)
+BAND_EDGES = (1200, 2400, None)
+
+
+class CurvePoint:
+    """Measured outcome of extractions sent at one width."""
+
+    __slots__ = ("width", "samples", "accuracy", "latency_p50", "bytes_p50")
+
+    def __init__(self, width: int, samples: int, accuracy: float,
+                 latency_p50: Optional[float] = None, bytes_p50: Optional[int] = None):
+        self.width = width
+        self.samples = samples
+        self.accuracy = accuracy
+        self.latency_p50 = latency_p50
+        self.bytes_p50 = bytes_p50
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def band_for(source_width: int) -> Optional[int]:
+    """Upper edge of the band a source width falls into (None for the last band)."""
+    for edge in BAND_EDGES:
+        if edge is None or source_width <= edge:
+            return edge
+    return None
+
+
+def load_curves(path: str) -> Dict[Optional[int], List[CurvePoint]]:
+    with open(path, "r", encoding="utf-8") as handle:
+        data = json.load(handle)
+    curves = {}
+    for band in data.get("bands", []):
+        points = [CurvePoint(**point) for point in band.get("points", [])]
+        curves[band.get("max_source_width")] = sorted(points, key=lambda point: point.width)
+    return curves
+
+
+def save_curves(curves: Dict[Optional[int], List[CurvePoint]], path: str, metadata: Optional[dict] = None) -> None:
+    data = dict(metadata or {})
+    data["bands"] = [
+        {"max_source_width": edge, "points": [point.to_dict() for point in curves[edge]]}
+        for edge in sorted(curves, key=lambda edge: float("inf") if edge is None else edge)
+    ]
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(data, handle, indent=2)
+        handle.write("\n")
+
+
+def _median(values: List[float]) -> Optional[float]:
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def build_curves(measurements: List[dict]) -> Dict[Optional[int], List[CurvePoint]]:
+    """Aggregate harness measurements into per-band curves.
+
+    Each measurement is a dict with source_width, width, valid (bool) and
+    optionally seconds and bytes.
+    """
+    grouped = {}
+    for measurement in measurements:
+        key = (band_for(measurement["source_width"]), measurement["width"])
+        grouped.setdefault(key, []).append(measurement)
+
+    curves = {}
+    for (edge, width), items in grouped.items():
+        latencies = [item["seconds"] for item in items if item.get("seconds") is not None]
+        sizes = [item["bytes"] for item in items if item.get("bytes") is not None]
+        median_bytes = _median(sizes)
+        curves.setdefault(edge, []).append(CurvePoint(
+            width=width,
+            samples=len(items),
+            accuracy=sum(1 for item in items if item["valid"]) / len(items),
+            latency_p50=_median(latencies),
+            bytes_p50=int(median_bytes) if median_bytes is not None else None,
+        ))
+    for points in curves.values():
+        points.sort(key=lambda point: point.width)
+    return curves
+
+
+class ResolutionController:
+    """Pick the width each image is sent at.
+
+    Args:
+        curves: Per-band curve points, as returned by load_curves
+        target_accuracy: Smallest acceptable measured accuracy for a width
+        min_samples: Points measured on fewer images are ignored
+        fallback_percent / min_width: Fixed resize used without usable curves
+        retry_factor: Without curves, a retry is sent this many times wider
+    """
+
+    def __init__(self, curves: Optional[Dict[Optional[int], List[CurvePoint]]] = None,
+                 target_accuracy: float = 0.95, min_samples: int = 3,
+                 fallback_percent: int = 40, min_width: int = 200, retry_factor: float = 2.0):
+        self.curves = curves or {}
+        self.target_accuracy = target_accuracy
+        self.min_samples = min_samples
+        self.fallback_percent = fallback_percent
+        self.min_width = min_width
+        self.retry_factor = retry_factor
+        self.counters = dict.fromkeys(("choices", "retries", "retry_recovered"), 0)
+        self._lock = threading.Lock()
+
+    def _points(self, source_width: int) -> List[CurvePoint]:
+        points = self.curves.get(band_for(source_width), [])
+        return [point for point in points if point.samples >= self.min_samples and point.width <= source_width]
+
+    def _fallback_width(self, source_width: int) -> int:
+        return min(source_width, max(self.min_width, int(source_width * self.fallback_percent / 100)))
+
+    def choose_width(self, source_width: int, source_height: Optional[int] = None) -> int:
+        """Smallest width meeting the accuracy target for this source size."""
+        with self._lock:
+            self.counters["choices"] += 1
+        points = self._points(source_width)
+        if not points:
+            return self._fallback_width(source_width)
+
+        for point in points:
+            if point.accuracy >= self.target_accuracy:
+                return point.width
+        # Nothing meets the target: the most accurate width, then the fastest
+        best = max(points, key=lambda point: (point.accuracy, -(point.latency_p50 or 0.0), -point.width))
+        return best.width
+
+    def retry_width(self, source_width: int, used_width: int) -> Optional[int]:
+        """Width for the single retry after a failed validation (None: no retry)."""
+        if used_width >= source_width:
+            return None
+        points = [point for point in self._points(source_width) if point.width > used_width]
+        if points:
+            # The most accurate wider point, preferring the narrower on ties
+            width = max(points, key=lambda point: (point.accuracy, -point.width)).width
+        else:
+            width = min(source_width, int(used_width * self.retry_factor))
+        return width if width > used_width else None
+
+    def record_retry(self, recovered: bool) -> None:
+        with self._lock:
+            self.counters["retries"] += 1
+            if recovered:
+                self.counters["retry_recovered"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters)
+
+
+def controller_from_env() -> ResolutionController:
+    """Controller configured by the environment.
+
+    RESOLUTION_CURVES: curves JSON path (default resolution_curves.json next
+    to this module; a missing file means the fixed 40% resize)
+    RESOLUTION_TARGET_ACCURACY: accuracy a width must reach (default 0.95)
+    RESOLUTION_MIN_SAMPLES: images a curve point needs (default 3)
+    """
+    path = os.environ.get("RESOLUTION_CURVES", DEFAULT_CURVES_PATH)
+    curves = load_curves(path) if path and os.path.exists(path) else None
+    return ResolutionController(
+        curves,
+        target_accuracy=float(os.environ.get("RESOLUTION_TARGET_ACCURACY", "0.95")),
+        min_samples=int(os.environ.get("RESOLUTION_MIN_SAMPLES", "3")),
+    )
+
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Benchmark preprocess_image against resize_image_percent on 12 MP phone-sized JPEGs.
+
+Run with: python -m tests.bench_image_preprocess [--runs N]
+"""
+
+import argparse
+import statistics
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from anthropic_vision_script import preprocess_image, resize_image_percent
+
+
+def make_photo(width: int = 4032, height: int = 3024) -> bytes:
+    """Build a photo-like JPEG: noisy background with card-like text blocks."""
+    image = Image.effect_noise((width, height), 40).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for row in range(40):
+        y = 200 + row * 60
+        draw.text((300, y), f"TREM 6405 5089  JEAN TREMBLAY {row:02d}", fill=(0, 0, 0))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def time_call(func, data: bytes, runs: int):
+    timings = []
+    output = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = func(data)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image preprocessing paths.")
+    parser.add_argument("--runs", type=int, default=10, help="Timed runs per function")
+    parser.add_argument("--percent", type=int, default=40, help="Target percentage")
+    args = parser.parse_args()
+
+    data = make_photo()
+    print(f"Input: 4032x3024 JPEG, {len(data) / 1024:.0f}KB, {args.runs} runs, {args.percent}%")
+    print(f"{'Function':<22} | {'p50 ms':>8} | {'min ms':>8} | {'Output KB':>9}")
+    print("-" * 56)
+
+    candidates = [
+        ("resize_image_percent", lambda d: resize_image_percent(d, percent=args.percent)),
+        ("preprocess_image", lambda d: preprocess_image(d, percent=args.percent)[0]),
+    ]
+    medians = {}
+    for name, func in candidates:
+        timings, output = time_call(func, data, args.runs)
+        medians[name] = statistics.median(timings)
+        print(f"{name:<22} | {medians[name]:>8.1f} | {min(timings):>8.1f} | {len(output) / 1024:>9.0f}")
+
+    print()
+    print(f"Speedup: {medians['resize_image_percent'] / medians['preprocess_image']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Benchmark cold-start import cost of the entry points with python -X importtime.
+
+Each module is imported in a fresh interpreter from the repository root; the
+report lists its cumulative import time and the slowest modules it pulls in.
+
+Run with: python -m tests.bench_import_time [--modules validators,api,main] [--top 8] [--runs 3]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = ("validators", "api", "main", "anthropic_vision_script")
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """Cumulative import microseconds of every module loaded by `import module`."""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    env.setdefault("GEMINI_API_KEY", "dummy")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, cwd=REPO_ROOT, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import time of the API and CLI entry points.")
+    parser.add_argument("--modules", default=",".join(DEFAULT_MODULES), help="Comma-separated modules to import")
+    parser.add_argument("--top", type=int, default=8, help="Slowest dependencies listed per module")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per module")
+    args = parser.parse_args()
+
+    # Modules the interpreter loads before any import (site and .pth hooks)
+    startup = set(import_times("sys"))
+    for module in args.modules.split(","):
+        runs = [import_times(module) for _ in range(args.runs)]
+        total = statistics.median(times[module] for times in runs)
+        print(f"{module}: {total / 1000:.1f} ms (median of {args.runs})")
+        slowest = sorted(runs[-1].items(), key=lambda item: -item[1])
+        for name, micros in [item for item in slowest if item[0] not in startup and item[0] != module][:args.top]:
+            print(f"    {name:<40} {micros / 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
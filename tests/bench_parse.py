@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark parsing and validating model responses: the schema fast path
+(pydantic model_validate_json) against the lenient json.loads parser.
+
+Run with: python -m tests.bench_parse [--patients N] [--runs N]
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+from anthropic_vision_script import (
+    _parse_patient_list_fallback,
+    _parse_patient_list_response,
+    _parse_ramq_response,
+    _ramq_result_from_data,
+)
+
+
+def make_patient_list(count: int) -> str:
+    return json.dumps({"patients": [
+        {
+            "first_name": f"Prenom{i}",
+            "last_name": f"Nom{i}",
+            "patient_number": str(100000 + i),
+            "room_number": f" {i % 400} " if i % 3 else None,
+        }
+        for i in range(count)
+    ]})
+
+
+PERSON = json.dumps({
+    "first_name": "Jean", "last_name": "Tremblay", "date_of_birth": "1964-05-05",
+    "ramq": "TREJ64050519", "ohip": None, "mrn": "MRN-0001",
+})
+
+
+def time_call(func, runs: int):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model response parsing.")
+    parser.add_argument("--patients", type=int, default=5000, help="Patients in the list response")
+    parser.add_argument("--runs", type=int, default=20, help="Timed runs per parser")
+    args = parser.parse_args()
+
+    patient_list = make_patient_list(args.patients)
+    person_runs = 1000
+    print(f"Patient list: {args.patients} patients, {len(patient_list) / 1024:.0f}KB, {args.runs} runs")
+    print(f"{'Parser':<34} | {'p50 ms':>9}")
+    print("-" * 47)
+
+    rows = [
+        ("patient list, json.loads", lambda: _parse_patient_list_fallback(patient_list), args.runs),
+        ("patient list, model_validate_json", lambda: _parse_patient_list_response(patient_list), args.runs),
+        (f"person x{person_runs}, json.loads",
+         lambda: [_ramq_result_from_data(json.loads(PERSON)) for _ in range(person_runs)], args.runs),
+        (f"person x{person_runs}, model_validate_json",
+         lambda: [_parse_ramq_response(PERSON) for _ in range(person_runs)], args.runs),
+    ]
+    medians = {}
+    for name, func, runs in rows:
+        medians[name] = time_call(func, runs)
+        print(f"{name:<34} | {medians[name]:>9.2f}")
+
+    print()
+    print(f"Patient list speedup: "
+          f"{medians['patient list, json.loads'] / medians['patient list, model_validate_json']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Size sweep benchmark: RAMQ extraction accuracy, latency and payload size per
+image width, format and quality.
+
+The corpus is a local directory of card images with a labels.json holding
+the ground truth of each file:
+
+    {"card_01.jpg": {"ramq": "TREJ64050519", "last_name": "Tremblay",
+                     "first_name": "Jean", "date_of_birth": "1964-05-05"}}
+
+The default "production" format measures what the API sends: the card
+through preprocess_image at each width with RAMQ_IMAGE_PROMPT (the first
+read of get_ramq_from_image). The jpeg, png and webp formats re-encode the
+image here and use the shorter RAMQ_BYTES_PROMPT to compare encodings.
+
+Every (image x width x format x quality) configuration is extracted
+concurrently through the configured model backend (MODEL_BACKEND, or
+--backend fake). Results are appended to a JSONL cache keyed by image hash,
+configuration and model, so re-runs only measure what is new; --fresh
+ignores it. The report is JSON with, per configuration, the RAMQ accuracy
+against the labels, p50/p95 latency and payload bytes.
+
+--baseline compares the report with an earlier one and exits non-zero when
+accuracy drops or latency grows beyond the thresholds. --save-curves stores
+the production measurements for the adaptive resolution controller
+(resolution.py).
+
+Run with: python -m tests.bench_sizes CORPUS_DIR [--widths 200,400,800] [--report report.json]
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+import anthropic_vision_script
+from anthropic_vision_script import (RAMQ_BYTES_PROMPT, RAMQ_IMAGE_PROMPT, get_ramq_from_bytes,
+                                     get_ramq_from_image_at_width, normalize_ramq, preprocess_image)
+from model_backend import fake_backend_from_env
+from resolution import DEFAULT_CURVES_PATH, build_curves, save_curves
+
+DEFAULT_WIDTHS = (100, 200, 400, 800, 1200, 1600)
+# The API's own preprocessing and prompt (get_ramq_from_image)
+PRODUCTION_FORMAT = "production"
+DEFAULT_FORMATS = (PRODUCTION_FORMAT,)
+DEFAULT_QUALITIES = (85,)
+FORMAT_MIME_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+# Lossless formats ignore the quality setting and production uses its own, so they are swept once
+LOSSLESS_FORMATS = ("png", PRODUCTION_FORMAT)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff", ".bmp")
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".bench_sizes_cache.jsonl")
+
+
+class Sample:
+    """One corpus image with its ground truth."""
+
+    __slots__ = ("name", "data", "digest", "labels", "size")
+
+    def __init__(self, name: str, data: bytes, labels: dict):
+        self.name = name
+        self.data = data
+        self.digest = hashlib.sha256(data).hexdigest()
+        self.labels = labels
+        self.size = ImageOps.exif_transpose(Image.open(BytesIO(data))).size
+
+
+def load_corpus(directory: str) -> List[Sample]:
+    """Images of the corpus directory that have a labels.json entry."""
+    with open(os.path.join(directory, "labels.json"), "r", encoding="utf-8") as handle:
+        labels = json.load(handle)
+    samples = []
+    for name in sorted(labels):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        with open(os.path.join(directory, name), "rb") as handle:
+            samples.append(Sample(name, handle.read(), labels[name]))
+    return samples
+
+
+def sweep_configs(widths: Iterable[int], formats: Iterable[str], qualities: Iterable[int]) -> List[Tuple[int, str, Optional[int]]]:
+    configs = []
+    for fmt in formats:
+        for quality in ((None,) if fmt in LOSSLESS_FORMATS else qualities):
+            configs.extend((width, fmt, quality) for width in widths)
+    return configs
+
+
+class Encoder:
+    """Decode each image once, resize once per width and encode per format."""
+
+    def __init__(self):
+        self._resized = {}
+        self._lock = threading.Lock()
+
+    def _resized_image(self, sample: Sample, width: int) -> Image.Image:
+        key = (sample.digest, width)
+        with self._lock:
+            image = self._resized.get(key)
+        if image is None:
+            image = ImageOps.exif_transpose(Image.open(BytesIO(sample.data)))
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            if width < image.width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            with self._lock:
+                self._resized[key] = image
+        return image
+
+    def encode(self, sample: Sample, width: int, fmt: str, quality: Optional[int]) -> bytes:
+        buffer = BytesIO()
+        options = {} if quality is None else {"quality": quality}
+        self._resized_image(sample, width).save(buffer, format=fmt.upper(), **options)
+        return buffer.getvalue()
+
+
+def _normalized(value) -> Optional[str]:
+    return " ".join(str(value).split()).casefold() if value is not None else None
+
+
+def _matches(expected, actual) -> bool:
+    return _normalized(expected) == _normalized(actual)
+
+
+def score(labels: dict, extraction: tuple) -> Dict[str, bool]:
+    """Per-field correctness of a get_ramq_from_bytes/get_ramq_from_image result against the labels."""
+    ramq, last_name, first_name, dob, _, valid = extraction[:6]
+    fields = {
+        "ramq": (normalize_ramq(labels.get("ramq")), ramq),
+        "last_name": (labels.get("last_name"), last_name),
+        "first_name": (labels.get("first_name"), first_name),
+        "date_of_birth": (labels.get("date_of_birth"), dob.strftime("%Y-%m-%d") if dob else None),
+    }
+    result = {name: _matches(expected, actual) for name, (expected, actual) in fields.items() if name in labels}
+    result["valid"] = bool(valid)
+    return result
+
+
+class ResultCache:
+    """Append-only JSONL store of earlier measurements."""
+
+    def __init__(self, path: Optional[str], load: bool = True):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if load and path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as handle:
+                for line in handle:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry["key"]] = entry
+
+    @staticmethod
+    def key(sample: Sample, config: Tuple[int, str, Optional[int]], model: str) -> str:
+        width, fmt, quality = config
+        prompt = RAMQ_IMAGE_PROMPT if fmt == PRODUCTION_FORMAT else RAMQ_BYTES_PROMPT
+        prompt = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+        return f"{sample.digest}:{width}:{fmt}:{quality}:{model}:{prompt}"
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.entries.get(key)
+
+    def put(self, entry: dict) -> None:
+        with self._lock:
+            self.entries[entry["key"]] = entry
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as handle:
+                    handle.write(json.dumps(entry) + "\n")
+
+
+def measure(sample: Sample, config: Tuple[int, str, Optional[int]], encoder: Encoder) -> dict:
+    width, fmt, quality = config
+    if fmt == PRODUCTION_FORMAT:
+        # Payload as sent; the timed call resizes again, as production does per request
+        data = preprocess_image(sample.data, width=width)[0]
+    else:
+        data = encoder.encode(sample, width, fmt, quality)
+    entry = {"image": sample.name, "source_width": sample.size[0], "width": width, "format": fmt,
+             "quality": quality, "bytes": len(data)}
+    start = time.perf_counter()
+    try:
+        if fmt == PRODUCTION_FORMAT:
+            extraction = get_ramq_from_image_at_width(sample.data, width)
+        else:
+            extraction = get_ramq_from_bytes(data, FORMAT_MIME_TYPES[fmt])
+    except ValueError as e:
+        entry.update(seconds=time.perf_counter() - start, error=str(e)[:200])
+        return entry
+    entry.update(seconds=time.perf_counter() - start, fields=score(sample.labels, extraction))
+    return entry
+
+
+def run_sweep(samples: List[Sample], configs: List[Tuple[int, str, Optional[int]]], workers: int = 8,
+              cache: Optional[ResultCache] = None, progress=None) -> List[dict]:
+    """Measure every sample at every configuration it can be sent at (no upscaling)."""
+    cache = cache or ResultCache(None)
+    model = anthropic_vision_script.get_model_backend().model
+    encoder = Encoder()
+    results, pending = [], []
+    for sample in samples:
+        for config in configs:
+            if config[0] > sample.size[0]:
+                continue
+            key = ResultCache.key(sample, config, model)
+            cached = cache.get(key)
+            if cached is not None:
+                results.append(dict(cached, cached=True))
+            else:
+                pending.append((key, sample, config))
+
+    def run(item):
+        key, sample, config = item
+        entry = dict(measure(sample, config, encoder), key=key)
+        if "error" not in entry:
+            cache.put(entry)
+        if progress:
+            progress(entry)
+        return entry
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results.extend(pool.map(run, pending))
+    return results
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(results: List[dict]) -> List[dict]:
+    """Accuracy, latency and payload statistics per configuration."""
+    grouped = {}
+    for entry in results:
+        grouped.setdefault((entry["width"], entry["format"], entry["quality"]), []).append(entry)
+
+    summary = []
+    for (width, fmt, quality), entries in sorted(grouped.items(), key=lambda item: (item[0][1], item[0][2] or 0, item[0][0])):
+        scored = [entry["fields"] for entry in entries if "fields" in entry]
+        latencies = [entry["seconds"] for entry in entries if "fields" in entry]
+        sizes = [entry["bytes"] for entry in entries]
+        field_names = sorted({name for fields in scored for name in fields if name != "valid"})
+        summary.append({
+            "width": width,
+            "format": fmt,
+            "quality": quality,
+            "samples": len(entries),
+            "errors": len(entries) - len(scored),
+            # Errors count as wrong answers
+            "accuracy": sum(1 for fields in scored if fields.get("ramq")) / len(entries),
+            "valid_rate": sum(1 for fields in scored if fields["valid"]) / len(entries),
+            "field_accuracy": {
+                name: sum(1 for fields in scored if fields.get(name)) / len(entries) for name in field_names
+            },
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "bytes_p50": percentile(sizes, 50),
+            "bytes_p95": percentile(sizes, 95),
+        })
+    return summary
+
+
+def compare(report: dict, baseline: dict, max_accuracy_drop: float = 0.02,
+            max_latency_increase: float = 0.25) -> List[str]:
+    """Regressions of report against baseline, one message per configuration."""
+    previous = {(row["width"], row["format"], row["quality"]): row for row in baseline.get("configs", [])}
+    regressions = []
+    for row in report["configs"]:
+        label = f"{row['width']}px {row['format']}" + (f" q{row['quality']}" if row["quality"] else "")
+        before = previous.get((row["width"], row["format"], row["quality"]))
+        if before is None:
+            continue
+        if row["accuracy"] < before["accuracy"] - max_accuracy_drop:
+            regressions.append(f"{label}: accuracy {before['accuracy']:.1%} -> {row['accuracy']:.1%}")
+        if (row["latency_p95"] is not None and before.get("latency_p95")
+                and row["latency_p95"] > before["latency_p95"] * (1 + max_latency_increase)):
+            regressions.append(f"{label}: p95 {before['latency_p95']:.2f}s -> {row['latency_p95']:.2f}s")
+    return regressions
+
+
+def curve_measurements(results: List[dict], fmt: str = PRODUCTION_FORMAT, quality: Optional[int] = None) -> List[dict]:
+    """Measurements of one format/quality for resolution.build_curves; errors count as failures."""
+    return [
+        {
+            "source_width": entry["source_width"],
+            "width": entry["width"],
+            "valid": bool(entry.get("fields", {}).get("ramq")),
+            "seconds": entry.get("seconds"),
+            "bytes": entry["bytes"],
+        }
+        for entry in results
+        if entry["format"] == fmt and entry["quality"] == quality
+    ]
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(value) for value in text.split(",") if value]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Sweep RAMQ extraction over image widths, formats and qualities.")
+    parser.add_argument("corpus", help="Directory of card images with a labels.json ground truth file")
+    parser.add_argument("--widths", type=_int_list, default=list(DEFAULT_WIDTHS), help="Comma-separated widths")
+    parser.add_argument("--formats", default=",".join(DEFAULT_FORMATS),
+                        help=f"Comma-separated formats among {PRODUCTION_FORMAT}, {', '.join(FORMAT_MIME_TYPES)}")
+    parser.add_argument("--qualities", type=_int_list, default=list(DEFAULT_QUALITIES),
+                        help="Comma-separated JPEG/WebP qualities")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent extractions")
+    parser.add_argument("--backend", choices=["env", "fake"], default="env",
+                        help="Model backend: as configured by MODEL_BACKEND, or the in-process fake")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="JSONL cache of earlier measurements")
+    parser.add_argument("--fresh", action="store_true", help="Ignore cached measurements")
+    parser.add_argument("--report", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="Earlier report to check for regressions")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.02)
+    parser.add_argument("--max-latency-increase", type=float, default=0.25, help="Allowed p95 growth (fraction)")
+    parser.add_argument("--save-curves", nargs="?", const=DEFAULT_CURVES_PATH, default=None,
+                        help=f"Store production accuracy/latency curves (default path: {DEFAULT_CURVES_PATH})")
+    args = parser.parse_args(argv)
+
+    formats = [fmt.strip().lower() for fmt in args.formats.split(",") if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in FORMAT_MIME_TYPES and fmt != PRODUCTION_FORMAT]
+    if unknown:
+        parser.error(f"Unknown format(s): {', '.join(unknown)}")
+    if args.save_curves and PRODUCTION_FORMAT not in formats:
+        parser.error(f"--save-curves needs the {PRODUCTION_FORMAT} format, which the resolution controller serves")
+    if args.backend == "fake":
+        anthropic_vision_script.set_model_backend(fake_backend_from_env())
+    # Measure the model, not the response cache
+    anthropic_vision_script.configure_extraction_cache(None)
+
+    samples = load_corpus(args.corpus)
+    configs = sweep_configs(args.widths, formats, args.qualities)
+    cache = ResultCache(args.cache, load=not args.fresh)
+    done = [0]
+
+    def progress(entry):
+        done[0] += 1
+        status = entry.get("error") or ("ok" if entry["fields"].get("ramq") else "wrong")
+        print(f"[{done[0]}] {entry['image']} {entry['width']}px {entry['format']}: {status} "
+              f"({entry['seconds']:.2f}s, {entry['bytes'] / 1024:.0f}KB)", file=sys.stderr)
+
+    start = time.perf_counter()
+    results = run_sweep(samples, configs, args.workers, cache, progress)
+    report = {
+        "measured": datetime.now().isoformat(timespec="seconds"),
+        "model": anthropic_vision_script.get_model_backend().model,
+        "images": len(samples),
+        "measurements": len(results),
+        "cached": sum(1 for entry in results if entry.get("cached")),
+        "seconds": round(time.perf_counter() - start, 3),
+        "configs": summarize(results),
+    }
+    text = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+    else:
+        print(text)
+
+    if args.save_curves:
+        save_curves(build_curves(curve_measurements(results)), args.save_curves, {
+            "measured": datetime.now().strftime("%Y-%m-%d"),
+            "images": len(samples),
+            "format": PRODUCTION_FORMAT,
+        })
+        print(f"Curves saved to: {args.save_curves}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as handle:
+            regressions = compare(report, json.load(handle), args.max_accuracy_drop, args.max_latency_increase)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
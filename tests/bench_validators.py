@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark the per-record validators (validators.py) against the
+implementations they replaced: inline re patterns, string-built RAMQ check
+digits and a strptime loop over six date formats.
+
+The inputs mix well-formed, messy and invalid values the way batch
+reconciliation sees them. Per-call cost is the best of --repeat timed loops.
+
+Run with: python -m tests.bench_validators [--records 2000] [--repeat 5]
+"""
+
+import argparse
+import random
+import re
+import string
+import time
+from datetime import datetime
+from typing import Callable, List, Optional
+
+import validators
+from validators import RAMQ_CHAR_VALUES, RAMQ_MULTIPLIERS
+
+
+# -- reference implementations (before the validators module) ---------------
+
+def reference_validate_ramq(ramq: str) -> bool:
+    if len(ramq) != 12:
+        return False
+    name, year, month, day, sequence = ramq[:4], ramq[4:6], ramq[6:8], ramq[8:10], ramq[10]
+    check_digit = int(ramq[11])
+    current_year = datetime.now().year
+    full_year = f"19{year}" if int(year) > 50 else f"20{year}"
+    if int(full_year) > current_year:
+        full_year = str(int(full_year) - 100)
+    month_num = int(month)
+    sex = "M"
+    if month_num > 50:
+        month_num -= 50
+        sex = "F"
+
+    def check(nam_decomposed):
+        return sum(RAMQ_CHAR_VALUES[char] * mult for char, mult in zip(nam_decomposed, RAMQ_MULTIPLIERS)) % 10
+
+    calculated = check(name + full_year + sex + f"{month_num:02d}" + day + sequence)
+    if calculated != check_digit and full_year.startswith("20"):
+        full_year = str(int(full_year) - 100)
+        calculated = check(name + full_year + sex + f"{month_num:02d}" + day + sequence)
+    return calculated == check_digit
+
+
+def reference_normalize_ohip(ohip: Optional[str]) -> Optional[dict]:
+    if not ohip:
+        return None
+    compact = re.sub(r"[\s\-]+", "", str(ohip)).upper()
+    match = re.fullmatch(r"(\d{10})([A-Z]{2})?", compact)
+    if not match:
+        return None
+    return {"number": match.group(1), "version_code": match.group(2) or None}
+
+
+def reference_validate_ohip(ohip: str) -> bool:
+    compact = re.sub(r"[\s\-]+", "", str(ohip)).upper()
+    return bool(re.fullmatch(r"\d{10}([A-Z]{2})?", compact))
+
+
+def reference_normalize_ramq(ramq: Optional[str]) -> Optional[str]:
+    if not ramq:
+        return None
+    compact = re.sub(r"\s+", "", str(ramq)).upper()
+    if re.fullmatch(r"[A-Z]{4}\d{8}", compact):
+        return compact
+    match = re.search(r"[A-Z]{4}\d{8}", compact)
+    return match.group(0) if match else None
+
+
+def reference_parse_date_string(date_text: Optional[str]) -> Optional[datetime]:
+    if not date_text:
+        return None
+    cleaned = str(date_text).strip()
+    if not cleaned:
+        return None
+    for fmt in ("%Y-%m-%d", "%Y/%m/%d", "%d-%m-%Y", "%d/%m/%Y", "%m-%d-%Y", "%m/%d/%Y"):
+        try:
+            return datetime.strptime(cleaned, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+# -- inputs -------------------------------------------------------------------
+
+def make_ramq(rng: random.Random) -> str:
+    """A RAMQ with a correct check digit about half the time."""
+    letters = "".join(rng.choice(string.ascii_uppercase) for _ in range(4))
+    month = rng.randint(1, 12) + (50 if rng.random() < 0.5 else 0)
+    body = f"{letters}{rng.randint(0, 99):02d}{month:02d}{rng.randint(1, 28):02d}{rng.randint(1, 9)}"
+    for digit in string.digits:
+        if reference_validate_ramq(body + digit):
+            return body + (digit if rng.random() < 0.5 else str((int(digit) + 1) % 10))
+    return body + "0"
+
+
+def make_ohip(rng: random.Random) -> str:
+    digits = "".join(rng.choice(string.digits) for _ in range(rng.choice((10, 10, 10, 9))))
+    version = rng.choice(("", "", "AB", "ab", "X"))
+    if rng.random() < 0.5:
+        return f"{digits[:4]} {digits[4:7]}-{digits[7:]} {version}".strip()
+    return digits + version
+
+
+def make_date(rng: random.Random) -> str:
+    year, month, day = rng.randint(1930, 2024), rng.randint(1, 12), rng.randint(1, 28)
+    separator = rng.choice("-/")
+    shape = rng.choice(("ymd", "ymd", "dmy", "mdy", "text"))
+    if shape == "ymd":
+        return f"{year}{separator}{month:02d}{separator}{day:02d}"
+    if shape == "dmy":
+        return f"{day:02d}{separator}{month:02d}{separator}{year}"
+    if shape == "mdy":
+        # Day above 12, so the day-first reading fails and month-first is used
+        return f"{month:02d}{separator}{max(day, 13)}{separator}{year}"
+    return f"{year}{month:02d}{day:02d}"
+
+
+def make_inputs(records: int, seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    ramqs = [make_ramq(rng) for _ in range(records)]
+    return {
+        "ramq": ramqs,
+        "raw_ramq": [f" {ramq[:4]} {ramq[4:8]} {ramq[8:].lower()}" if index % 2 else ramq
+                     for index, ramq in enumerate(ramqs)],
+        "ohip": [make_ohip(rng) for _ in range(records)],
+        "date": [make_date(rng) for _ in range(records)],
+    }
+
+
+def per_call_ns(func: Callable, values: List, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for value in values:
+            func(value)
+        best = min(best, time.perf_counter_ns() - start)
+    return best / len(values)
+
+
+CASES = [
+    ("validate_ramq", "ramq", validators.validate_ramq, reference_validate_ramq),
+    ("check_ramq", "ramq", validators.check_ramq, None),
+    ("normalize_ramq", "raw_ramq", validators.normalize_ramq, reference_normalize_ramq),
+    ("validate_ohip", "ohip", validators.validate_ohip, reference_validate_ohip),
+    ("normalize_ohip", "ohip", validators.normalize_ohip, reference_normalize_ohip),
+    ("check_ohip", "ohip", validators.check_ohip, None),
+    ("parse_date_string", "date", validators.parse_date_string, reference_parse_date_string),
+]
+
+
+def run(records: int, repeat: int) -> List[dict]:
+    inputs = make_inputs(records)
+    rows = []
+    for name, kind, func, reference in CASES:
+        values = inputs[kind]
+        rows.append({
+            "validator": name,
+            "ns_per_call": per_call_ns(func, values, repeat),
+            "reference_ns_per_call": per_call_ns(reference, values, repeat) if reference else None,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-record validators.")
+    parser.add_argument("--records", type=int, default=2000, help="Inputs per validator")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed loops; the best is reported")
+    args = parser.parse_args()
+
+    print(f"{args.records} inputs per validator, best of {args.repeat}")
+    print(f"{'Validator':<20} | {'ns/call':>9} | {'before':>9} | {'speedup':>7}")
+    print("-" * 54)
+    for row in run(args.records, args.repeat):
+        before = row["reference_ns_per_call"]
+        speedup = f"{before / row['ns_per_call']:.1f}x" if before else "-"
+        before_text = f"{before:9.0f}" if before else f"{'-':>9}"
+        print(f"{row['validator']:<20} | {row['ns_per_call']:9.0f} | {before_text} | {speedup:>7}")
+
+
+if __name__ == "__main__":
+    main()
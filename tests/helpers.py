@@ -0,0 +1,34 @@
+"""Shared test fixtures: a controllable clock and blank JPEG images."""
+from io import BytesIO
+
+from PIL import Image
+
+CARD_SIZE = (1200, 760)
+
+
+class FakeClock:
+    """time.time stand-in that only moves when a test advances `now`."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def jpeg_bytes(width=300, height=200, orientation=None):
+    """A blank white JPEG, optionally with an EXIF orientation tag."""
+    image = Image.new("RGB", (width, height), "white")
+    buffer = BytesIO()
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        image.save(buffer, format="JPEG", exif=exif)
+    else:
+        image.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def card_bytes(size=CARD_SIZE):
+    """A blank JPEG the size of a health card photo."""
+    return jpeg_bytes(*size)
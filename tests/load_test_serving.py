@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Load test for /extract_json_from_image.
+
+By default the model is replaced by a FakeBackend with a fixed latency and
+two in-process servers are compared:
+
+  serialized: one request at a time, each extraction blocking its request
+              (how the old development server behaved under load)
+  async:      threaded server with extractions on the shared event loop
+              (how gunicorn.conf.py serves each worker)
+
+Pass --url to load-test an already running server instead, e.g. one started
+with `gunicorn -c gunicorn.conf.py api:app`.
+
+Run with: python -m tests.load_test_serving [--requests N] [--concurrency C]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import threading
+import time
+from unittest import mock
+
+import httpx
+from werkzeug.serving import make_server
+
+import anthropic_vision_script
+import api
+from model_backend import FakeBackend
+
+TOKEN = "load-test-token"
+
+
+async def run_load(url: str, token: str, requests: int, concurrency: int):
+    payload = {"is_image": False, "text": "Jean Tremblay TREM64055089"}
+    headers = {"RAMQ-Billr-API-Key": token}
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=300) as client:
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(f"{url}/extract_json_from_image", json=payload, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code != 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": elapsed,
+        "rps": requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+def serve(threaded: bool):
+    server = make_server("127.0.0.1", 0, api.app, threaded=threaded)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def print_result(name: str, result: dict):
+    print(
+        f"{name:<12} | {result['rps']:>8.1f} | {result['p50_ms']:>8.0f} | "
+        f"{result['p95_ms']:>8.0f} | {result['errors']:>6}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /extract_json_from_image.")
+    parser.add_argument("--requests", type=int, default=100, help="Total requests")
+    parser.add_argument("--concurrency", type=int, default=25, help="Concurrent client connections")
+    parser.add_argument("--latency", type=float, default=0.2, help="FakeBackend latency (seconds)")
+    parser.add_argument("--url", type=str, help="Load-test a running server instead")
+    args = parser.parse_args()
+
+    print(f"{'Server':<12} | {'req/s':>8} | {'p50 ms':>8} | {'p95 ms':>8} | {'errors':>6}")
+    print("-" * 56)
+
+    if args.url:
+        token = os.environ.get("HEADER_TOKEN", "")
+        print_result("remote", asyncio.run(run_load(args.url, token, args.requests, args.concurrency)))
+        return
+
+    os.environ["HEADER_TOKEN"] = TOKEN
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    # Identical payloads would otherwise be served from the extraction cache
+    anthropic_vision_script.configure_extraction_cache(None)
+    anthropic_vision_script.set_model_backend(FakeBackend(latency=args.latency))
+
+    # Serialized: single-threaded server, each extraction runs in its request
+    with mock.patch.object(api, "run_async", asyncio.run):
+        server, url = serve(threaded=False)
+        try:
+            print_result("serialized", asyncio.run(run_load(url, TOKEN, args.requests, args.concurrency)))
+        finally:
+            server.shutdown()
+
+    # Async: threaded server, extractions overlap on the shared event loop
+    server, url = serve(threaded=True)
+    try:
+        print_result("async", asyncio.run(run_load(url, TOKEN, args.requests, args.concurrency)))
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
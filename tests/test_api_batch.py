@@ -0,0 +1,101 @@
+import io
+import json
+import os
+import unittest
+from unittest import mock
+
+import api
+from anthropic_vision_script import validate_ramq
+
+
+class TestBatchValidationEndpoints(unittest.TestCase):
+    def setUp(self):
+        os.environ["HEADER_TOKEN"] = "test-token"
+        self.client = api.app.test_client()
+        self.headers = {"RAMQ-Billr-API-Key": "test-token"}
+
+    def post_lines(self, path, data, content_type):
+        response = self.client.post(path, data=data, headers=self.headers, content_type=content_type)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    def test_ramq_batch_json_array(self):
+        ramqs = ["TREM64055089", "ABCD90010111", "bad"]
+        results = self.post_lines("/validate_ramq/batch", json.dumps(ramqs), "application/json")
+
+        self.assertEqual([r["ramq"] for r in results], ramqs)
+        self.assertEqual(results[0]["valid"], validate_ramq("TREM64055089"))
+        self.assertEqual(results[1]["valid"], validate_ramq("ABCD90010111"))
+        self.assertFalse(results[2]["valid"])
+        self.assertIn("error", results[2])
+
+    def test_ramq_batch_newline_delimited(self):
+        body = "TREM64055089\n\nABCD90010111\r\n"
+        results = self.post_lines("/validate_ramq/batch", body, "text/plain")
+        self.assertEqual([r["ramq"] for r in results], ["TREM64055089", "ABCD90010111"])
+
+    def test_ohip_batch(self):
+        body = json.dumps(["1234 567 890 ab", "12345", 42])
+        results = self.post_lines("/validate_ohip/batch", body, "application/json")
+        self.assertEqual(
+            results,
+            [
+                {"ohip": "1234 567 890 ab", "valid": True, "number": "1234567890", "version_code": "AB"},
+                {"ohip": "12345", "valid": False, "number": None, "version_code": None},
+                {"ohip": 42, "valid": False, "number": None, "version_code": None},
+            ],
+        )
+
+    def test_large_array_is_read_in_chunks(self):
+        ramqs = [f"ABCD9001{i % 100:02d}{i % 10}{i % 7}" for i in range(20000)]
+        body = io.BytesIO(json.dumps(ramqs).encode("utf-8"))
+        results = self.post_lines("/validate_ramq/batch", body, "application/json")
+        self.assertEqual(len(results), len(ramqs))
+        self.assertEqual([r["valid"] for r in results[:50]], [validate_ramq(r) for r in ramqs[:50]])
+
+    def test_malformed_json_reports_error_line(self):
+        results = self.post_lines("/validate_ramq/batch", '["TREM64055089", oops]', "application/json")
+        self.assertEqual(results[0]["ramq"], "TREM64055089")
+        self.assertIn("error", results[-1])
+
+    def test_empty_array(self):
+        self.assertEqual(self.post_lines("/validate_ohip/batch", " [ ] ", "application/json"), [])
+
+    def test_requires_token(self):
+        response = self.client.post("/validate_ramq/batch", data="[]", content_type="application/json")
+        self.assertEqual(response.status_code, 401)
+
+
+class TestIterJsonArray(unittest.TestCase):
+    def test_values_split_across_reads(self):
+        original = api.BATCH_READ_SIZE
+        api.BATCH_READ_SIZE = 3
+        try:
+            values = list(api._iter_json_array(io.BytesIO(b'[12345, "a\\u00e9b", {"k": [1, 2]}, "\xc3\xa9"]')))
+        finally:
+            api.BATCH_READ_SIZE = original
+        self.assertEqual(values, [12345, "aéb", {"k": [1, 2]}, "é"])
+
+    def test_numbers_cut_by_a_read(self):
+        body = b"[" + b", ".join(b"1.5e+3" for _ in range(50)) + b", -Infinity, true]"
+        for size in (1, 2, 3, 5, 7):
+            with mock.patch.object(api, "BATCH_READ_SIZE", size):
+                values = list(api._iter_json_array(io.BytesIO(body)))
+            self.assertEqual(values, [1500.0] * 50 + [float("-inf"), True], size)
+
+    def test_malformed_value_fails_without_reading_the_rest(self):
+        stream = io.BytesIO(b'[1, x, ' + b'"TREM64055089", ' * 100000 + b'2]')
+        with self.assertRaisesRegex(ValueError, "Invalid JSON value"):
+            list(api._iter_json_array(stream))
+        self.assertLessEqual(stream.tell(), api.BATCH_READ_SIZE)
+
+    def test_value_size_is_limited(self):
+        stream = io.BytesIO(b'["' + b"x" * (api.BATCH_MAX_ITEM_CHARS * 4) + b'"]')
+        with self.assertRaisesRegex(ValueError, "too large"):
+            list(api._iter_json_array(stream))
+        self.assertLessEqual(stream.tell(), api.BATCH_MAX_ITEM_CHARS + 2 * api.BATCH_READ_SIZE)
+
+
+if __name__ == "__main__":
+    unittest.main()
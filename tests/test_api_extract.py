@@ -0,0 +1,60 @@
+import os
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import api
+
+RESULT = (
+    "TREM64055089", "Tremblay", "Jean", datetime(1964, 5, 5), "female", True,
+    "123", None, False, "RAMQ", "TREM64055089",
+)
+
+
+class TestExtractJsonFromImage(unittest.TestCase):
+    def setUp(self):
+        os.environ["HEADER_TOKEN"] = "test-token"
+        self.client = api.app.test_client()
+        self.headers = {"RAMQ-Billr-API-Key": "test-token"}
+
+    def test_runs_extraction_on_async_path(self):
+        calls = []
+
+        async def fake_aget_ramq(input_data, is_image=True, repair=None):
+            calls.append((input_data, is_image))
+            return RESULT
+
+        with mock.patch.object(api, "aget_ramq", fake_aget_ramq):
+            response = self.client.post(
+                "/extract_json_from_image",
+                json={"is_image": True, "image_url": "https://x/card.jpg"},
+                headers=self.headers,
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(calls, [("https://x/card.jpg", True)])
+        body = response.get_json()
+        self.assertEqual(body["ramq"], "TREM64055089")
+        self.assertEqual(body["dob"], "1964-05-05")
+        self.assertEqual(body["insurance_type"], "RAMQ")
+
+    def test_extraction_errors_are_reported(self):
+        async def failing(input_data, is_image=True, repair=None):
+            raise ValueError("Error processing image: boom")
+
+        with mock.patch.object(api, "aget_ramq", failing):
+            response = self.client.post(
+                "/extract_json_from_image",
+                json={"is_image": False, "text": "Jean"},
+                headers=self.headers,
+            )
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.get_json()["error"], "Error processing image: boom")
+
+    def test_missing_fields(self):
+        response = self.client.post("/extract_json_from_image", json={"is_image": True}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import mmap
+import os
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from PIL import Image
+
+import anthropic_vision_script
+import api
+from model_backend import FakeBackend
+from tests.helpers import card_bytes
+
+
+class TestExtractUpload(unittest.TestCase):
+    def setUp(self):
+        os.environ["HEADER_TOKEN"] = "test-token"
+        self.headers = {"RAMQ-Billr-API-Key": "test-token"}
+        self.client = api.app.test_client()
+        self.addCleanup(anthropic_vision_script.configure_extraction_cache, anthropic_vision_script.extraction_cache)
+        self.addCleanup(anthropic_vision_script.set_model_backend, anthropic_vision_script.get_model_backend())
+        anthropic_vision_script.configure_extraction_cache(None)
+        self.backend = FakeBackend()
+        anthropic_vision_script.set_model_backend(self.backend)
+
+        # Uploads never go through the downloaders
+        for name in ("download_image", "adownload_image"):
+            patcher = mock.patch.object(anthropic_vision_script, name, side_effect=AssertionError("downloaded"))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_raw_body(self):
+        response = self.client.post("/extract_upload", data=card_bytes(), content_type="image/jpeg",
+                                    headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(body["ramq"], "TREJ64050519")
+        self.assertEqual(body["dob"], "1964-05-05")
+        self.assertEqual(self.backend.calls, 1)
+
+    def test_multipart(self):
+        response = self.client.post(
+            "/extract_upload",
+            data={"image": (BytesIO(card_bytes()), "card.jpg"), "repair": "true"},
+            content_type="multipart/form-data",
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()["valid_ramq"])
+
+    def test_large_upload_is_spooled_to_disk(self):
+        data = card_bytes((3000, 2000))
+        opened = []
+        real_open = anthropic_vision_script._open_image
+
+        def open_image(image_data):
+            opened.append(image_data)
+            return real_open(image_data)
+
+        with mock.patch.object(api, "UPLOAD_SPOOL_BYTES", 1024), \
+                mock.patch.object(anthropic_vision_script, "_open_image", open_image):
+            response = self.client.post("/extract_upload", data=data, content_type="application/octet-stream",
+                                        headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        # The extraction read the mapped temp file in place, never a bytes copy of it
+        self.assertTrue(opened)
+        for image_data in opened:
+            self.assertIsInstance(image_data, memoryview)
+            self.assertIsInstance(image_data.obj, mmap.mmap)
+
+    def test_read_upload(self):
+        data = card_bytes((3000, 2000))
+        self.assertEqual(api._read_upload(BytesIO(data)), data)
+        self.assertIsInstance(api._read_upload(BytesIO(data)), bytes)
+        with mock.patch.object(api, "UPLOAD_SPOOL_BYTES", 1024):
+            view = api._read_upload(BytesIO(data))
+        self.assertIsInstance(view, memoryview)
+        self.assertTrue(view.readonly)
+        self.assertEqual(view, data)
+        self.assertEqual(anthropic_vision_script.image_dimensions(view), (3000, 2000))
+        resized, _ = anthropic_vision_script.preprocess_image(view, width=600)
+        self.assertEqual(Image.open(BytesIO(resized)).size, (600, 400))
+        self.assertEqual(anthropic_vision_script.make_cache_key(view, "p", "m"),
+                         anthropic_vision_script.make_cache_key(data, "p", "m"))
+
+    def test_rejections(self):
+        with mock.patch.object(api, "UPLOAD_MAX_BYTES", 100):
+            response = self.client.post("/extract_upload", data=card_bytes(), content_type="image/jpeg",
+                                        headers=self.headers)
+        self.assertEqual(response.status_code, 413)
+
+        response = self.client.post("/extract_upload", data=b"", content_type="image/jpeg", headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/extract_upload", json={"image_url": "x"}, headers=self.headers)
+        self.assertEqual(response.status_code, 415)
+        response = self.client.post("/extract_upload", data={"other": "x"}, content_type="multipart/form-data",
+                                    headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_uploads_share_the_extraction_cache(self):
+        anthropic_vision_script.configure_extraction_cache(anthropic_vision_script.ExtractionCache())
+        data = card_bytes()
+        for _ in range(2):
+            self.client.post("/extract_upload", data=data, content_type="image/jpeg", headers=self.headers)
+        self.assertEqual(self.backend.calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+import httpx
+
+import anthropic_vision_script
+from anthropic_vision_script import aget_patient_list, aget_ramq, set_extraction_concurrency
+from model_backend import FakeBackend
+from tests.helpers import jpeg_bytes
+
+PERSON_JSON = json.dumps({
+    "first_name": "Jean",
+    "last_name": "Tremblay",
+    "date_of_birth": "1964-05-50",
+    "ramq": "TREJ 6405 0519",
+    "ohip": None,
+    "mrn": "123",
+})
+
+
+class TestAsyncExtraction(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.image = jpeg_bytes(400, 250)
+        transport = httpx.MockTransport(
+            lambda request: httpx.Response(200, content=self.image, headers={"content-type": "image/jpeg"})
+        )
+        patcher = mock.patch.object(
+            anthropic_vision_script,
+            "new_async_http_client",
+            lambda: httpx.AsyncClient(transport=transport),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(set_extraction_concurrency, anthropic_vision_script.EXTRACTION_CONCURRENCY)
+
+        self.addCleanup(anthropic_vision_script.configure_extraction_cache, anthropic_vision_script.extraction_cache)
+        anthropic_vision_script.configure_extraction_cache(None)
+
+    def use_backend(self, backend):
+        self.addCleanup(anthropic_vision_script.set_model_backend, anthropic_vision_script.get_model_backend())
+        anthropic_vision_script.set_model_backend(backend)
+
+    async def asyncTearDown(self):
+        await anthropic_vision_script.aclose_async_clients()
+
+    async def test_aget_ramq_image_matches_sync_parsing(self):
+        self.use_backend(FakeBackend(PERSON_JSON, latency=0.01))
+        result = await aget_ramq("https://example.com/card.jpg")
+        self.assertEqual(result, anthropic_vision_script._parse_ramq_response(PERSON_JSON))
+        self.assertEqual(result[0], "TREJ64050519")
+        self.assertEqual(len(result), 11)
+
+    async def test_aget_ramq_text(self):
+        self.use_backend(FakeBackend(PERSON_JSON, latency=0.01))
+        result = await aget_ramq("Jean Tremblay TREM64055089", is_image=False)
+        self.assertEqual(result[1:3], ("Tremblay", "Jean"))
+
+    async def test_concurrency_limit_is_respected(self):
+        backend = FakeBackend(PERSON_JSON, latency=0.02)
+        self.use_backend(backend)
+        set_extraction_concurrency(4)
+
+        results = await asyncio.gather(
+            *(aget_ramq(f"https://example.com/{i}.jpg") for i in range(20))
+        )
+
+        self.assertEqual(len(results), 20)
+        self.assertEqual(backend.calls, 20)
+        self.assertEqual(backend.max_in_flight, 4)
+
+    async def test_aget_patient_list(self):
+        self.use_backend(FakeBackend(json.dumps({
+            "patients": [{"first_name": "A", "last_name": "B", "room_number": " 12 "}]
+        })))
+        patients = await aget_patient_list("some list", is_image=False)
+        self.assertEqual(patients.patients[0].room_number, "12")
+
+    def test_rejects_invalid_limit(self):
+        with self.assertRaises(ValueError):
+            set_extraction_concurrency(0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import batch_extract
+from batch_extract import FIELDS, collect_inputs, load_checkpoint, run_batch
+
+
+def fake_extract(source):
+    record = dict.fromkeys(FIELDS)
+    record.update(source=source, ramq="TREM64055089", last_name="Tremblay", first_name="Jean")
+    return record
+
+
+class TestBatchExtract(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cards = os.path.join(self.tmp.name, "cards")
+        os.makedirs(os.path.join(self.cards, "nested"))
+        for name in ["b.jpg", "a.PNG", "notes.txt", "nested/c.jpeg"]:
+            with open(os.path.join(self.cards, name), "wb") as handle:
+                handle.write(b"x")
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_collect_inputs(self):
+        expected = [os.path.join(self.cards, n) for n in ["a.PNG", "b.jpg", "nested/c.jpeg"]]
+        self.assertEqual(collect_inputs(self.cards), expected)
+        self.assertEqual(collect_inputs(os.path.join(self.cards, "*.jpg")), expected[1:2])
+
+        urls = self.path("urls.txt")
+        with open(urls, "w") as handle:
+            handle.write("https://x/1.jpg\n\n# comment\nhttps://x/2.jpg\n")
+        self.assertEqual(collect_inputs(urls), ["https://x/1.jpg", "https://x/2.jpg"])
+
+        with self.assertRaises(ValueError):
+            collect_inputs(self.path("missing"))
+
+    def test_writes_csv_and_ndjson(self):
+        run_batch(self.cards, self.path("out.csv"), workers=2, extract=fake_extract)
+        with open(self.path("out.csv"), newline="") as handle:
+            rows = list(csv.DictReader(handle))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]["ramq"], "TREM64055089")
+
+        run_batch(self.cards, self.path("out.ndjson"), workers=2, extract=fake_extract)
+        with open(self.path("out.ndjson")) as handle:
+            self.assertEqual(len([json.loads(line) for line in handle]), 3)
+
+    def test_unwritable_format_fails_before_extracting(self):
+        calls = []
+
+        def extract(source):
+            calls.append(source)
+            return fake_extract(source)
+
+        with mock.patch.dict("sys.modules", {"pyarrow": None, "pyarrow.parquet": None}):
+            with self.assertRaisesRegex(ValueError, "pyarrow"):
+                run_batch(self.cards, self.path("out.parquet"), extract=extract)
+        with self.assertRaisesRegex(ValueError, "Unknown output format"):
+            run_batch(self.cards, self.path("out.csv"), fmt="xlsx", extract=extract)
+        self.assertEqual(calls, [])
+        self.assertFalse(os.path.exists(self.path("out.parquet.checkpoint.ndjson")))
+
+    def test_resumes_from_checkpoint_and_retries_errors(self):
+        calls = []
+
+        def flaky(source):
+            calls.append(source)
+            record = fake_extract(source)
+            if source.endswith("b.jpg"):
+                record["error"] = "model unavailable"
+            return record
+
+        output = self.path("out.ndjson")
+        run_batch(self.cards, output, workers=3, extract=flaky)
+        self.assertEqual(len(calls), 3)
+
+        def recording(source):
+            calls.append(source)
+            return fake_extract(source)
+
+        calls.clear()
+        run_batch(self.cards, output, workers=3, extract=recording)
+        self.assertEqual(calls, [os.path.join(self.cards, "b.jpg")])
+
+        calls.clear()
+        results = run_batch(self.cards, output, workers=3, extract=recording)
+        self.assertEqual(calls, [])
+        self.assertTrue(all(record["error"] is None for record in results))
+        self.assertEqual(len(load_checkpoint(output + ".checkpoint.ndjson")), 3)
+
+    def test_local_file_gives_the_same_record_as_a_url(self):
+        extraction = ("TREM64055089", "Tremblay", "Jean", None, "female", True, "MRN-1", "1234567890",
+                      True, "RAMQ", "TREM64055089")
+        with mock.patch.object(batch_extract, "get_ramq_from_image", return_value=extraction) as extract, \
+                mock.patch.object(batch_extract, "get_ramq", return_value=extraction):
+            local = batch_extract.extract_item(os.path.join(self.cards, "b.jpg"))
+            remote = batch_extract.extract_item("https://x/b.jpg")
+        extract.assert_called_once_with(b"x")
+        self.assertEqual((local["mrn"], local["ohip"], local["valid_ohip"]), ("MRN-1", "1234567890", True))
+        self.assertEqual(dict(local, source=None), dict(remote, source=None))
+        self.assertIsNone(local["error"])
+
+    def test_extract_item_records_errors(self):
+        with mock.patch.object(batch_extract, "get_ramq", side_effect=ValueError("boom")):
+            record = batch_extract.extract_item("https://x/1.jpg")
+        self.assertEqual(record["error"], "boom")
+
+    def test_cli_rejects_other_modes_with_batch(self):
+        import main
+        argv = ["main.py", self.cards, "--batch", "--output", self.path("out.csv"), "--mode", "list"]
+        with mock.patch("sys.argv", argv), mock.patch("sys.stderr"), \
+                mock.patch.object(batch_extract, "run_batch") as run:
+            with self.assertRaises(SystemExit) as raised:
+                main.main()
+        self.assertEqual(raised.exception.code, 2)
+        run.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import json
+import os
+import tempfile
+import unittest
+from io import BytesIO
+
+from PIL import Image
+
+import anthropic_vision_script
+from model_backend import FAKE_PERSON, FakeBackend
+from resolution import load_curves
+from tests import bench_sizes
+from tests.bench_sizes import ResultCache, compare, load_corpus, percentile, run_sweep, summarize, sweep_configs
+
+WRONG_PERSON = json.dumps(dict(FAKE_PERSON, ramq="TREJ64050518"))
+
+
+class TestSizeSweep(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        labels = {}
+        for index, size in enumerate(((1000, 640), (1100, 700), (300, 200))):
+            name = f"card_{index}.jpg"
+            Image.new("RGB", size, "white").save(os.path.join(self.directory, name), format="JPEG")
+            labels[name] = {"ramq": "TREJ 6405 0519", "last_name": "Tremblay", "first_name": "Jean"}
+        with open(os.path.join(self.directory, "labels.json"), "w", encoding="utf-8") as handle:
+            json.dump(labels, handle)
+
+        self.addCleanup(anthropic_vision_script.configure_extraction_cache, anthropic_vision_script.extraction_cache)
+        self.addCleanup(anthropic_vision_script.set_model_backend, anthropic_vision_script.get_model_backend())
+        anthropic_vision_script.configure_extraction_cache(None)
+        self.calls = []
+
+        self.prompts = []
+
+        def respond(contents):
+            image = Image.open(BytesIO(contents[0].parts[0].inline_data.data))
+            self.calls.append((image.size[0], image.format))
+            self.prompts.append(contents[0].parts[1].text)
+            # Small images are misread
+            return json.dumps(FAKE_PERSON) if image.size[0] >= 400 else WRONG_PERSON
+        anthropic_vision_script.set_model_backend(FakeBackend(respond))
+
+    def test_sweep_report(self):
+        samples = load_corpus(self.directory)
+        configs = sweep_configs([200, 400, 800], ["jpeg", "png"], [50, 85])
+        self.assertEqual(len(configs), 9)
+        results = run_sweep(samples, configs, workers=4)
+        # The 300px card is not upscaled to 400 or 800
+        self.assertEqual(len(results), 3 * 9 - 6)
+        self.assertIn((800, "PNG"), self.calls)
+
+        rows = {(row["width"], row["format"], row["quality"]): row for row in summarize(results)}
+        self.assertEqual(rows[(200, "jpeg", 85)]["accuracy"], 0.0)
+        self.assertEqual(rows[(400, "jpeg", 85)]["accuracy"], 1.0)
+        self.assertEqual(rows[(400, "jpeg", 85)]["samples"], 2)
+        self.assertEqual(rows[(800, "png", None)]["field_accuracy"]["last_name"], 1.0)
+        self.assertLess(rows[(400, "jpeg", 50)]["bytes_p50"], rows[(800, "jpeg", 50)]["bytes_p50"])
+        self.assertIsNotNone(rows[(400, "jpeg", 85)]["latency_p95"])
+
+    def test_production_format_uses_the_api_path(self):
+        samples = load_corpus(self.directory)
+        results = run_sweep(samples, sweep_configs([200, 400], ["production"], [50, 85]))
+        # Swept once whatever the qualities; the 300px card only at 200
+        self.assertEqual(len(results), 5)
+        self.assertEqual(set(self.prompts), {anthropic_vision_script.RAMQ_IMAGE_PROMPT})
+        card = samples[0]
+        expected = len(anthropic_vision_script.preprocess_image(card.data, width=400)[0])
+        entry = next(e for e in results if e["image"] == card.name and e["width"] == 400)
+        self.assertEqual((entry["bytes"], entry["quality"]), (expected, None))
+        self.assertEqual(len(bench_sizes.curve_measurements(results)), 5)
+
+    def test_cached_results_are_not_measured_again(self):
+        path = os.path.join(self.directory, "cache.jsonl")
+        samples = load_corpus(self.directory)
+        configs = sweep_configs([200, 400], ["jpeg"], [85])
+        first = run_sweep(samples, configs, cache=ResultCache(path))
+        calls = len(self.calls)
+        second = run_sweep(samples, configs, cache=ResultCache(path))
+        self.assertEqual(len(self.calls), calls)
+        self.assertTrue(all(entry["cached"] for entry in second))
+        self.assertEqual(summarize(first), summarize(second))
+
+        run_sweep(samples, configs, cache=ResultCache(path, load=False))
+        self.assertEqual(len(self.calls), 2 * calls)
+
+    def test_regressions_against_baseline(self):
+        baseline = {"configs": [{"width": 400, "format": "jpeg", "quality": 85, "accuracy": 1.0, "latency_p95": 1.0}]}
+        current = {"configs": [{"width": 400, "format": "jpeg", "quality": 85, "accuracy": 0.9, "latency_p95": 2.0}]}
+        self.assertEqual(len(compare(current, baseline)), 2)
+        self.assertEqual(compare(baseline, baseline), [])
+
+    def test_command_line_writes_report_and_curves(self):
+        report_path = os.path.join(self.directory, "report.json")
+        curves_path = os.path.join(self.directory, "curves.json")
+        status = bench_sizes.main([
+            self.directory, "--widths", "200,400", "--report", report_path, "--save-curves", curves_path,
+            "--cache", os.path.join(self.directory, "cache.jsonl"),
+        ])
+        self.assertEqual(status, 0)
+        with open(report_path, "r", encoding="utf-8") as handle:
+            report = json.load(handle)
+        self.assertEqual(report["images"], 3)
+        self.assertEqual([row["width"] for row in report["configs"]], [200, 400])
+        self.assertEqual([point.width for point in load_curves(curves_path)[1200]], [200, 400])
+
+        worse = dict(report, configs=[dict(row, accuracy=1.0) for row in report["configs"]])
+        baseline_path = os.path.join(self.directory, "baseline.json")
+        with open(baseline_path, "w", encoding="utf-8") as handle:
+            json.dump(worse, handle)
+        status = bench_sizes.main([self.directory, "--widths", "200,400", "--report", report_path,
+                                   "--cache", os.path.join(self.directory, "cache.jsonl"), "--baseline", baseline_path])
+        self.assertEqual(status, 1)
+
+    def test_percentile(self):
+        self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+        self.assertEqual(percentile([3.0], 50), 3.0)
+        self.assertIsNone(percentile([], 50))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import os
+import unittest
+from io import BytesIO
+from unittest import mock
+
+import httpx
+from PIL import Image
+
+import anthropic_vision_script
+import api
+from anthropic_vision_script import document_pages, get_people_from_document
+from model_backend import FAKE_PERSON, FakeBackend
+
+
+def tiff_bytes(pages, mode="1", size=(2400, 3000)):
+    frames = [Image.new(mode, size, 1 if mode == "1" else "white") for _ in range(pages)]
+    buffer = BytesIO()
+    frames[0].save(buffer, format="TIFF", save_all=True, append_images=frames[1:])
+    return buffer.getvalue()
+
+
+def photo_bytes(size=(3000, 2000)):
+    buffer = BytesIO()
+    Image.new("RGB", size, "white").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def person(page=None, box=None, **fields):
+    return dict(FAKE_PERSON, page=page, box_2d=box, **fields)
+
+
+class TestDocumentPages(unittest.TestCase):
+    def test_tiff_is_split_and_downscaled(self):
+        pages = document_pages(tiff_bytes(3), width=800)
+        self.assertEqual(len(pages), 3)
+        for data, content_type in pages:
+            self.assertEqual(content_type, "image/png")
+            self.assertEqual(Image.open(BytesIO(data)).size, (800, 1000))
+
+    def test_photo_of_several_cards_is_one_image(self):
+        pages = document_pages(photo_bytes(), width=1600)
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(Image.open(BytesIO(pages[0][0])).size[0], 1600)
+
+    def test_pdf_is_sent_whole(self):
+        pdf = b"%PDF-1.4 fake"
+        self.assertEqual(document_pages(pdf), [(pdf, "application/pdf")])
+
+
+class TestDocumentExtraction(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(anthropic_vision_script.configure_extraction_cache, anthropic_vision_script.extraction_cache)
+        self.addCleanup(anthropic_vision_script.set_model_backend, anthropic_vision_script.get_model_backend())
+        anthropic_vision_script.configure_extraction_cache(None)
+        self.calls = []
+
+    def use_responder(self, respond):
+        def record(contents):
+            parts = contents[0].parts
+            labels = [part.text for part in parts[:-1] if part.text]
+            self.calls.append(labels)
+            return json.dumps({"people": respond(labels)})
+        anthropic_vision_script.set_model_backend(FakeBackend(record))
+
+    def test_every_card_on_a_photo(self):
+        self.use_responder(lambda labels: [
+            person(1, [100, 50, 400, 450]),
+            person(1, [500, 50, 800, 450], first_name="Marie", last_name="Gagnon", ramq="GAGM80520399"),
+        ])
+        people = get_people_from_document(photo_bytes())
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual([p.last_name for p in people], ["Tremblay", "Gagnon"])
+        self.assertTrue(people[0].valid_ramq)
+        self.assertEqual(people[0].gender, "male")
+        self.assertEqual(people[0].bbox, (0.05, 0.1, 0.45, 0.4))
+
+    def test_pages_are_batched_per_call(self):
+        def respond(labels):
+            return [person(int(label.split()[1].rstrip(":"))) for label in labels]
+        self.use_responder(respond)
+        with mock.patch.object(anthropic_vision_script, "DOCUMENT_PAGES_PER_CALL", 4):
+            people = get_people_from_document(tiff_bytes(10, size=(400, 500)))
+        self.assertEqual([len(labels) for labels in self.calls], [4, 4, 2])
+        self.assertEqual(self.calls[1][0], "Page 5:")
+        self.assertEqual([p.page for p in people], list(range(1, 11)))
+
+    def test_call_relative_page_numbers_are_mapped(self):
+        self.use_responder(lambda labels: [person(2, [0, 0, 1000, 1000])])
+        with mock.patch.object(anthropic_vision_script, "DOCUMENT_PAGES_PER_CALL", 2):
+            people = get_people_from_document(tiff_bytes(4, size=(400, 500)))
+        self.assertEqual([p.page for p in people], [2, 4])
+        self.assertEqual(people[0].bbox, (0.0, 0.0, 1.0, 1.0))
+
+    def test_unusable_entries_are_skipped(self):
+        anthropic_vision_script.set_model_backend(FakeBackend(json.dumps(
+            [person(1), {"first_name": "No last name"}, person(1, [5, 5, 5, 5])])))
+        people = get_people_from_document(photo_bytes())
+        self.assertEqual(len(people), 2)
+        self.assertIsNone(people[1].bbox)
+
+    def test_async_sends_chunks_concurrently(self):
+        backend = FakeBackend(json.dumps({"people": [person(1)]}), latency=0.05)
+        anthropic_vision_script.set_model_backend(backend)
+        with mock.patch.object(anthropic_vision_script, "DOCUMENT_PAGES_PER_CALL", 1):
+            people = asyncio.run(anthropic_vision_script.aget_people_from_document(tiff_bytes(4, size=(400, 500))))
+        self.assertEqual([p.page for p in people], [1, 2, 3, 4])
+        self.assertEqual(backend.max_in_flight, 4)
+
+    def test_pdf_url(self):
+        pdf = b"%PDF-1.4 two pages"
+        client = httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=pdf)))
+        self.addCleanup(client.close)
+        self.use_responder(lambda labels: [person(1), person(2)])
+        with mock.patch.object(anthropic_vision_script, "get_http_client", return_value=client):
+            people = get_people_from_document("https://example.com/fax.pdf")
+        self.assertEqual([p.page for p in people], [1, 2])
+        self.assertEqual(len(self.calls), 1)
+
+    def test_pdf_url_async(self):
+        pdf = b"%PDF-1.4 two pages"
+
+        def client():
+            return httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=pdf)))
+
+        self.use_responder(lambda labels: [person(1)])
+        with mock.patch.object(anthropic_vision_script, "new_async_http_client", client):
+            people = asyncio.run(anthropic_vision_script.aget_people_from_document("https://example.com/fax.pdf"))
+        self.assertEqual([p.page for p in people], [1])
+
+    def test_endpoint(self):
+        os.environ["HEADER_TOKEN"] = "test-token"
+        anthropic_vision_script.set_model_backend(FakeBackend(json.dumps({"people": [person(1, [0, 0, 500, 500])]})))
+        with mock.patch.object(anthropic_vision_script, "adownload_document", return_value=(photo_bytes(), "image/jpeg")):
+            response = api.app.test_client().post(
+                "/extract_document",
+                json={"document_url": "https://example.com/fax.tiff"},
+                headers={"RAMQ-Billr-API-Key": "test-token"},
+            )
+        body = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body["people"][0]["ramq"], "TREJ64050519")
+        self.assertEqual(body["people"][0]["bbox"], [0.0, 0.0, 0.5, 0.5])
+        self.assertEqual(body["people"][0]["dob"], "1964-05-05")
+
+
+if __name__ == "__main__":
+    unittest.main()
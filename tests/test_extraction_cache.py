@@ -0,0 +1,158 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import anthropic_vision_script
+from extraction_cache import (
+    CacheBackend,
+    ExtractionCache,
+    MemoryBackend,
+    SqliteBackend,
+    cache_from_env,
+    make_cache_key,
+)
+from tests.helpers import FakeClock
+
+
+class TestCacheKey(unittest.TestCase):
+    def test_key_depends_on_payload_prompt_and_model(self):
+        base = make_cache_key(b"image", "prompt", "model")
+        self.assertEqual(base, make_cache_key(b"image", "prompt", "model"))
+        self.assertNotEqual(base, make_cache_key(b"image2", "prompt", "model"))
+        self.assertNotEqual(base, make_cache_key(b"image", "prompt2", "model"))
+        self.assertNotEqual(base, make_cache_key(b"image", "prompt", "model2"))
+
+    def test_text_is_whitespace_normalized(self):
+        self.assertEqual(
+            make_cache_key("Jean  Tremblay\n TREM64055089 ", "p", "m"),
+            make_cache_key("Jean Tremblay TREM64055089", "p", "m"),
+        )
+
+
+class BackendTests:
+    def make_backend(self, **kwargs):
+        raise NotImplementedError
+
+    def test_lru_eviction_by_entries(self):
+        backend = self.make_backend(max_entries=2)
+        backend.set("a", "1")
+        backend.set("b", "2")
+        self.assertEqual(backend.get("a"), "1")  # a is now most recent
+        backend.set("c", "3")
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("a"), "1")
+        self.assertEqual(backend.get("c"), "3")
+        self.assertEqual(len(backend), 2)
+
+    def test_eviction_by_bytes(self):
+        backend = self.make_backend(max_bytes=30)
+        backend.set("a", "x" * 10)
+        backend.set("b", "y" * 10)
+        backend.set("c", "z" * 10)
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual(backend.get("c"), "z" * 10)
+
+    def test_expiry(self):
+        backend = self.make_backend()
+        backend.set("a", "1", expires_at=self.clock.now + 5)
+        self.assertEqual(backend.get("a"), "1")
+        self.clock.now += 10
+        self.assertIsNone(backend.get("a"))
+
+    def test_delete_and_clear(self):
+        backend = self.make_backend()
+        backend.set("a", "1")
+        backend.set("b", "2")
+        backend.delete("a")
+        self.assertIsNone(backend.get("a"))
+        backend.clear()
+        self.assertEqual(len(backend), 0)
+
+
+class TestMemoryBackend(BackendTests, unittest.TestCase):
+    def make_backend(self, **kwargs):
+        self.clock = FakeClock()
+        return MemoryBackend(clock=self.clock, **kwargs)
+
+
+class TestSqliteBackend(BackendTests, unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "cache.db")
+
+    def make_backend(self, **kwargs):
+        self.clock = FakeClock()
+        backend = SqliteBackend(self.path, clock=self._tick, **kwargs)
+        self.addCleanup(backend.close)
+        return backend
+
+    def _tick(self):
+        # Distinct access times keep the LRU order deterministic
+        self.clock.now += 0.001
+        return self.clock.now
+
+    def test_persists_across_instances(self):
+        self.make_backend().set("a", "1")
+        self.assertEqual(self.make_backend().get("a"), "1")
+
+
+class TestExtractionCache(unittest.TestCase):
+    def test_ttl_and_counters(self):
+        clock = FakeClock()
+        cache = ExtractionCache(MemoryBackend(clock=clock), ttl=60, clock=clock)
+        self.assertIsNone(cache.get("k"))
+        cache.set("k", "v")
+        self.assertEqual(cache.get("k"), "v")
+        clock.now += 61
+        self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 2, "hit_rate": 1 / 3, "entries": 0})
+
+
+class TestGetRamqCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ExtractionCache()
+        self.addCleanup(anthropic_vision_script.configure_extraction_cache, anthropic_vision_script.extraction_cache)
+        anthropic_vision_script.configure_extraction_cache(self.cache)
+
+    def test_duplicate_text_skips_model_call(self):
+        response = json.dumps({"first_name": "Jean", "last_name": "Tremblay", "ramq": "TREM64055089"})
+        with mock.patch.object(anthropic_vision_script, "_generate", return_value=response) as generate:
+            first = anthropic_vision_script.get_ramq("Jean Tremblay TREM64055089", is_image=False)
+            second = anthropic_vision_script.get_ramq("Jean  Tremblay TREM64055089\n", is_image=False)
+
+        self.assertEqual(first, second)
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_unparseable_response_is_not_cached(self):
+        with mock.patch.object(anthropic_vision_script, "_generate", return_value="not json"):
+            with self.assertRaises(ValueError):
+                anthropic_vision_script.get_ramq("text", is_image=False)
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+
+class TestConfiguration(unittest.TestCase):
+    def test_cache_is_opt_in(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("EXTRACTION_CACHE", None)
+            self.assertIsNone(cache_from_env())
+        with mock.patch.dict(os.environ, {"EXTRACTION_CACHE": "memory"}):
+            self.assertIsInstance(cache_from_env().backend, MemoryBackend)
+
+    def test_interfaces_are_abstract(self):
+        with self.assertRaises(TypeError):
+            CacheBackend()
+
+        class Incomplete(CacheBackend):
+            def get(self, key):
+                return None
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+if __name__ == "__main__":
+    unittest.main()
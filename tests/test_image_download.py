@@ -0,0 +1,134 @@
+import unittest
+from io import BytesIO
+
+import httpx
+from PIL import Image
+
+from image_download import (ImageDownloadError, ImageSniffer, adownload_document, adownload_image, download_document,
+                            download_image)
+from tests.helpers import jpeg_bytes
+
+
+def png_bytes(width=300, height=200):
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class ChunkedBody:
+    """Streamed response body that records how much of it was consumed."""
+
+    def __init__(self, data, chunk_size=1024):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+
+    def __iter__(self):
+        for start in range(0, len(self.data), self.chunk_size):
+            chunk = self.data[start:start + self.chunk_size]
+            self.bytes_read += len(chunk)
+            yield chunk
+
+
+def client_for(body, headers=None, status=200):
+    def handler(request):
+        return httpx.Response(status, content=body, headers=headers or {})
+    return httpx.Client(transport=httpx.MockTransport(handler))
+
+
+class TestDownloadImage(unittest.TestCase):
+    def test_downloads_and_sniffs_mime_type(self):
+        data = jpeg_bytes()
+        with client_for(data, {"content-type": "application/octet-stream"}) as client:
+            self.assertEqual(download_image("https://x/card", client), (data, "image/jpeg"))
+
+    def test_rejects_declared_length_over_limit(self):
+        body = ChunkedBody(png_bytes())
+        with client_for(body, {"content-length": "999999"}) as client:
+            with self.assertRaises(ImageDownloadError):
+                download_image("https://x/card", client, max_bytes=1000)
+        self.assertEqual(body.bytes_read, 0)
+
+    def test_rejects_stream_over_limit(self):
+        data = png_bytes() + b"\0" * 10000
+        body = ChunkedBody(data)
+        with client_for(body) as client:
+            with self.assertRaises(ImageDownloadError):
+                download_image("https://x/card", client, max_bytes=4096)
+        self.assertLess(body.bytes_read, len(data))
+
+    def test_rejects_non_image_from_first_chunk(self):
+        body = ChunkedBody(b"<!DOCTYPE html><html>" + b"x" * 100000)
+        with client_for(body) as client:
+            with self.assertRaises(ImageDownloadError):
+                download_image("https://x/card", client)
+        self.assertEqual(body.bytes_read, 1024)
+
+    def test_rejects_too_many_pixels_from_header(self):
+        data = png_bytes(2000, 2000)
+        body = ChunkedBody(data, chunk_size=256)
+        with client_for(body) as client:
+            with self.assertRaises(ImageDownloadError):
+                download_image("https://x/card", client, max_pixels=1000 * 1000)
+        self.assertLessEqual(body.bytes_read, 512)
+
+    def test_http_error(self):
+        with client_for(b"missing", status=404) as client:
+            with self.assertRaises(httpx.HTTPStatusError):
+                download_image("https://x/card", client)
+
+
+class TestImageSniffer(unittest.TestCase):
+    def test_header_split_across_chunks(self):
+        data = jpeg_bytes(640, 480)
+        sniffer = ImageSniffer()
+        for start in range(0, len(data), 7):
+            if sniffer.feed(data[start:start + 7]):
+                break
+        self.assertEqual((sniffer.format, sniffer.size, sniffer.mime_type), ("JPEG", (640, 480), "image/jpeg"))
+
+
+class TestDownloadDocument(unittest.TestCase):
+    def test_pdf(self):
+        pdf = b"%PDF-1.4\n" + b"\0" * 5000
+        with client_for(ChunkedBody(pdf, chunk_size=3)) as client:
+            self.assertEqual(download_document("https://x/fax.pdf", client), (pdf, "application/pdf"))
+            with self.assertRaises(ImageDownloadError):
+                download_image("https://x/fax.pdf", client)
+
+    def test_images_and_byte_cap(self):
+        data = png_bytes()
+        with client_for(data) as client:
+            self.assertEqual(download_document("https://x/fax", client), (data, "image/png"))
+        with client_for(b"%PDF-1.4" + b"\0" * 5000) as client:
+            with self.assertRaises(ImageDownloadError):
+                download_document("https://x/fax.pdf", client, max_bytes=1000)
+        with client_for(b"<html>not found</html>") as client:
+            with self.assertRaises(ImageDownloadError):
+                download_document("https://x/fax.pdf", client)
+
+
+class TestAsyncDownloadImage(unittest.IsolatedAsyncioTestCase):
+    async def test_async_download(self):
+        data = png_bytes()
+
+        async def handler(request):
+            return httpx.Response(200, content=data)
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            self.assertEqual(await adownload_image("https://x/card", client), (data, "image/png"))
+            with self.assertRaises(ImageDownloadError):
+                await adownload_image("https://x/card", client, max_bytes=10)
+
+    async def test_async_document_download(self):
+        pdf = b"%PDF-1.7 fax"
+
+        async def handler(request):
+            return httpx.Response(200, content=pdf)
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            self.assertEqual(await adownload_document("https://x/fax.pdf", client), (pdf, "application/pdf"))
+
+
+if __name__ == "__main__":
+    unittest.main()
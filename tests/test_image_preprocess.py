@@ -0,0 +1,68 @@
+import unittest
+from io import BytesIO
+
+from PIL import Image
+
+from anthropic_vision_script import preprocess_image, resize_image_percent
+
+
+def make_image(width, height, fmt="JPEG", mode="RGB", orientation=None):
+    image = Image.new(mode, (width, height), "white" if mode != "RGBA" else (255, 255, 255, 0))
+    # Dark block in the top-left corner to check orientation
+    image.paste("black" if mode != "RGBA" else (0, 0, 0, 255), (0, 0, width // 4, height // 4))
+    buffer = BytesIO()
+    if orientation is not None:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        image.save(buffer, format=fmt, exif=exif.tobytes())
+    else:
+        image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+class TestPreprocessImage(unittest.TestCase):
+    def test_same_size_as_resize_image_percent(self):
+        data = make_image(4000, 3000)
+        fast, mime = preprocess_image(data, percent=40)
+        slow = resize_image_percent(data, percent=40)
+        self.assertEqual(mime, "image/jpeg")
+        self.assertEqual(Image.open(BytesIO(fast)).size, Image.open(BytesIO(slow)).size)
+        self.assertEqual(Image.open(BytesIO(fast)).size, (1600, 1200))
+
+    def test_min_width(self):
+        fast, _ = preprocess_image(make_image(400, 300), percent=10, min_width=200)
+        self.assertEqual(Image.open(BytesIO(fast)).size, (200, 150))
+
+    def test_small_image_returned_unchanged(self):
+        data = make_image(150, 100)
+        self.assertEqual(preprocess_image(data), (data, "image/jpeg"))
+
+    def test_exif_rotation_applied(self):
+        # Stored landscape, displayed portrait (rotate 90 degrees clockwise)
+        data = make_image(2000, 1000, orientation=6)
+        fast, _ = preprocess_image(data, percent=50)
+        image = Image.open(BytesIO(fast))
+        self.assertEqual(image.size, (500, 1000))
+        # The dark stored top-left corner ends up top-right
+        self.assertLess(image.convert("L").getpixel((480, 20)), 64)
+        self.assertGreater(image.convert("L").getpixel((20, 980)), 192)
+
+    def test_rotation_without_resize_reencodes(self):
+        data = make_image(200, 100, orientation=3)
+        fast, mime = preprocess_image(data, percent=100)
+        self.assertNotEqual(fast, data)
+        self.assertEqual(Image.open(BytesIO(fast)).size, (200, 100))
+
+    def test_transparent_png_stays_png(self):
+        fast, mime = preprocess_image(make_image(1000, 600, fmt="PNG", mode="RGBA"))
+        self.assertEqual(mime, "image/png")
+        self.assertEqual(Image.open(BytesIO(fast)).format, "PNG")
+
+    def test_opaque_png_becomes_jpeg(self):
+        fast, mime = preprocess_image(make_image(1000, 600, fmt="PNG"))
+        self.assertEqual(mime, "image/jpeg")
+        self.assertEqual(Image.open(BytesIO(fast)).size, (400, 240))
+
+
+if __name__ == "__main__":
+    unittest.main()
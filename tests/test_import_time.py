@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from tests.bench_import_time import REPO_ROOT, import_times
+
+HEAVY_PACKAGES = ("google", "PIL", "pydantic", "numpy", "httpx", "dotenv")
+
+
+def loaded(times, package):
+    return any(name == package or name.startswith(package + ".") for name in times)
+
+
+class TestImportTime(unittest.TestCase):
+    def test_validators_import_only_the_standard_library(self):
+        times = import_times("validators")
+        for package in HEAVY_PACKAGES + ("flask", "anthropic_vision_script"):
+            self.assertFalse(loaded(times, package), package)
+
+    def test_api_defers_the_extraction_stack(self):
+        times = import_times("api")
+        for package in ("anthropic_vision_script", "google", "PIL", "pydantic", "numpy", "httpx"):
+            self.assertFalse(loaded(times, package), package)
+
+    def test_cli_defers_the_extraction_stack(self):
+        times = import_times("main")
+        self.assertFalse(loaded(times, "anthropic_vision_script"))
+
+    def test_extraction_clients_are_created_on_first_use(self):
+        code = (
+            "import anthropic_vision_script as m\n"
+            "assert m._gemini_client is None and m._http_client is None\n"
+            "assert 'numpy' not in __import__('sys').modules\n"
+            "assert m.http_client is m.get_http_client()\n"
+        )
+        env = dict(os.environ, GEMINI_API_KEY="dummy")
+        env.pop("MODEL_BACKEND", None)
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env,
+                                cwd=REPO_ROOT)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_validate_cli(self):
+        result = subprocess.run([sys.executable, "main.py", "TREJ64050519", "--mode", "validate"],
+                                capture_output=True, text=True, cwd=REPO_ROOT)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("Valid: True", result.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import httpx
+
+import anthropic_vision_script
+import api
+import job_queue
+from job_queue import DONE, FAILED, QUEUED, RUNNING, JobQueue, JobRunner, deliver_webhook, public_view
+from model_backend import FakeBackend
+from tests.helpers import FakeClock
+
+
+class QueueTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "jobs.sqlite3")
+
+    def make_queue(self, **kwargs):
+        queue = JobQueue(self.path, **kwargs)
+        self.addCleanup(queue.close)
+        return queue
+
+
+class TestJobQueue(QueueTestCase):
+    def test_lifecycle(self):
+        queue = self.make_queue()
+        first = queue.submit({"text": "a"}, webhook="https://example.com/hook")
+        second = queue.submit({"text": "b"})
+        self.assertEqual(queue.get(first)["status"], QUEUED)
+
+        job = queue.claim()
+        self.assertEqual((job["id"], job["status"], job["attempts"]), (first, RUNNING, 1))
+        self.assertEqual(job["payload"], {"text": "a"})
+        queue.complete(first, {"ramq": "TREJ64050519"})
+        self.assertEqual(public_view(queue.get(first)), {"id": first, "status": DONE, "result": {"ramq": "TREJ64050519"}})
+
+        self.assertEqual(queue.claim()["id"], second)
+        queue.fail(second, "boom")
+        self.assertEqual(public_view(queue.get(second))["error"], "boom")
+        self.assertIsNone(queue.claim())
+        self.assertEqual(queue.counts(), {DONE: 1, FAILED: 1})
+
+    def test_expired_lease_is_claimed_again_until_attempts_run_out(self):
+        clock = FakeClock()
+        queue = self.make_queue(lease_seconds=10, max_attempts=2, clock=clock)
+        job_id = queue.submit({})
+        queue.claim()
+        self.assertIsNone(queue.claim())
+
+        clock.now += 11
+        self.assertEqual(queue.claim()["attempts"], 2)
+        clock.now += 11
+        self.assertIsNone(queue.claim())
+        self.assertEqual(queue.get(job_id)["status"], FAILED)
+
+    def test_only_the_latest_claim_finishes_a_job(self):
+        clock = FakeClock()
+        queue = self.make_queue(lease_seconds=10, clock=clock)
+        job_id = queue.submit({})
+        first = queue.claim()
+        clock.now += 11
+        second = queue.claim()
+        self.assertFalse(queue.renew(job_id, first["attempts"]))
+        self.assertFalse(queue.complete(job_id, {"run": 1}, first["attempts"]))
+        self.assertTrue(queue.complete(job_id, {"run": 2}, second["attempts"]))
+        self.assertFalse(queue.fail(job_id, "late", second["attempts"]))
+        self.assertEqual(queue.get(job_id)["result"], {"run": 2})
+
+    def test_renewed_lease_is_not_claimed_again(self):
+        clock = FakeClock()
+        queue = self.make_queue(lease_seconds=10, clock=clock)
+        job_id = queue.submit({})
+        job = queue.claim()
+        clock.now += 8
+        self.assertTrue(queue.renew(job_id, job["attempts"]))
+        clock.now += 8
+        self.assertIsNone(queue.claim())
+
+    def test_processes_never_claim_the_same_job(self):
+        queues = [self.make_queue() for _ in range(4)]
+        for index in range(50):
+            queues[0].submit({"index": index})
+        claimed = []
+
+        def drain(queue):
+            while True:
+                job = queue.claim()
+                if job is None:
+                    return
+                claimed.append(job["payload"]["index"])
+
+        threads = [threading.Thread(target=drain, args=(queue,)) for queue in queues]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(claimed), list(range(50)))
+
+    def test_purge_keeps_recent_and_unfinished_jobs(self):
+        clock = FakeClock()
+        queue = self.make_queue(clock=clock)
+        old = queue.submit({})
+        queue.complete(queue.claim()["id"], {})
+        clock.now += 100
+        queue.submit({})
+        self.assertEqual(queue.purge(50), 1)
+        self.assertIsNone(queue.get(old))
+
+
+class TestRunner(QueueTestCase):
+    def test_runs_jobs_concurrently_and_records_failures(self):
+        queue = self.make_queue()
+        in_flight, peak = [0], [0]
+        lock = threading.Lock()
+
+        def handler(payload):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            if payload.get("fail"):
+                raise ValueError("Error processing image: bad")
+            return {"echo": payload["n"]}
+
+        ids = [queue.submit({"n": n, "fail": n == 3}) for n in range(8)]
+        runner = JobRunner(queue, handler, concurrency=4, poll_interval=0.01)
+        runner.start()
+        self.addCleanup(runner.stop, 1)
+        deadline = time.time() + 5
+        while time.time() < deadline and queue.counts().get(DONE, 0) + queue.counts().get(FAILED, 0) < 8:
+            time.sleep(0.01)
+
+        self.assertEqual(queue.get(ids[0])["result"], {"echo": 0})
+        self.assertEqual(queue.get(ids[3])["error"], "Error processing image: bad")
+        self.assertGreater(peak[0], 1)
+
+    def test_lease_is_renewed_while_the_handler_runs(self):
+        queue = self.make_queue(lease_seconds=0.15)
+        job_id = queue.submit({})
+        claims = []
+
+        def handler(payload):
+            # Another process polling while the slow job runs
+            time.sleep(0.4)
+            claims.append(queue.claim())
+            time.sleep(0.2)
+            return {"ok": True}
+
+        self.assertTrue(JobRunner(queue, handler).run_one())
+        self.assertEqual(claims, [None])
+        job = queue.get(job_id)
+        self.assertEqual((job["status"], job["attempts"]), (DONE, 1))
+
+    def test_webhook_receives_finished_job(self):
+        queue = self.make_queue()
+        job_id = queue.submit({"n": 1}, webhook="https://example.com/hook")
+        runner = JobRunner(queue, lambda payload: {"ok": True}, webhook_secret="s3cret")
+        with mock.patch.object(job_queue, "deliver_webhook", return_value=True) as deliver:
+            self.assertTrue(runner.run_one())
+        url, body, secret = deliver.call_args[0]
+        self.assertEqual((url, body, secret), ("https://example.com/hook",
+                                                {"id": job_id, "status": DONE, "result": {"ok": True}}, "s3cret"))
+        self.assertEqual(queue.get(job_id)["webhook_status"], "delivered")
+
+    def test_webhook_signature_and_retries(self):
+        seen = []
+
+        def handle(request):
+            seen.append(request)
+            return httpx.Response(503 if len(seen) == 1 else 200)
+
+        client = httpx.Client(transport=httpx.MockTransport(handle))
+        with mock.patch("time.sleep"):
+            self.assertTrue(deliver_webhook("https://example.com/hook", {"id": "x"}, "key", client=client))
+        self.assertEqual(len(seen), 2)
+        self.assertTrue(seen[1].headers["X-Job-Signature"].startswith("sha256="))
+        self.assertEqual(json.loads(seen[1].content), {"id": "x"})
+
+
+class TestJobsEndpoints(QueueTestCase):
+    def setUp(self):
+        super().setUp()
+        os.environ["HEADER_TOKEN"] = "test-token"
+        self.headers = {"RAMQ-Billr-API-Key": "test-token"}
+        self.client = api.app.test_client()
+        self.addCleanup(anthropic_vision_script.configure_extraction_cache, anthropic_vision_script.extraction_cache)
+        self.addCleanup(anthropic_vision_script.set_model_backend, anthropic_vision_script.get_model_backend())
+        anthropic_vision_script.configure_extraction_cache(None)
+        anthropic_vision_script.set_model_backend(FakeBackend())
+
+        patcher = mock.patch.dict(os.environ, {"JOBS_DB": self.path, "JOB_CONCURRENCY": "2"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.stop_runner)
+
+    def stop_runner(self):
+        if api._job_runner is not None and api._job_pid == os.getpid():
+            api._job_runner.stop(1)
+            api._job_queue.close()
+        api._job_pid = api._job_queue = api._job_runner = None
+
+    def test_submit_and_poll(self):
+        response = self.client.post("/jobs", json={"is_image": False, "text": "Jean Tremblay"}, headers=self.headers)
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()["id"]
+        self.assertEqual(response.headers["Location"], f"/jobs/{job_id}")
+
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            body = self.client.get(f"/jobs/{job_id}", headers=self.headers).get_json()
+            if body["status"] in (DONE, FAILED):
+                break
+            time.sleep(0.02)
+        self.assertEqual(body["status"], DONE)
+        self.assertEqual(body["result"]["ramq"], "TREJ64050519")
+        self.assertEqual(body["result"]["dob"], "1964-05-05")
+
+    def test_invalid_submissions(self):
+        response = self.client.post("/jobs", json={"is_image": True}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/jobs", json={"is_image": False, "text": "x", "webhook": "ftp://x"},
+                                    headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get("/jobs/unknown", headers=self.headers).status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
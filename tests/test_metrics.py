@@ -0,0 +1,143 @@
+import os
+import tempfile
+import time
+import unittest
+
+import anthropic_vision_script
+import api
+import metrics
+from model_backend import FakeBackend
+
+
+def sample(text, line_prefix):
+    """Value of the first exposition line starting with line_prefix."""
+    for line in text.splitlines():
+        if line.startswith(line_prefix):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+class TestRegistry(unittest.TestCase):
+    def test_histogram_exposition(self):
+        registry = metrics.Registry()
+        histogram = registry.histogram("test_seconds", "Test latency", ("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.labels("parse").observe(value)
+
+        text = registry.render()
+        self.assertIn("# TYPE test_seconds histogram", text)
+        self.assertIn('test_seconds_bucket{stage="parse",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{stage="parse",le="1"} 2', text)
+        self.assertIn('test_seconds_bucket{stage="parse",le="+Inf"} 3', text)
+        self.assertIn('test_seconds_count{stage="parse"} 3', text)
+        self.assertEqual(sample(text, 'test_seconds_sum{stage="parse"}'), 5.55)
+
+    def test_counter_and_label_escaping(self):
+        registry = metrics.Registry()
+        counter = registry.counter("test_total", "Test counter", ("path",))
+        counter.labels('a"b').inc(2)
+        self.assertIn('test_total{path="a\\"b"} 2', registry.render())
+
+    def test_snapshots_from_several_processes_are_summed(self):
+        registry = metrics.Registry()
+        counter = registry.counter("test_total", "Test counter", ("kind",))
+        histogram = registry.histogram("test_seconds", "Test latency", buckets=(1.0,))
+        counter.labels("ramq").inc(3)
+        histogram.observe(0.5)
+
+        snapshot = registry.snapshot()
+        text = registry.render([snapshot, snapshot])
+        self.assertIn('test_total{kind="ramq"} 6', text)
+        self.assertIn('test_seconds_bucket{le="1"} 2', text)
+
+    def test_snapshot_directory_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            metrics.write_snapshot(directory)
+            snapshots = metrics.read_snapshots(directory)
+            self.assertEqual(len(snapshots), 1)
+            self.assertIn("ramq_stage_seconds", snapshots[0])
+            metrics.clear_snapshots(directory)
+            self.assertEqual(metrics.read_snapshots(directory), [])
+
+    def test_exited_workers_are_folded_into_the_archive(self):
+        registry = metrics.Registry()
+        counter = registry.counter("test_total", "Test counter", ("kind",))
+        histogram = registry.histogram("test_seconds", "Test latency", buckets=(1.0,))
+        counter.labels("ramq").inc(2)
+        histogram.observe(0.5)
+        snapshot = registry.snapshot()
+        with tempfile.TemporaryDirectory() as directory:
+            for pid in (101, 102, 103):
+                metrics._write_json(metrics._snapshot_path(directory, pid), snapshot)
+                metrics.archive_snapshot(directory, pid, registry)
+            metrics.archive_snapshot(directory, 104, registry)  # never wrote a snapshot
+            metrics.write_snapshot(directory, registry)
+
+            self.assertEqual(sorted(os.listdir(directory)),
+                             sorted(["metrics-archive.json", f"metrics-{os.getpid()}.json"]))
+            text = registry.render(metrics.read_snapshots(directory))
+            self.assertIn('test_total{kind="ramq"} 8', text)
+            self.assertIn('test_seconds_bucket{le="1"} 4', text)
+
+    def test_stage_timer_overhead_is_small(self):
+        runs = 20000
+        start = time.perf_counter()
+        for _ in range(runs):
+            with metrics.stage("overhead_test"):
+                pass
+        per_call = (time.perf_counter() - start) / runs
+        self.assertLess(per_call, 50e-6)
+
+
+class TestPipelineMetrics(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(anthropic_vision_script.configure_extraction_cache, anthropic_vision_script.extraction_cache)
+        self.addCleanup(anthropic_vision_script.set_model_backend, anthropic_vision_script.get_model_backend())
+        anthropic_vision_script.configure_extraction_cache(None)
+        anthropic_vision_script.set_model_backend(FakeBackend())
+
+    def count(self, prefix):
+        return sample(metrics.REGISTRY.render(), prefix) or 0
+
+    def test_stages_and_validations_are_recorded(self):
+        stages = ("model_call", "parse", "validate")
+        before = {stage: self.count(f'ramq_stage_seconds_count{{stage="{stage}"}}') for stage in stages}
+        valid_before = self.count('ramq_validations_total{kind="ramq",source="extraction",result="valid"}')
+
+        anthropic_vision_script.get_ramq("Jean Tremblay", is_image=False)
+
+        for stage in stages:
+            self.assertEqual(self.count(f'ramq_stage_seconds_count{{stage="{stage}"}}'), before[stage] + 1)
+        self.assertEqual(
+            self.count('ramq_validations_total{kind="ramq",source="extraction",result="valid"}'), valid_before + 1)
+
+    def test_image_stages_and_bytes(self):
+        from tests.bench_image_preprocess import make_photo
+        photo = make_photo(1200, 900)
+        before = self.count('ramq_bytes_total{stage="encode"}')
+        decode_before = self.count('ramq_stage_seconds_count{stage="decode"}')
+
+        output, _ = anthropic_vision_script.preprocess_image(photo, percent=40)
+
+        self.assertEqual(self.count('ramq_bytes_total{stage="encode"}'), before + len(output))
+        self.assertEqual(self.count('ramq_stage_seconds_count{stage="decode"}'), decode_before + 1)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    def setUp(self):
+        os.environ["HEADER_TOKEN"] = "test-token"
+        self.client = api.app.test_client()
+        self.headers = {"RAMQ-Billr-API-Key": "test-token"}
+
+    def test_requires_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+
+    def test_exposes_prometheus_text(self):
+        self.client.get("/validate_ramq?ramq=bad", headers=self.headers)
+        response = self.client.get("/metrics", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        text = response.get_data(as_text=True)
+        self.assertIn("# TYPE ramq_stage_seconds histogram", text)
+        self.assertGreaterEqual(sample(text, 'ramq_validations_total{kind="ramq",source="api",result="invalid"}'), 1)
+        self.assertIn('ramq_http_request_seconds_count{endpoint="/validate_ramq",status="400"}', text)
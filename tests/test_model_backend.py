@@ -0,0 +1,125 @@
+import asyncio
+import json
+import time
+import unittest
+from unittest import mock
+
+import anthropic_vision_script
+from anthropic_vision_script import get_patient_list, get_people_from_document, get_ramq, get_ramq_batch_text
+from model_backend import FakeBackend, FakeBackendError, ModelBackend, fake_backend_from_env
+from tests.helpers import card_bytes
+
+
+class TestFakeBackend(unittest.TestCase):
+    def test_backend_interface_is_abstract(self):
+        with self.assertRaises(TypeError):
+            ModelBackend()
+
+        class Incomplete(ModelBackend):
+            model = "incomplete"
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_fixed_and_rotating_responses(self):
+        self.assertEqual(FakeBackend('{"a": 1}').generate([], None), '{"a": 1}')
+
+        backend = FakeBackend(["one", "two"])
+        self.assertEqual([backend.generate([], None) for _ in range(3)], ["one", "two", "one"])
+        self.assertEqual(backend.calls, 3)
+
+    def test_error_rate_is_reproducible_with_seed(self):
+        def outcomes(seed):
+            backend = FakeBackend("{}", error_rate=0.3, seed=seed)
+            results = []
+            for _ in range(50):
+                try:
+                    backend.generate([], None)
+                    results.append(True)
+                except FakeBackendError as e:
+                    self.assertEqual(e.code, 503)
+                    results.append(False)
+            return results, backend.errors
+
+        first, errors = outcomes(7)
+        self.assertEqual(first, outcomes(7)[0])
+        self.assertGreater(errors, 0)
+        self.assertLess(errors, 50)
+
+    def test_async_calls_overlap(self):
+        backend = FakeBackend("{}", latency=0.05)
+
+        async def run():
+            await asyncio.gather(*(backend.agenerate([], None) for _ in range(10)))
+
+        start = time.perf_counter()
+        asyncio.run(run())
+        self.assertLess(time.perf_counter() - start, 0.4)
+        self.assertEqual(backend.max_in_flight, 10)
+        self.assertEqual(backend.in_flight, 0)
+
+    def test_failing_responses_callable_is_not_left_in_flight(self):
+        def responses(contents):
+            raise RuntimeError("bad canned response")
+
+        backend = FakeBackend(responses)
+        for _ in range(3):
+            with self.assertRaises(RuntimeError):
+                backend.generate([], None)
+        with self.assertRaises(RuntimeError):
+            asyncio.run(backend.agenerate([], None))
+        self.assertEqual((backend.in_flight, backend.max_in_flight, backend.calls), (0, 1, 4))
+
+    def test_from_env(self):
+        env = {"FAKE_MODEL_LATENCY": "0.25", "FAKE_MODEL_ERROR_RATE": "0.1", "FAKE_MODEL_SEED": "3"}
+        with mock.patch.dict("os.environ", env):
+            backend = fake_backend_from_env()
+        self.assertEqual(backend.latency, 0.25)
+        self.assertEqual(backend.error_rate, 0.1)
+        self.assertIsNone(backend.responses)
+
+
+class TestPipelineWithFakeBackend(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(anthropic_vision_script.configure_extraction_cache, anthropic_vision_script.extraction_cache)
+        self.addCleanup(anthropic_vision_script.set_model_backend, anthropic_vision_script.get_model_backend())
+        anthropic_vision_script.configure_extraction_cache(None)
+        self.backend = FakeBackend()
+        anthropic_vision_script.set_model_backend(self.backend)
+
+    def test_text_extraction(self):
+        result = get_ramq("Jean Tremblay TREJ 6405 0519", is_image=False)
+        self.assertEqual(result[:3], ("TREJ64050519", "Tremblay", "Jean"))
+        self.assertTrue(result[5])
+        self.assertEqual(self.backend.calls, 1)
+
+    def test_batch_text_extraction(self):
+        results = get_ramq_batch_text([f"Patient {i}" for i in range(5)])
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result[0] == "TREJ64050519" for result in results))
+        self.assertEqual(self.backend.calls, 1)
+
+    def test_patient_list(self):
+        with mock.patch.object(anthropic_vision_script, "download_image", return_value=(b"img", "image/png")):
+            patients = get_patient_list("https://example.com/list.png")
+        self.assertEqual([p.last_name for p in patients.patients], ["Tremblay", "Roy"])
+
+    def test_document_extraction(self):
+        people = get_people_from_document(card_bytes())
+        self.assertEqual([(p.ramq, p.page) for p in people], [("TREJ64050519", 1)])
+        self.assertTrue(people[0].valid_ramq)
+        self.assertEqual(self.backend.calls, 1)
+
+    def test_backend_model_is_part_of_cache_key(self):
+        anthropic_vision_script.configure_extraction_cache(anthropic_vision_script.ExtractionCache())
+        get_ramq("Jean Tremblay", is_image=False)
+        get_ramq("Jean Tremblay", is_image=False)
+        self.assertEqual(self.backend.calls, 1)
+
+        other = json.dumps({"first_name": "Other", "last_name": "Person"})
+        anthropic_vision_script.set_model_backend(FakeBackend(other, model="other"))
+        self.assertEqual(get_ramq("Jean Tremblay", is_image=False)[2], "Other")
+
+
+if __name__ == "__main__":
+    unittest.main()
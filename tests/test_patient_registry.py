@@ -0,0 +1,129 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import api
+import patient_registry
+from patient_registry import PatientRegistry, build_registry, main, normalize_key
+
+ROWS = [
+    ["patient_id", "last_name", "first_name", "NAM", "ohip", "mrn"],
+    ["1", "Tremblay", "Jean", "TREJ64050519", "", "A-100"],
+    ["2", "Gagnon", "Marie", "GAGM80520399", "1234567890", "A-200"],
+    ["3", "Roy", "Luc", "", "9876543210", ""],
+]
+RESULT = (
+    "TREJ64050519", "Tremblay", "Jean", datetime(1964, 5, 5), "male", True,
+    None, None, False, "RAMQ", "TREJ64050519",
+)
+
+
+class RegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.export = self.write_export(ROWS)
+        self.index = os.path.join(self.directory, "registry.idx")
+
+    def write_export(self, rows, name="export.csv"):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", newline="", encoding="utf-8") as handle:
+            csv.writer(handle).writerows(rows)
+        return path
+
+    def open_registry(self):
+        registry = PatientRegistry(self.index)
+        self.addCleanup(registry.close)
+        return registry
+
+
+class TestRegistry(RegistryTestCase):
+    def test_lookup_by_each_key(self):
+        header = build_registry(self.export, self.index)
+        self.assertEqual(header["rows"], 3)
+        self.assertEqual(header["keys"]["ramq"]["count"], 2)
+
+        registry = self.open_registry()
+        self.assertEqual(len(registry), 3)
+        self.assertEqual(registry.lookup("ramq", "trej 6405 0519")["patient_id"], "1")
+        self.assertEqual(registry.lookup("ohip", "1234-567-890-AB")["last_name"], "Gagnon")
+        self.assertEqual(registry.lookup("mrn", "a100")["first_name"], "Jean")
+        self.assertIsNone(registry.lookup("ramq", "ZZZZ00000000"))
+        self.assertIsNone(registry.lookup("ramq", None))
+
+    def test_match_tries_ramq_then_ohip_then_mrn(self):
+        build_registry(self.export, self.index)
+        registry = self.open_registry()
+        kind, record = registry.match(ramq="ZZZZ00000000", ohip="9876543210")
+        self.assertEqual((kind, record["patient_id"]), ("ohip", "3"))
+        self.assertIsNone(registry.match())
+
+    def test_column_override_and_missing_columns(self):
+        export = self.write_export([["id", "health_card"], ["7", "TREJ64050519"]], "other.csv")
+        build_registry(export, self.index, {"ramq": "health_card"})
+        self.assertEqual(self.open_registry().lookup("ramq", "TREJ64050519")["id"], "7")
+        with self.assertRaises(ValueError):
+            build_registry(export, self.index)
+
+    def test_many_rows(self):
+        rows = [["mrn", "name"]] + [[f"M{i:07d}", f"Patient {i}"] for i in range(20000)]
+        build_registry(self.write_export(rows), self.index)
+        registry = self.open_registry()
+        for i in (0, 1, 9999, 19999):
+            self.assertEqual(registry.lookup("mrn", f"M{i:07d}")["name"], f"Patient {i}")
+        self.assertIsNone(registry.lookup("mrn", "M9999999"))
+
+    def test_rebuild_is_picked_up(self):
+        build_registry(self.export, self.index)
+        env = {"PATIENT_REGISTRY": self.index, "PATIENT_REGISTRY_RELOAD_SECONDS": "0"}
+        with mock.patch.dict(os.environ, env), mock.patch.object(patient_registry, "_registry", None):
+            first = patient_registry.get_registry()
+            self.assertIs(patient_registry.get_registry(), first)
+
+            build_registry(self.write_export(ROWS[:2]), self.index)
+            second = patient_registry.get_registry()
+            self.assertIsNot(second, first)
+            self.assertEqual(len(second), 1)
+            # The old mapping stays readable for lookups already in flight
+            self.assertEqual(first.lookup("mrn", "A-200")["patient_id"], "2")
+
+    def test_command_line(self):
+        with mock.patch("sys.stderr"):
+            self.assertEqual(main(["build", self.export, self.index]), 0)
+        with mock.patch("builtins.print") as printed:
+            self.assertEqual(main(["lookup", self.index, "--mrn", "A-200"]), 0)
+        self.assertEqual(json.loads(printed.call_args[0][0])["record"]["patient_id"], "2")
+
+
+class TestExtractAttachesRecord(RegistryTestCase):
+    def test_registry_match_in_response(self):
+        build_registry(self.export, self.index)
+        os.environ["HEADER_TOKEN"] = "test-token"
+
+        async def fake_aget_ramq(input_data, is_image=True, repair=None):
+            return RESULT
+
+        with mock.patch.dict(os.environ, {"PATIENT_REGISTRY": self.index}), \
+                mock.patch.object(api, "aget_ramq", fake_aget_ramq):
+            response = api.app.test_client().post(
+                "/extract_json_from_image",
+                json={"is_image": False, "text": "Jean Tremblay"},
+                headers={"RAMQ-Billr-API-Key": "test-token"},
+            )
+        body = response.get_json()
+        self.assertEqual(body["registry_match"]["matched_on"], "ramq")
+        self.assertEqual(body["registry_match"]["record"]["patient_id"], "1")
+
+    def test_normalize_key(self):
+        self.assertEqual(normalize_key("ohip", "1234 567 890 AB"), "1234567890")
+        self.assertIsNone(normalize_key("ohip", "12345"))
+        self.assertEqual(normalize_key("ramq", " trej-6405-0519 "), "TREJ64050519")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import io
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+
+from anthropic_vision_script import (
+    RAMQ_REASON_CHECK_DIGIT,
+    RAMQ_REASON_FORMAT,
+    RAMQ_REASON_LENGTH,
+    validate_ramq,
+    validate_ramq_batch,
+)
+
+
+def random_ramq(rng: random.Random) -> str:
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    name = "".join(rng.choice(letters) for _ in range(4))
+    month = rng.randint(1, 12) + rng.choice([0, 50])
+    return (
+        f"{name}{rng.randint(0, 99):02d}{month:02d}"
+        f"{rng.randint(1, 31):02d}{rng.randint(0, 9)}{rng.randint(0, 9)}"
+    )
+
+
+class TestValidateRamqBatch(unittest.TestCase):
+    def test_matches_scalar_on_random_numbers(self):
+        rng = random.Random(1234)
+        ramqs = [random_ramq(rng) for _ in range(5000)]
+        # Sequence slot and name may hold any tabulated character
+        ramqs += ["1A2B90010111", "ABCD900101Z1", "ABCD99999999"]
+
+        valid, reasons = validate_ramq_batch(ramqs)
+
+        expected = [validate_ramq(ramq) for ramq in ramqs]
+        self.assertEqual(valid.tolist(), expected)
+        self.assertTrue(any(expected))
+        for ok, reason in zip(valid, reasons):
+            self.assertEqual(reason, None if ok else RAMQ_REASON_CHECK_DIGIT)
+
+    def test_matches_scalar_for_every_sequence_and_check_digit(self):
+        for prefix in ["TREM640550", "ABCD900101", "ZZZZ255512"]:
+            ramqs = [f"{prefix}{seq}{check}" for seq in "0123456789" for check in range(10)]
+            valid, _ = validate_ramq_batch(np.array(ramqs))
+            self.assertEqual(valid.tolist(), [validate_ramq(r) for r in ramqs])
+
+    def test_any_byte_order(self):
+        ramqs = ["TREM64055089", "ABCD12345678", "TREM6405508"]
+        expected = validate_ramq_batch(ramqs)
+        for dtype in (">U12", "<U12", ">U16"):
+            valid, reasons = validate_ramq_batch(np.array(ramqs, dtype=dtype))
+            self.assertEqual((valid.tolist(), reasons), (expected[0].tolist(), expected[1]), dtype)
+        self.assertEqual(expected[1][1], RAMQ_REASON_CHECK_DIGIT)
+
+    def test_reports_failure_reasons(self):
+        valid, reasons = validate_ramq_batch(
+            ["ABCD9001011", "abcd90010111", "ABCD9O010111", "ÀBCD90010111", "", "ABCD900101111"]
+        )
+        self.assertFalse(valid.any())
+        self.assertEqual(
+            reasons,
+            [
+                RAMQ_REASON_LENGTH,
+                RAMQ_REASON_FORMAT,
+                RAMQ_REASON_FORMAT,
+                RAMQ_REASON_FORMAT,
+                RAMQ_REASON_LENGTH,
+                RAMQ_REASON_LENGTH,
+            ],
+        )
+
+    def test_reads_files_and_file_objects(self):
+        rng = random.Random(7)
+        ramqs = [random_ramq(rng) for _ in range(50)]
+        expected = [validate_ramq(ramq) for ramq in ramqs]
+
+        valid, _ = validate_ramq_batch(io.StringIO("\n".join(ramqs) + "\n\n"))
+        self.assertEqual(valid.tolist(), expected)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "roster.txt")
+            with open(path, "w", encoding="utf-8") as handle:
+                handle.write("\n".join(ramqs))
+            valid, _ = validate_ramq_batch(path)
+        self.assertEqual(valid.tolist(), expected)
+
+    def test_empty_input(self):
+        valid, reasons = validate_ramq_batch([])
+        self.assertEqual(valid.shape, (0,))
+        self.assertEqual(reasons, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import time
+import unittest
+from datetime import datetime
+
+import api
+from anthropic_vision_script import (
+    RamqPrefixIndex,
+    expected_ramq_prefixes,
+    ramq_name_prefixes,
+    score_ramq_consistency,
+)
+
+DOB = datetime(1964, 5, 5)
+
+
+class TestExpectedPrefixes(unittest.TestCase):
+    def test_simple_name(self):
+        self.assertEqual(ramq_name_prefixes("Tremblay", "Jean"), ("TREJ",))
+        self.assertEqual(expected_ramq_prefixes("Tremblay", "Jean", DOB, "male"), ("TREJ640505",))
+        self.assertEqual(expected_ramq_prefixes("Tremblay", "Jean", DOB), ("TREJ640505", "TREJ645505"))
+
+    def test_accents_short_and_compound_names(self):
+        self.assertEqual(ramq_name_prefixes("Bédard", "Élise"), ("BEDE",))
+        self.assertEqual(ramq_name_prefixes("Ng", "Anh"), ("NGXA",))
+        self.assertEqual(ramq_name_prefixes("De La Fontaine", "Marie"), ("DELM", "DEXM", "FONM"))
+        self.assertEqual(ramq_name_prefixes("Li-Tremblay", "Amy"), ("LITA", "LIXA"))
+        self.assertEqual(ramq_name_prefixes(None, "Amy"), ())
+
+
+class TestConsistencyScore(unittest.TestCase):
+    def test_matching_extraction(self):
+        result = score_ramq_consistency("TREJ64050519", "Tremblay", "Jean", DOB, "male")
+        self.assertTrue(result.consistent)
+        self.assertEqual(result.score, 1.0)
+
+    def test_mismatched_name_is_flagged(self):
+        result = score_ramq_consistency("TREJ64050519", "Gagnon", "Marie", DOB)
+        self.assertTrue(result.valid)
+        self.assertFalse(result.name_match)
+        self.assertFalse(result.consistent)
+        self.assertLess(result.score, 1.0)
+
+    def test_mismatched_birth_date_and_sex(self):
+        result = score_ramq_consistency("TREJ64050519", "Tremblay", "Jean", datetime(1970, 1, 1), "female")
+        self.assertEqual((result.dob_match, result.sex_match), (False, False))
+        self.assertAlmostEqual(result.score, 1 / 3)
+
+    def test_invalid_number_scores_zero(self):
+        result = score_ramq_consistency("TREJ64050518", "Tremblay", "Jean")
+        self.assertEqual((result.valid, result.score), (False, 0.0))
+        self.assertFalse(score_ramq_consistency(None).consistent)
+
+
+class TestPrefixIndex(unittest.TestCase):
+    def test_lookup(self):
+        index = RamqPrefixIndex.build([
+            ("p1", "Tremblay", "Jean", DOB, "male"),
+            ("p2", "Tremblay", "Julie", DOB, "female"),
+            ("p3", "Gagnon", "Marc", datetime(1980, 2, 3)),
+        ])
+        self.assertEqual(index.lookup("TREJ 6405 0519"), ["p1"])
+        self.assertEqual(index.lookup("TREJ64550512"), ["p2"])
+        self.assertEqual(index.lookup("GAGM80520399"), ["p3"])
+        self.assertEqual(index.lookup("ROYM80020311"), [])
+        self.assertEqual(index.lookup(None), [])
+
+    def test_large_registry_lookups_are_constant_time(self):
+        index = RamqPrefixIndex.build(
+            (i, f"Name{i % 5000}", "Jean", datetime(1940 + i % 60, 1 + i % 12, 1 + i % 28), "male")
+            for i in range(50000)
+        )
+        start = time.perf_counter()
+        for _ in range(10000):
+            index.lookup("NAMJ64050519")
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+
+class TestValidateEndpoint(unittest.TestCase):
+    def setUp(self):
+        os.environ["HEADER_TOKEN"] = "test-token"
+        self.client = api.app.test_client()
+        self.headers = {"RAMQ-Billr-API-Key": "test-token"}
+
+    def test_cross_check_is_optional(self):
+        response = self.client.get("/validate_ramq?ramq=TREJ64050519", headers=self.headers)
+        self.assertEqual(response.get_json(), {"valid": True})
+
+        response = self.client.get(
+            "/validate_ramq?ramq=TREJ64050519&last_name=Gagnon&first_name=Marie&dob=1964-05-05",
+            headers=self.headers,
+        )
+        body = response.get_json()
+        self.assertFalse(body["consistent"])
+        self.assertFalse(body["consistency"]["name_match"])
+        self.assertTrue(body["consistency"]["dob_match"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import random
+import string
+import unittest
+from datetime import date
+from unittest import mock
+
+import anthropic_vision_script
+from anthropic_vision_script import RAMQ_REQUERY_PROMPT, repair_ramq, validate_ramq
+from model_backend import FAKE_PERSON, FakeBackend
+from resolution import ResolutionController
+from tests.helpers import card_bytes
+
+DOB = date(1964, 5, 5)
+
+
+def person(ramq):
+    return json.dumps(dict(FAKE_PERSON, ramq=ramq))
+
+
+class TestRepairRamq(unittest.TestCase):
+    def test_ocr_confusions(self):
+        for misread in ("TREJ64O50519", "TREJ6405O5I9", "TREJ64O5O519", "trej 64O5 0519"):
+            self.assertEqual(repair_ramq(misread, "Tremblay", "Jean", DOB), "TREJ64050519", misread)
+
+    def test_name_and_date_of_birth_do_not_supply_characters(self):
+        self.assertIsNone(repair_ramq("TRE164050519", "Tremblay", "Jean", DOB))
+        self.assertIsNone(repair_ramq("TREJ64030519", "Tremblay", "Jean", DOB))
+        self.assertIsNone(repair_ramq("LRWY51781286", "Tremblay", "Jean", DOB))
+
+    def test_candidates_must_match_date_of_birth(self):
+        self.assertIsNone(repair_ramq("TREJ64O50519", "Tremblay", "Jean", date(1964, 5, 6)))
+
+    def test_random_invalid_numbers_are_not_repaired(self):
+        rng = random.Random(5)
+        repaired = attempts = 0
+        while attempts < 2000:
+            ramq = "".join(rng.choice(string.ascii_uppercase) for _ in range(4)) + "".join(
+                rng.choice(string.digits) for _ in range(8))
+            if validate_ramq(ramq):
+                continue
+            attempts += 1
+            repaired += repair_ramq(ramq, "Tremblay", "Jean", DOB) is not None
+            repaired += repair_ramq(ramq) is not None
+        self.assertEqual(repaired, 0)
+
+    def test_edit_limit(self):
+        self.assertIsNone(repair_ramq("TREJ64O5O519", "Tremblay", "Jean", DOB, max_edits=1))
+
+    def test_valid_number_is_unchanged(self):
+        self.assertEqual(repair_ramq("TREJ64050519", "Tremblay", "Jean", DOB), "TREJ64050519")
+
+    def test_no_unique_fix(self):
+        self.assertIsNone(repair_ramq("TREJ64050518", "Tremblay", "Jean", DOB))
+        self.assertIsNone(repair_ramq(None))
+        self.assertIsNone(repair_ramq("not a number"))
+
+
+class TestRepairInExtraction(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(anthropic_vision_script.configure_extraction_cache, anthropic_vision_script.extraction_cache)
+        self.addCleanup(anthropic_vision_script.set_model_backend, anthropic_vision_script.get_model_backend())
+        self.addCleanup(anthropic_vision_script.set_resolution_controller,
+                        anthropic_vision_script.resolution_controller)
+        anthropic_vision_script.configure_extraction_cache(None)
+        anthropic_vision_script.set_resolution_controller(ResolutionController())
+
+        self.prompts = []
+        card = (card_bytes((2000, 1250)), "image/jpeg")
+        for patcher in (mock.patch.object(anthropic_vision_script, "download_image", return_value=card),
+                        mock.patch.object(anthropic_vision_script, "adownload_image", return_value=card)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def use_responses(self, *responses):
+        def respond(contents):
+            self.prompts.append(contents[0].parts[-1].text)
+            return responses[len(self.prompts) - 1]
+        anthropic_vision_script.set_model_backend(FakeBackend(respond))
+
+    def test_local_fix_needs_one_call(self):
+        self.use_responses(person("TREJ64O50519"))
+        result = anthropic_vision_script.get_ramq("https://example.com/card.jpg", repair=True)
+        self.assertEqual(result[0], "TREJ64050519")
+        self.assertTrue(result[5])
+        self.assertEqual(len(self.prompts), 1)
+
+    def test_unfixable_number_is_requeried_alone(self):
+        self.use_responses(person("TREJ64050518"), json.dumps({"ramq": "TREJ64050519"}))
+        result = anthropic_vision_script.get_ramq("https://example.com/card.jpg", repair=True)
+        self.assertEqual(result[0], "TREJ64050519")
+        self.assertTrue(result[5])
+        self.assertEqual(result[1:3], ("Tremblay", "Jean"))
+        self.assertEqual(self.prompts[1], RAMQ_REQUERY_PROMPT)
+
+    def test_failed_requery_keeps_first_reading(self):
+        self.use_responses(person("TREJ64050518"), json.dumps({"ramq": None}))
+        result = anthropic_vision_script.get_ramq("https://example.com/card.jpg", repair=True)
+        self.assertEqual(result[0], "TREJ64050518")
+        self.assertFalse(result[5])
+
+    def test_async_path(self):
+        self.use_responses(person("TREJ64050518"), json.dumps({"ramq": "TREJ 6405 0519"}))
+        result = asyncio.run(anthropic_vision_script.aget_ramq("https://example.com/card.jpg", repair=True))
+        self.assertTrue(result[5])
+        self.assertEqual(len(self.prompts), 2)
+
+    def test_text_is_repaired_locally(self):
+        self.use_responses(person("TREJ6405O5I9"))
+        result = anthropic_vision_script.get_ramq("Jean Tremblay", is_image=False, repair=True)
+        self.assertEqual(result[0], "TREJ64050519")
+        self.assertEqual(len(self.prompts), 1)
+
+    def test_off_by_default(self):
+        self.use_responses(person("TREJ64O50519"), person("TREJ64O50519"))
+        result = anthropic_vision_script.get_ramq("https://example.com/card.jpg", repair=False)
+        self.assertFalse(result[5])
+        self.assertNotIn(RAMQ_REQUERY_PROMPT, self.prompts)
+
+
+if __name__ == "__main__":
+    unittest.main()
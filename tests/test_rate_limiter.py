@@ -0,0 +1,247 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from google.genai import types
+
+import anthropic_vision_script
+import api
+import rate_limiter
+from model_backend import FakeBackend, FakeBackendError
+from rate_limiter import BATCH, INTERACTIVE, FileState, RateLimiter, RateLimitExceeded
+from tests.helpers import FakeClock, card_bytes
+
+
+class TestBuckets(unittest.TestCase):
+    def test_requests_per_minute(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rpm=60, clock=clock)
+        for _ in range(60):
+            self.assertEqual(limiter.try_acquire(0), 0.0)
+        self.assertAlmostEqual(limiter.try_acquire(0), 1.0)
+        clock.now += 1.0
+        self.assertEqual(limiter.try_acquire(0), 0.0)
+
+    def test_tokens_per_minute(self):
+        clock = FakeClock()
+        limiter = RateLimiter(tpm=6000, clock=clock)
+        self.assertEqual(limiter.try_acquire(5000), 0.0)
+        # 1000 tokens left, 2000 missing at 100 tokens per second
+        self.assertAlmostEqual(limiter.try_acquire(3000), 20.0)
+        clock.now += 20.0
+        self.assertEqual(limiter.try_acquire(3000), 0.0)
+
+    def test_oversized_call_fits_a_full_bucket(self):
+        limiter = RateLimiter(tpm=1000, clock=FakeClock())
+        self.assertEqual(limiter.try_acquire(50000), 0.0)
+
+    def test_lower_priorities_leave_a_reserve(self):
+        limiter = RateLimiter(rpm=8, clock=FakeClock())
+        taken = 0
+        while limiter.try_acquire(0, BATCH) == 0.0:
+            taken += 1
+        # Batch stops with a quarter of the bucket left for interactive calls
+        self.assertEqual(taken, 6)
+        self.assertEqual(limiter.try_acquire(0, INTERACTIVE), 0.0)
+        self.assertEqual(limiter.try_acquire(0, INTERACTIVE), 0.0)
+        self.assertGreater(limiter.try_acquire(0, INTERACTIVE), 0.0)
+
+    def test_penalize_blocks_and_empties(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rpm=60, clock=clock, penalty_seconds=5.0)
+        limiter.penalize()
+        self.assertAlmostEqual(limiter.try_acquire(0), 5.0)
+        clock.now += 5.0
+        # The buckets refilled for 5 seconds while blocked
+        for _ in range(5):
+            self.assertEqual(limiter.try_acquire(0), 0.0)
+        self.assertGreater(limiter.try_acquire(0), 0.0)
+
+
+class TestFileState(unittest.TestCase):
+    def test_limiters_share_the_state_file(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "quota")
+        clock = FakeClock()
+        first = RateLimiter(rpm=10, state=FileState(path), clock=clock)
+        second = RateLimiter(rpm=10, state=FileState(path), clock=clock)
+        for _ in range(5):
+            self.assertEqual(first.try_acquire(0), 0.0)
+            self.assertEqual(second.try_acquire(0), 0.0)
+        self.assertGreater(first.try_acquire(0), 0.0)
+        self.assertGreater(second.try_acquire(0), 0.0)
+
+        second.penalize(30.0)
+        clock.now += 12.0
+        self.assertAlmostEqual(first.try_acquire(0), 18.0)
+
+    def test_threads_never_overdraw(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "quota")
+        clock = FakeClock()
+        limiters = [RateLimiter(rpm=100, state=FileState(path), clock=clock) for _ in range(2)]
+        taken = []
+
+        def take(limiter):
+            for _ in range(100):
+                if limiter.try_acquire(0) == 0.0:
+                    taken.append(1)
+
+        threads = [threading.Thread(target=take, args=(limiters[index % 2],)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(taken), 100)
+
+
+class TestAcquire(unittest.TestCase):
+    def test_sheds_when_the_wait_is_too_long(self):
+        limiter = RateLimiter(rpm=1, clock=FakeClock())
+        limiter.acquire()
+        outcomes = []
+        limiter.on_acquire = lambda priority, result, waited: outcomes.append((priority, result))
+        with self.assertRaises(RateLimitExceeded) as raised:
+            limiter.acquire(max_wait=1.0)
+        self.assertAlmostEqual(raised.exception.retry_after, 60.0)
+        self.assertEqual(outcomes, [(INTERACTIVE, "shed")])
+
+    def test_interactive_waiters_go_first(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rpm=60, burst_seconds=1.0, reserve={BATCH: 0.0}, poll_interval=0.005, clock=clock)
+        limiter.acquire()
+        order = []
+
+        def wait_for_quota(priority_name):
+            limiter.acquire(priority_name=priority_name)
+            order.append(priority_name)
+
+        batch = threading.Thread(target=wait_for_quota, args=(BATCH,))
+        batch.start()
+        time.sleep(0.05)
+        interactive = threading.Thread(target=wait_for_quota, args=(INTERACTIVE,))
+        interactive.start()
+        time.sleep(0.05)
+        for _ in range(2):
+            clock.now += 1.0
+            time.sleep(0.1)
+        batch.join(5)
+        interactive.join(5)
+        self.assertEqual(order, [INTERACTIVE, BATCH])
+
+    def test_context_priority(self):
+        limiter = RateLimiter(rpm=60, max_wait={BATCH: 0.0}, clock=FakeClock())
+        for _ in range(50):
+            limiter.acquire()
+        # Interactive may take the last quarter, batch may not
+        with rate_limiter.priority(BATCH):
+            with self.assertRaises(RateLimitExceeded):
+                limiter.acquire()
+        limiter.acquire()
+
+    def test_async_acquire(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rpm=60, burst_seconds=1.0, poll_interval=0.005, clock=clock)
+
+        async def run():
+            await limiter.aacquire()
+            waiter = asyncio.ensure_future(limiter.aacquire())
+            await asyncio.sleep(0.02)
+            self.assertFalse(waiter.done())
+            clock.now += 1.0
+            await asyncio.wait_for(waiter, 1.0)
+
+        asyncio.run(run())
+
+
+class TestModelCalls(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(anthropic_vision_script.configure_extraction_cache, anthropic_vision_script.extraction_cache)
+        self.addCleanup(anthropic_vision_script.set_model_backend, anthropic_vision_script.get_model_backend())
+        self.addCleanup(anthropic_vision_script.set_rate_limiter, anthropic_vision_script.get_rate_limiter())
+        anthropic_vision_script.configure_extraction_cache(None)
+
+    def test_estimate_tokens(self):
+        contents = anthropic_vision_script._image_contents(card_bytes(), "image/jpeg", "x" * 400)
+        # Two 768px tiles, 100 prompt tokens and the response estimate
+        expected = 2 * 258 + 101 + anthropic_vision_script.RESPONSE_TOKENS_ESTIMATE
+        self.assertEqual(anthropic_vision_script.estimate_tokens(contents), expected)
+
+    def test_estimate_pdf_pages(self):
+        def pdf_tokens(data):
+            part = types.Part.from_bytes(data=data, mime_type="application/pdf")
+            return anthropic_vision_script._part_tokens(part) // anthropic_vision_script.IMAGE_TILE_TOKENS
+
+        pages = b"<< /Type /Pages /Count 3 >> << /Type /Page >> << /Type/Page >> <</Type\n/Page/Parent 1 0 R>>"
+        self.assertEqual(pdf_tokens(b"%PDF-1.7 " + pages), 3)
+        # Pages hidden in a compressed object stream still count as one
+        self.assertEqual(pdf_tokens(b"%PDF-1.7 << /Type /ObjStm /Filter /FlateDecode >>"), 1)
+
+    def test_quota_error_penalizes_all_callers(self):
+        calls = []
+
+        def respond(contents):
+            calls.append(1)
+            if len(calls) == 1:
+                raise FakeBackendError("Resource exhausted", code=429)
+            return '{"first_name": "Jean", "last_name": "Tremblay", "ramq": "TREJ64050519"}'
+
+        limiter = RateLimiter(rpm=60, penalty_seconds=0.2)
+        acquired = []
+        limiter.on_acquire = lambda priority, result, waited: acquired.append(waited)
+        anthropic_vision_script.set_rate_limiter(limiter)
+        anthropic_vision_script.set_model_backend(FakeBackend(respond))
+        with mock.patch.object(anthropic_vision_script.request_policy, "backoff_base", 0.001):
+            result = anthropic_vision_script.get_ramq_from_bytes(card_bytes())
+        self.assertEqual(result[0], "TREJ64050519")
+        self.assertEqual(len(calls), 2)
+        # The retry took its own quota, after waiting out the penalty
+        self.assertEqual(len(acquired), 2)
+        self.assertGreater(acquired[1], 0.1)
+
+    def test_hedged_requests_are_charged(self):
+        limiter = RateLimiter(rpm=600)
+        acquired = []
+        limiter.on_acquire = lambda priority, result, waited: acquired.append(priority)
+        anthropic_vision_script.set_rate_limiter(limiter)
+        anthropic_vision_script.set_model_backend(FakeBackend(latency=0.2))
+        policy = anthropic_vision_script.request_policy
+        with mock.patch.object(policy, "hedge", True), mock.patch.object(policy, "hedge_after", 0.05), \
+                rate_limiter.priority(BATCH):
+            anthropic_vision_script.get_ramq_from_bytes(card_bytes())
+        self.assertEqual(acquired, [BATCH, BATCH])
+
+    def test_api_answers_503_when_shed(self):
+        os.environ["HEADER_TOKEN"] = "test-token"
+        limiter = RateLimiter(rpm=1, max_wait={INTERACTIVE: 0.5}, clock=FakeClock())
+        limiter.acquire()
+        anthropic_vision_script.set_rate_limiter(limiter)
+        backend = FakeBackend()
+        anthropic_vision_script.set_model_backend(backend)
+        response = api.app.test_client().post("/extract_upload", data=card_bytes(), content_type="image/jpeg",
+                                              headers={"RAMQ-Billr-API-Key": "test-token"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "60")
+        self.assertEqual(backend.calls, 0)
+
+    def test_from_env(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("MODEL_RPM", None)
+            os.environ.pop("MODEL_TPM", None)
+            self.assertIsNone(rate_limiter.limiter_from_env())
+        with mock.patch.dict(os.environ, {"MODEL_RPM": "120", "RATE_LIMIT_STATE": "memory",
+                                          "RATE_LIMIT_MAX_WAIT_BATCH": "30"}):
+            limiter = rate_limiter.limiter_from_env()
+        self.assertEqual(limiter.capacity, (120.0, 0.0))
+        self.assertIsInstance(limiter.state, rate_limiter.MemoryState)
+        self.assertEqual(limiter.max_wait[BATCH], 30.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import asyncio
+import time
+import unittest
+
+import anthropic_vision_script
+from model_backend import FakeBackend, FakeBackendError
+from request_policy import AttemptTimeoutError, RequestPolicy, is_retryable
+
+
+class Flaky:
+    """Fails `failures` times with the given error, then answers."""
+
+    def __init__(self, failures, error=None, delay=0.0):
+        self.failures = failures
+        self.error = error or FakeBackendError()
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        time.sleep(self.delay)
+        return "ok"
+
+
+class Delays:
+    """Answers call n after delays[n] seconds (sync or async)."""
+
+    def __init__(self, *delays):
+        self.delays = delays
+        self.calls = 0
+
+    def _next_delay(self):
+        delay = self.delays[min(self.calls, len(self.delays) - 1)]
+        self.calls += 1
+        return delay
+
+    def __call__(self):
+        delay = self._next_delay()
+        time.sleep(delay)
+        return f"answer after {delay}"
+
+    async def coroutine(self):
+        delay = self._next_delay()
+        await asyncio.sleep(delay)
+        return f"answer after {delay}"
+
+
+class TestRetries(unittest.TestCase):
+    def test_transient_errors_are_retried(self):
+        policy = RequestPolicy(backoff_base=0.001)
+        func = Flaky(2)
+        self.assertEqual(policy.call(func), "ok")
+        self.assertEqual(func.calls, 3)
+        self.assertEqual(policy.counters["retries"], 2)
+        self.assertEqual([t.outcome for t in policy.attempts(call=1)], ["error", "error", "ok"])
+
+    def test_permanent_errors_are_not_retried(self):
+        policy = RequestPolicy(backoff_base=0.001)
+        func = Flaky(1, error=ValueError("bad request"))
+        with self.assertRaises(ValueError):
+            policy.call(func)
+        self.assertEqual(func.calls, 1)
+        self.assertEqual(policy.counters["failures"], 1)
+
+    def test_gives_up_after_max_attempts(self):
+        policy = RequestPolicy(max_attempts=3, backoff_base=0.001)
+        with self.assertRaises(FakeBackendError):
+            policy.call(Flaky(10))
+        self.assertEqual(policy.counters["attempts"], 3)
+
+    def test_deadline_bounds_retries(self):
+        policy = RequestPolicy(max_attempts=100, deadline=0.2, backoff_base=0.05, backoff_max=0.05)
+        start = time.perf_counter()
+        with self.assertRaises(FakeBackendError):
+            policy.call(Flaky(1000))
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_backoff_grows_and_is_capped(self):
+        policy = RequestPolicy(backoff_base=1.0, backoff_max=4.0, seed=1)
+        for retry in range(1, 8):
+            delays = [policy.backoff(retry) for _ in range(50)]
+            self.assertLessEqual(max(delays), min(4.0, 2 ** (retry - 1)))
+
+    def test_retryable_classification(self):
+        self.assertTrue(is_retryable(FakeBackendError(code=503)))
+        self.assertTrue(is_retryable(FakeBackendError(code=429)))
+        self.assertTrue(is_retryable(AttemptTimeoutError()))
+        self.assertFalse(is_retryable(FakeBackendError(code=400)))
+        self.assertFalse(is_retryable(ValueError()))
+
+
+class TestDeadlinesAndHedging(unittest.TestCase):
+    def test_slow_attempt_times_out_and_retries(self):
+        policy = RequestPolicy(attempt_timeout=0.05, backoff_base=0.001)
+        func = Delays(1.0, 0.0)
+        start = time.perf_counter()
+        self.assertEqual(policy.call(func), "answer after 0.0")
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual([t.outcome for t in policy.attempts()], ["timeout", "ok"])
+
+    def test_hedge_wins_over_slow_attempt(self):
+        policy = RequestPolicy(hedge=True, hedge_after=0.05)
+        func = Delays(1.0, 0.01)
+        start = time.perf_counter()
+        self.assertEqual(policy.call(func), "answer after 0.01")
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(policy.counters["hedges"], 1)
+        self.assertEqual(policy.counters["hedge_wins"], 1)
+        timings = policy.attempts()
+        self.assertTrue(any(t.hedged and t.outcome == "ok" for t in timings))
+        self.assertTrue(any(not t.hedged and t.outcome == "cancelled" for t in timings))
+
+    def test_fast_attempt_is_not_hedged(self):
+        policy = RequestPolicy(hedge=True, hedge_after=0.5)
+        policy.call(Delays(0.0))
+        self.assertEqual(policy.counters["hedges"], 0)
+
+    def test_hedge_delay_follows_p95_once_warm(self):
+        policy = RequestPolicy(hedge=True, hedge_min_samples=20)
+        self.assertIsNone(policy.hedge_delay())
+        for ms in range(1, 101):
+            policy.latency.add(ms / 1000)
+        self.assertAlmostEqual(policy.hedge_delay(), 0.096)
+
+    def test_async_hedge_cancels_loser(self):
+        policy = RequestPolicy(hedge=True, hedge_after=0.05)
+        func = Delays(1.0, 0.01)
+
+        async def run():
+            start = time.perf_counter()
+            result = await policy.acall(func.coroutine)
+            return result, time.perf_counter() - start
+
+        result, elapsed = asyncio.run(run())
+        self.assertEqual(result, "answer after 0.01")
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(policy.counters["hedge_wins"], 1)
+
+    def test_async_attempt_timeout(self):
+        policy = RequestPolicy(attempt_timeout=0.05, max_attempts=2, backoff_base=0.001)
+        func = Delays(1.0, 1.0)
+        with self.assertRaises(AttemptTimeoutError):
+            asyncio.run(policy.acall(func.coroutine))
+        self.assertEqual(policy.counters["timeouts"], 2)
+
+
+class TestExtractionUsesPolicy(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(anthropic_vision_script.configure_extraction_cache, anthropic_vision_script.extraction_cache)
+        self.addCleanup(anthropic_vision_script.set_model_backend, anthropic_vision_script.get_model_backend())
+        self.addCleanup(anthropic_vision_script.set_request_policy, anthropic_vision_script.get_request_policy())
+        anthropic_vision_script.configure_extraction_cache(None)
+
+    def test_get_ramq_survives_transient_errors(self):
+        backend = FakeBackend(error_rate=0.5, seed=3)
+        policy = RequestPolicy(max_attempts=10, backoff_base=0.001)
+        anthropic_vision_script.set_model_backend(backend)
+        anthropic_vision_script.set_request_policy(policy)
+
+        for _ in range(10):
+            result = anthropic_vision_script.get_ramq("Jean Tremblay", is_image=False)
+            self.assertEqual(result[1], "Tremblay")
+        self.assertGreater(backend.errors, 0)
+        self.assertEqual(policy.counters["retries"], backend.errors)
+
+
+if __name__ == "__main__":
+    unittest.main()
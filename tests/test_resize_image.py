@@ -0,0 +1,68 @@
+import unittest
+from io import BytesIO
+
+from PIL import Image
+
+from anthropic_vision_script import (
+    get_resize_stats,
+    reset_resize_stats,
+    resize_image,
+    resize_image_with_stats,
+)
+
+
+def noisy_jpeg(width, height, quality=95):
+    buffer = BytesIO()
+    Image.effect_noise((width, height), 60).convert("RGB").save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class TestResizeImage(unittest.TestCase):
+    def setUp(self):
+        reset_resize_stats()
+
+    def test_small_image_untouched(self):
+        data = noisy_jpeg(200, 100)
+        result, stats = resize_image_with_stats(data, max_size_mb=1)
+        self.assertIs(result, data)
+        self.assertEqual(stats["encodes"], 0)
+
+    def test_large_image_fits_within_encode_budget(self):
+        data = noisy_jpeg(2400, 1800)
+        max_size_mb = len(data) / 8 / (1024 * 1024)
+
+        result, stats = resize_image_with_stats(data, max_size_mb=max_size_mb, max_encodes=5)
+
+        self.assertLessEqual(len(result), max_size_mb * 1024 * 1024)
+        self.assertLessEqual(stats["encodes"], 5)
+        self.assertLess(stats["scale"], 1.0)
+        self.assertEqual(Image.open(BytesIO(result)).format, "JPEG")
+        # Use most of the budget rather than overshrinking
+        self.assertGreater(len(result), max_size_mb * 1024 * 1024 * 0.5)
+
+    def test_slightly_oversized_image_keeps_resolution(self):
+        data = noisy_jpeg(1200, 900, quality=75)
+        result, stats = resize_image_with_stats(data, max_size_mb=len(data) * 0.9 / (1024 * 1024))
+        self.assertEqual(stats["scale"], 1.0)
+        self.assertLess(stats["quality"], 75)
+        self.assertEqual(Image.open(BytesIO(result)).size, (1200, 900))
+
+    def test_rgba_input(self):
+        image = Image.effect_noise((800, 600), 60).convert("RGBA")
+        buffer = BytesIO()
+        image.save(buffer, format="PNG")
+        result = resize_image(buffer.getvalue(), max_size_mb=0.1)
+        self.assertLessEqual(len(result), 0.1 * 1024 * 1024)
+
+    def test_aggregate_stats(self):
+        resize_image(noisy_jpeg(1600, 1200), max_size_mb=0.2)
+        resize_image(noisy_jpeg(100, 100), max_size_mb=0.2)
+        totals = get_resize_stats()
+        self.assertEqual(totals["calls"], 2)
+        self.assertEqual(totals["resized"], 1)
+        self.assertGreaterEqual(totals["encodes"], 2)
+        self.assertEqual(totals["avg_encodes"], totals["encodes"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import json
+import os
+import tempfile
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from PIL import Image
+
+import anthropic_vision_script
+from anthropic_vision_script import image_dimensions, preprocess_image
+from model_backend import FAKE_PERSON, FakeBackend
+from resolution import CurvePoint, ResolutionController, build_curves, load_curves, save_curves
+from tests.helpers import jpeg_bytes
+
+INVALID_PERSON = json.dumps(dict(FAKE_PERSON, ramq="TREJ64050518"))
+VALID_PERSON = json.dumps(FAKE_PERSON)
+
+
+def curves(points, edge=2400):
+    return {edge: [CurvePoint(width, samples, accuracy) for width, samples, accuracy in points]}
+
+
+class TestController(unittest.TestCase):
+    def test_fallback_matches_fixed_percentage(self):
+        controller = ResolutionController()
+        self.assertEqual(controller.choose_width(2000), 800)
+        self.assertEqual(controller.choose_width(300), 200)
+        self.assertEqual(controller.choose_width(150), 150)
+
+    def test_smallest_width_meeting_target(self):
+        controller = ResolutionController(curves([(200, 5, 0.4), (400, 5, 0.96), (800, 5, 1.0)]))
+        self.assertEqual(controller.choose_width(2000), 400)
+
+    def test_points_with_few_samples_are_ignored(self):
+        controller = ResolutionController(curves([(200, 1, 1.0), (400, 5, 0.96)]))
+        self.assertEqual(controller.choose_width(2000), 400)
+
+    def test_most_accurate_width_when_none_meets_target(self):
+        controller = ResolutionController(curves([(200, 5, 0.4), (400, 5, 0.8), (800, 5, 0.7)]))
+        self.assertEqual(controller.choose_width(2000), 400)
+
+    def test_uses_band_of_source_width(self):
+        controller = ResolutionController(curves([(200, 5, 1.0)], edge=1200))
+        self.assertEqual(controller.choose_width(1000), 200)
+        self.assertEqual(controller.choose_width(2000), 800)
+
+    def test_retry_width(self):
+        controller = ResolutionController(curves([(400, 5, 0.96), (800, 5, 1.0), (1600, 5, 1.0)]))
+        self.assertEqual(controller.retry_width(2000, 400), 800)
+        self.assertIsNone(controller.retry_width(400, 400))
+        self.assertEqual(ResolutionController().retry_width(2000, 800), 1600)
+        self.assertEqual(ResolutionController().retry_width(1000, 800), 1000)
+
+    def test_curves_round_trip(self):
+        measurements = [
+            {"source_width": 2000, "width": 400, "valid": valid, "seconds": seconds, "bytes": 1000}
+            for valid, seconds in ((True, 1.0), (True, 2.0), (False, 3.0))
+        ]
+        built = build_curves(measurements)
+        point = built[2400][0]
+        self.assertAlmostEqual(point.accuracy, 2 / 3)
+        self.assertEqual((point.samples, point.latency_p50, point.bytes_p50), (3, 2.0, 1000))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "curves.json")
+            save_curves(built, path, {"measured": "2026-10-17"})
+            loaded = load_curves(path)
+        self.assertEqual(loaded[2400][0].to_dict(), point.to_dict())
+
+
+class TestImageWidth(unittest.TestCase):
+    def test_preprocess_to_width(self):
+        output, _ = preprocess_image(jpeg_bytes(2000, 1250), width=500)
+        self.assertEqual(Image.open(BytesIO(output)).size, (500, 312))
+
+    def test_width_is_not_upscaled(self):
+        data = jpeg_bytes(300, 200)
+        self.assertEqual(preprocess_image(data, width=800), (data, "image/jpeg"))
+
+    def test_dimensions_follow_exif_orientation(self):
+        self.assertEqual(image_dimensions(jpeg_bytes(1200, 800)), (1200, 800))
+        self.assertEqual(image_dimensions(jpeg_bytes(1200, 800, orientation=6)), (800, 1200))
+
+
+class TestAdaptiveExtraction(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(anthropic_vision_script.configure_extraction_cache, anthropic_vision_script.extraction_cache)
+        self.addCleanup(anthropic_vision_script.set_model_backend, anthropic_vision_script.get_model_backend())
+        self.addCleanup(anthropic_vision_script.set_resolution_controller,
+                        anthropic_vision_script.resolution_controller)
+        anthropic_vision_script.configure_extraction_cache(None)
+        self.controller = ResolutionController(curves([(400, 5, 0.97), (1200, 5, 1.0)]))
+        anthropic_vision_script.set_resolution_controller(self.controller)
+
+        self.sent_widths = []
+        patcher = mock.patch.object(anthropic_vision_script, "download_image",
+                                    return_value=(jpeg_bytes(2000, 1250), "image/jpeg"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use_responses(self, *responses):
+        def respond(contents):
+            image = contents[0].parts[0].inline_data.data
+            self.sent_widths.append(Image.open(BytesIO(image)).size[0])
+            return responses[len(self.sent_widths) - 1]
+        anthropic_vision_script.set_model_backend(FakeBackend(respond))
+
+    def test_valid_ramq_needs_one_call(self):
+        self.use_responses(VALID_PERSON)
+        result = anthropic_vision_script.get_ramq("https://example.com/card.jpg")
+        self.assertTrue(result[5])
+        self.assertEqual(self.sent_widths, [400])
+
+    def test_invalid_ramq_retries_once_wider(self):
+        self.use_responses(INVALID_PERSON, VALID_PERSON)
+        result = anthropic_vision_script.get_ramq("https://example.com/card.jpg")
+        self.assertTrue(result[5])
+        self.assertEqual(self.sent_widths, [400, 1200])
+        self.assertEqual(self.controller.stats()["retry_recovered"], 1)
+
+    def test_retry_happens_only_once(self):
+        self.use_responses(INVALID_PERSON, INVALID_PERSON)
+        result = anthropic_vision_script.get_ramq("https://example.com/card.jpg")
+        self.assertFalse(result[5])
+        self.assertEqual(len(self.sent_widths), 2)
+
+    def test_missing_ramq_is_not_retried(self):
+        self.use_responses(json.dumps(dict(FAKE_PERSON, ramq=None)))
+        anthropic_vision_script.get_ramq("https://example.com/card.jpg")
+        self.assertEqual(len(self.sent_widths), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
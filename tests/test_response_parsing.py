@@ -0,0 +1,73 @@
+import json
+import unittest
+
+from anthropic_vision_script import (
+    PATIENT_LIST_CONFIG,
+    PERSON_CONFIG,
+    PatientList,
+    PersonExtraction,
+    _parse_patient_list_response,
+    _parse_ramq_bytes_response,
+    _parse_ramq_response,
+)
+
+PERSON = {
+    "first_name": "Jean", "last_name": "Tremblay", "date_of_birth": "1964-05-05",
+    "ramq": "TREJ 6405 0519", "ohip": None, "mrn": "MRN-0001",
+}
+
+
+class TestResponseSchemas(unittest.TestCase):
+    def test_configs_carry_pydantic_schemas(self):
+        self.assertIs(PERSON_CONFIG.response_schema, PersonExtraction)
+        self.assertIs(PATIENT_LIST_CONFIG.response_schema, PatientList)
+        self.assertEqual(PERSON_CONFIG.response_mime_type, "application/json")
+
+
+class TestPersonParsing(unittest.TestCase):
+    def test_schema_response(self):
+        result = _parse_ramq_response(json.dumps(PERSON))
+        self.assertEqual(result[:3], ("TREJ64050519", "Tremblay", "Jean"))
+        self.assertEqual(result[4], "male")
+        self.assertTrue(result[5])
+        self.assertEqual(result[6], "MRN-0001")
+
+    def test_list_wrapped_response_falls_back(self):
+        self.assertEqual(_parse_ramq_response(json.dumps([PERSON])), _parse_ramq_response(json.dumps(PERSON)))
+
+    def test_non_string_values_fall_back(self):
+        result = _parse_ramq_response(json.dumps(dict(PERSON, date_of_birth=19640505)))
+        self.assertEqual(result[0], "TREJ64050519")
+        self.assertEqual(result[3].year, 1964)
+
+    def test_bytes_response(self):
+        result = _parse_ramq_bytes_response(json.dumps(PERSON))
+        self.assertEqual(result[:3], ("TREJ64050519", "Tremblay", "Jean"))
+        self.assertEqual(len(result), 6)
+
+    def test_invalid_json_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            _parse_ramq_response("not json")
+
+
+class TestPatientListParsing(unittest.TestCase):
+    def test_schema_response_normalizes_rooms(self):
+        response = json.dumps({"patients": [
+            {"first_name": "Jean", "last_name": "Tremblay", "patient_number": "1", "room_number": " 12 "},
+            {"first_name": "Marie", "last_name": "Roy", "patient_number": None, "room_number": "  "},
+        ]})
+        patients = _parse_patient_list_response(response).patients
+        self.assertEqual([p.room_number for p in patients], ["12", None])
+
+    def test_embedded_json_falls_back(self):
+        response = 'Here you go: {"patients": [{"first_name": "Jean", "last_name": "Tremblay", "room_number": 12}]}'
+        patients = _parse_patient_list_response(response).patients
+        self.assertEqual(patients[0].room_number, "12")
+
+    def test_no_json_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            _parse_patient_list_response("no patients here")
+
+
+if __name__ == "__main__":
+    unittest.main()
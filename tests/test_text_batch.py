@@ -0,0 +1,110 @@
+import json
+import re
+import unittest
+from unittest import mock
+
+import anthropic_vision_script
+from anthropic_vision_script import _pack_text_batches, get_ramq_batch_text
+from model_backend import FakeBackendError
+
+
+class FakeBatchModel:
+    """Answers packed prompts by echoing one record per '[id] name' line."""
+
+    def __init__(self, drop_ids=(), fail_over=None, unavailable_batches=0):
+        self.calls = []
+        self.drop_ids = set(drop_ids)
+        self.fail_over = fail_over
+        self.unavailable_batches = unavailable_batches
+
+    def __call__(self, contents, config=None):
+        prompt = contents[0].parts[0].text
+        self.calls.append(prompt)
+        lines = re.findall(r"^\[(\d+)\] ?(\S*) ?(\S*)$", prompt, flags=re.M)
+        if not lines:
+            words = prompt.rsplit("Here is the text: ", 1)[1].split()
+            if len(words) < 2:
+                return json.dumps({"first_name": None, "last_name": None, "ramq": None})
+            return json.dumps({"first_name": words[0], "last_name": words[1]})
+        if self.unavailable_batches:
+            self.unavailable_batches -= 1
+            raise FakeBackendError()
+        if self.fail_over is not None and len(lines) > self.fail_over:
+            return '[{"id": "0", "first_name": "trunc'
+        return json.dumps([
+            {"id": snippet_id, "first_name": first or None, "last_name": last or None, "ramq": None}
+            for snippet_id, first, last in lines
+            if snippet_id not in self.drop_ids
+        ])
+
+
+class TestTextBatching(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(anthropic_vision_script.configure_extraction_cache, anthropic_vision_script.extraction_cache)
+        anthropic_vision_script.configure_extraction_cache(None)
+        self.snippets = [f"First{i} Last{i}" for i in range(120)]
+
+    def run_batch(self, model, **kwargs):
+        with mock.patch.object(anthropic_vision_script, "_generate", model):
+            return get_ramq_batch_text(self.snippets, **kwargs)
+
+    def test_packs_snippets_and_splits_results(self):
+        model = FakeBatchModel()
+        results = self.run_batch(model, max_items=50)
+
+        self.assertEqual(len(model.calls), 3)
+        self.assertEqual([r[2] for r in results], [f"First{i}" for i in range(120)])
+        self.assertEqual(results[7][1], "Last7")
+        self.assertEqual(len(results[0]), 11)
+
+    def test_batch_size_follows_token_budget(self):
+        batches = _pack_text_batches(["x" * 400] * 20, max_tokens=1000, max_items=50)
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(sum(len(batch) for batch in batches), 20)
+        self.assertEqual([i for batch in batches for i in batch], list(range(20)))
+
+    def test_missing_ids_fall_back_to_single_calls(self):
+        model = FakeBatchModel(drop_ids={"3"})
+        results = self.run_batch(model, max_tokens=100000, max_items=200)
+        self.assertEqual(len(model.calls), 2)
+        self.assertEqual(results[3][2], "First3")
+
+    def test_nameless_snippet_does_not_abort_the_batch(self):
+        self.snippets[4] = "illegible"
+        model = FakeBatchModel()
+        results = self.run_batch(model, max_tokens=100000, max_items=200)
+        self.assertIsNone(results[4])
+        self.assertEqual(len(model.calls), 2)
+        self.assertEqual(results[5][2], "First5")
+        self.assertEqual(sum(result is not None for result in results), 119)
+
+    def test_unparseable_batches_are_split(self):
+        model = FakeBatchModel(fail_over=30)
+        results = self.run_batch(model, max_tokens=100000, max_items=120)
+        self.assertEqual([r[2] for r in results], [f"First{i}" for i in range(120)])
+        self.assertLess(len(model.calls), 20)
+
+    def test_backend_error_falls_back_to_single_calls(self):
+        model = FakeBatchModel(unavailable_batches=1)
+        results = self.run_batch(model, max_items=50)
+        self.assertEqual([r[2] for r in results], [f"First{i}" for i in range(120)])
+        # One failed batch of 20 (packed last, run first), two batch calls and 20 single calls
+        self.assertEqual(len(model.calls), 1 + 2 + 20)
+
+    def test_results_fill_the_per_snippet_cache(self):
+        anthropic_vision_script.configure_extraction_cache(anthropic_vision_script.ExtractionCache())
+        model = FakeBatchModel()
+        self.run_batch(model)
+        calls = len(model.calls)
+        with mock.patch.object(anthropic_vision_script, "_generate", model):
+            again = get_ramq_batch_text(self.snippets)
+            self.assertEqual(len(model.calls), calls)
+            # Batch records are not served as answers to the single-snippet prompt
+            single = anthropic_vision_script.get_ramq(self.snippets[5], is_image=False)
+        self.assertEqual(len(model.calls), calls + 1)
+        self.assertEqual(single[2], "First5")
+        self.assertEqual(again[119][2], "First119")
+
+
+if __name__ == "__main__":
+    unittest.main()
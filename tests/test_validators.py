@@ -0,0 +1,97 @@
+import random
+import unittest
+from datetime import datetime
+
+import validators
+from tests.bench_validators import (
+    make_inputs,
+    reference_normalize_ohip,
+    reference_normalize_ramq,
+    reference_parse_date_string,
+    reference_validate_ohip,
+    reference_validate_ramq,
+)
+from validators import (
+    RAMQ_REASON_CHECK_DIGIT,
+    RAMQ_REASON_FORMAT,
+    RAMQ_REASON_LENGTH,
+    check_ohip,
+    check_ramq,
+    parse_date_string,
+    validate_ramq,
+)
+
+
+class TestMatchesPreviousImplementation(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.inputs = make_inputs(3000, seed=11)
+
+    def assert_same(self, func, reference, values):
+        for value in values:
+            self.assertEqual(func(value), reference(value), value)
+
+    def test_validate_ramq(self):
+        self.assert_same(validate_ramq, reference_validate_ramq, self.inputs["ramq"])
+        # Every sex/month code and check digit of one number
+        codes = [f"TREJ64{month:02d}05{sequence}{check}"
+                 for month in range(100) for sequence in range(10) for check in range(10)]
+        self.assert_same(validate_ramq, reference_validate_ramq, codes)
+
+    def test_normalize_ramq(self):
+        values = self.inputs["raw_ramq"] + ["", None, "no ramq here", "xx TREJ 6405 0519 yy", "TREJ6405051"]
+        self.assert_same(validators.normalize_ramq, reference_normalize_ramq, values)
+
+    def test_ohip(self):
+        values = self.inputs["ohip"] + ["", None, "1234-567-890-ab", "1234567890ABC", 1234567890]
+        self.assert_same(validators.normalize_ohip, reference_normalize_ohip, values)
+        self.assert_same(validators.validate_ohip, reference_validate_ohip, [value for value in values if value])
+
+    def test_parse_date_string(self):
+        values = self.inputs["date"] + [
+            "", None, "  1990-05-03 ", "1990/5/3", "3/5/1990", "05/13/1990", "02-30-2020", "2020-02-30",
+            "1990-05/03", "13/13/1990", "90-05-03", "1990-05-03T00:00", "May 3, 1990", "19900503",
+            # Non-ASCII digits (Arabic-Indic, Devanagari, fullwidth)
+            "3/\u0661/6020", "\u0661\u0669\u0669\u0660-05-03", "1990-\u0966\u0665-03", "\uff11\uff19\uff19\uff10/05/03",
+            "1990-1-1\u0665", "1990-05- 3", " 3/05/1990",
+        ]
+        self.assert_same(parse_date_string, reference_parse_date_string, values)
+
+    def test_parse_date_string_fuzz(self):
+        rng = random.Random(3)
+        alphabet = "0123456789" * 3 + "\u0661\u0665\u0660\u0966\uff11" + "-/ x"
+        values = ["".join(rng.choice(alphabet) for _ in range(rng.randint(5, 11))) for _ in range(20000)]
+        self.assert_same(parse_date_string, reference_parse_date_string, values)
+
+    def test_day_first_before_month_first(self):
+        self.assertEqual(parse_date_string("03/05/1990"), datetime(1990, 5, 3))
+        self.assertEqual(parse_date_string("05/13/1990"), datetime(1990, 5, 13))
+
+
+class TestResults(unittest.TestCase):
+    def test_check_ramq_reasons(self):
+        self.assertTrue(check_ramq("TREJ64050519").valid)
+        self.assertEqual(check_ramq("TREJ64050518").reason, RAMQ_REASON_CHECK_DIGIT)
+        self.assertEqual(check_ramq("TREJ6405051").reason, RAMQ_REASON_LENGTH)
+        self.assertEqual(check_ramq("TRE164050519").reason, RAMQ_REASON_FORMAT)
+        self.assertEqual(check_ramq(None).reason, RAMQ_REASON_FORMAT)
+
+    def test_malformed_ramq_is_invalid(self):
+        for ramq in ("TREJ64O50519", "trej64050519", "TREJ6405051X", "TREJ 4050519"):
+            self.assertFalse(validate_ramq(ramq), ramq)
+
+    def test_check_ohip(self):
+        self.assertEqual(check_ohip("1234 567-890 ab").to_dict(),
+                         {"ohip": "1234 567-890 ab", "valid": True, "number": "1234567890", "version_code": "AB"})
+        self.assertFalse(check_ohip("123456789").valid)
+        self.assertFalse(check_ohip(None).valid)
+
+    def test_results_use_slots(self):
+        for result in (check_ramq("TREJ64050519"), check_ohip("1234567890")):
+            self.assertFalse(hasattr(result, "__dict__"))
+            with self.assertRaises(AttributeError):
+                result.extra = True
+
+
+if __name__ == '__main__':
+    unittest.main()
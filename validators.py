@@ -0,0 +1,616 @@
+"""Health number validation and normalization (RAMQ, OHIP) and date parsing.
+
+Only the standard library is imported, so the API validation endpoints and
+CLI validation start without loading the model client, Pillow or pydantic.
+NumPy is imported on the first call to validate_ramq_batch. The extraction
+module (anthropic_vision_script) re-exports everything defined here.
+"""
+import os
+import re
+import unicodedata
+from datetime import datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+# Character to decimal value mapping used by the RAMQ check digit
+RAMQ_CHAR_VALUES = {
+    "A": 193,
+    "B": 194,
+    "C": 195,
+    "D": 196,
+    "E": 197,
+    "F": 198,
+    "G": 199,
+    "H": 200,
+    "I": 201,
+    "J": 209,
+    "K": 210,
+    "L": 211,
+    "M": 212,
+    "N": 213,
+    "O": 214,
+    "P": 215,
+    "Q": 216,
+    "R": 217,
+    "S": 226,
+    "T": 227,
+    "U": 228,
+    "V": 229,
+    "W": 230,
+    "X": 231,
+    "Y": 232,
+    "Z": 233,
+    "0": 240,
+    "1": 241,
+    "2": 242,
+    "3": 243,
+    "4": 244,
+    "5": 245,
+    "6": 246,
+    "7": 247,
+    "8": 248,
+    "9": 249,
+}
+
+# Multipliers for all 14 characters before the check digit
+# Based on the example provided (NOMI-AAAA-SxMM-JJ-S gives 14 chars):
+RAMQ_MULTIPLIERS = [1, 3, 7, 9, 1, 7, 1, 3, 4, 5, 7, 6, 9, 1]
+
+
+# Check digit contribution of each character at each position of the
+# 14-character NOMI AAAA Sx MM JJ S string, indexed [position][char]
+_RAMQ_WEIGHTS = [{char: value * multiplier for char, value in RAMQ_CHAR_VALUES.items()}
+                 for multiplier in RAMQ_MULTIPLIERS]
+_RAMQ_CENTURY_19 = _RAMQ_WEIGHTS[4]["1"] + _RAMQ_WEIGHTS[5]["9"]
+_RAMQ_CENTURY_20 = _RAMQ_WEIGHTS[4]["2"] + _RAMQ_WEIGHTS[5]["0"]
+_TWO_DIGITS = [f"{number:02d}" for number in range(100)]
+# Two-digit fields of a RAMQ mapped straight to their check digit contribution:
+# year digits (and the year), month digits with the sex (month + 50 for women), day digits
+_RAMQ_YEARS = {code: (_RAMQ_WEIGHTS[6][code[0]] + _RAMQ_WEIGHTS[7][code[1]], int(code)) for code in _TWO_DIGITS}
+_RAMQ_MONTHS = {
+    code: _RAMQ_WEIGHTS[8]["F" if int(code) > 50 else "M"]
+    + _RAMQ_WEIGHTS[9][_TWO_DIGITS[int(code) - 50 if int(code) > 50 else int(code)][0]]
+    + _RAMQ_WEIGHTS[10][_TWO_DIGITS[int(code) - 50 if int(code) > 50 else int(code)][1]]
+    for code in _TWO_DIGITS
+}
+_RAMQ_DAYS = {code: _RAMQ_WEIGHTS[11][code[0]] + _RAMQ_WEIGHTS[12][code[1]] for code in _TWO_DIGITS}
+_DIGIT_VALUES = {digit: int(digit) for digit in "0123456789"}
+
+# Well-formed RAMQ number: 4 letters and 8 digits
+_RAMQ_FORMAT = re.compile(r"[A-Z]{4}\d{8}")
+
+
+def validate_ramq(ramq: str) -> bool:
+    """Check a 12-character RAMQ number (NOMI YYMM DDSC) against its check digit.
+
+    The birth year is tried in the 2000s when that is not in the future, then
+    in the 1900s. Values that are not 12 characters of letters and digits in
+    the right places are invalid. Every field is a table lookup.
+    """
+    if len(ramq) != 12:
+        return False
+    weights = _RAMQ_WEIGHTS
+    try:
+        year_weight, year = _RAMQ_YEARS[ramq[4:6]]
+        total = (
+            weights[0][ramq[0]] + weights[1][ramq[1]] + weights[2][ramq[2]] + weights[3][ramq[3]]
+            + year_weight + _RAMQ_MONTHS[ramq[6:8]] + _RAMQ_DAYS[ramq[8:10]] + weights[13][ramq[10]]
+        )
+        check_digit = _DIGIT_VALUES[ramq[11]]
+    except KeyError:
+        return False
+    if (total + _RAMQ_CENTURY_19) % 10 == check_digit:
+        return True
+    return year <= 50 and 2000 + year <= datetime.now().year and (total + _RAMQ_CENTURY_20) % 10 == check_digit
+
+
+# Failure reasons reported by validate_ramq_batch
+RAMQ_REASON_LENGTH = "invalid_length"
+RAMQ_REASON_FORMAT = "invalid_format"
+RAMQ_REASON_CHECK_DIGIT = "check_digit_mismatch"
+
+
+class RamqCheck:
+    """Outcome of check_ramq: valid, or the RAMQ_REASON_* it failed on."""
+
+    __slots__ = ("ramq", "valid", "reason")
+
+    def __init__(self, ramq, valid: bool, reason: Optional[str] = None):
+        self.ramq = ramq
+        self.valid = valid
+        self.reason = reason
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def check_ramq(ramq) -> RamqCheck:
+    """Validate one stored RAMQ as is (no normalization), with the failure reason.
+
+    Scalar counterpart of validate_ramq_batch for record-by-record reconciliation.
+    """
+    if not isinstance(ramq, str) or len(ramq) != 12:
+        reason = RAMQ_REASON_LENGTH if isinstance(ramq, str) else RAMQ_REASON_FORMAT
+        return RamqCheck(ramq, False, reason)
+    if _RAMQ_FORMAT.fullmatch(ramq) is None:
+        return RamqCheck(ramq, False, RAMQ_REASON_FORMAT)
+    if not validate_ramq(ramq):
+        return RamqCheck(ramq, False, RAMQ_REASON_CHECK_DIGIT)
+    return RamqCheck(ramq, True)
+
+
+@lru_cache(maxsize=None)
+def _ramq_batch_tables():
+    """Build the code point lookup tables used by validate_ramq_batch.
+
+    Returns (char_values, century_19, century_20, sex_values):
+        char_values: RAMQ_CHAR_VALUES indexed by ASCII code point (0 when not allowed)
+        century_19/century_20: weighted contribution of the "19"/"20" century digits
+        sex_values: weighted contribution of the sex letter, indexed by is_female
+    """
+    import numpy as np
+
+    char_values = np.zeros(128, dtype=np.int64)
+    for char, value in RAMQ_CHAR_VALUES.items():
+        char_values[ord(char)] = value
+
+    def weighted(text: str, offset: int) -> int:
+        return sum(
+            RAMQ_CHAR_VALUES[char] * RAMQ_MULTIPLIERS[offset + i]
+            for i, char in enumerate(text)
+        )
+
+    sex_values = np.array([weighted("M", 8), weighted("F", 8)], dtype=np.int64)
+    return char_values, weighted("19", 4), weighted("20", 4), sex_values
+
+
+def _load_ramq_batch_input(ramqs) -> "np.ndarray":
+    """Coerce a list, NumPy array, path or open text file into a 1-D str array."""
+    import numpy as np
+
+    if isinstance(ramqs, (str, os.PathLike)):
+        with open(ramqs, "r", encoding="utf-8") as handle:
+            return _load_ramq_batch_input(handle)
+    if hasattr(ramqs, "read"):
+        ramqs = [line.strip() for line in ramqs if line.strip()]
+
+    values = np.asarray(ramqs)
+    if values.dtype.kind != "U":
+        values = values.astype(str)
+    # Native byte order, so the characters can be read back as uint32 codes
+    return np.ascontiguousarray(values.reshape(-1), dtype=values.dtype.newbyteorder("="))
+
+
+def validate_ramq_batch(ramqs) -> Tuple["np.ndarray", List[Optional[str]]]:
+    """Validate many RAMQ numbers in one vectorized pass.
+
+    Args:
+        ramqs: List or NumPy array of RAMQ strings, or a path / open text file
+            with one RAMQ per line (blank lines are skipped)
+
+    Returns:
+        (valid, reasons) where valid is a boolean array and reasons holds, for
+        each item, None when valid or one of RAMQ_REASON_LENGTH,
+        RAMQ_REASON_FORMAT and RAMQ_REASON_CHECK_DIGIT.
+
+    Results match validate_ramq item by item. Values the scalar function
+    cannot parse (lowercase letters, non-digits in the date or check digit
+    positions) are reported invalid instead of raising.
+    """
+    import numpy as np
+
+    values = _load_ramq_batch_input(ramqs)
+    count = values.shape[0]
+    if count == 0:
+        return np.zeros(0, dtype=bool), []
+
+    char_values, century_19, century_20, sex_values = _ramq_batch_tables()
+
+    lengths = np.char.str_len(values)
+    if values.dtype.itemsize < 12 * 4:
+        values = values.astype("=U12")
+    width = values.dtype.itemsize // 4
+    codes = values.view(np.uint32).reshape(count, width)[:, :12].astype(np.int64)
+
+    ascii_codes = np.where(codes < 128, codes, 0)
+    values_table = char_values[ascii_codes]
+    digits = codes - ord("0")
+    is_digit = (digits >= 0) & (digits <= 9)
+
+    char_columns = [0, 1, 2, 3, 10]
+    digit_columns = [4, 5, 6, 7, 8, 9, 11]
+    well_formed = (
+        (lengths == 12)
+        & (values_table[:, char_columns] > 0).all(axis=1)
+        & is_digit[:, digit_columns].all(axis=1)
+    )
+    digits = np.where(is_digit, digits, 0)
+
+    year = digits[:, 4] * 10 + digits[:, 5]
+    month = digits[:, 6] * 10 + digits[:, 7]
+    is_female = month > 50
+    month = np.where(is_female, month - 50, month)
+    check_digit = digits[:, 11]
+
+    # Weighted sum of every position except the century digits, laid out
+    # as in validate_ramq: NOMI AAAA Sx MM JJ S
+    total = (
+        values_table[:, :4] @ np.array(RAMQ_MULTIPLIERS[:4], dtype=np.int64)
+        + char_values[ord("0") + digits[:, 4]] * RAMQ_MULTIPLIERS[6]
+        + char_values[ord("0") + digits[:, 5]] * RAMQ_MULTIPLIERS[7]
+        + sex_values[is_female.astype(np.int64)]
+        + char_values[ord("0") + month // 10] * RAMQ_MULTIPLIERS[9]
+        + char_values[ord("0") + month % 10] * RAMQ_MULTIPLIERS[10]
+        + char_values[ord("0") + digits[:, 8]] * RAMQ_MULTIPLIERS[11]
+        + char_values[ord("0") + digits[:, 9]] * RAMQ_MULTIPLIERS[12]
+        + values_table[:, 10] * RAMQ_MULTIPLIERS[13]
+    )
+
+    # 20xx is only tried for years up to 50 that are not in the future,
+    # falling back to 19xx exactly like the scalar function
+    current_year = datetime.now().year
+    allow_2000s = (year <= 50) & (2000 + year <= current_year)
+    matches = ((total + century_19) % 10 == check_digit) | (
+        allow_2000s & ((total + century_20) % 10 == check_digit)
+    )
+    valid = well_formed & matches
+
+    reasons = np.full(count, None, dtype=object)
+    reasons[~valid] = RAMQ_REASON_CHECK_DIGIT
+    reasons[~well_formed] = RAMQ_REASON_FORMAT
+    reasons[lengths != 12] = RAMQ_REASON_LENGTH
+    return valid, reasons.tolist()
+
+
+# Spaces and dashes people type inside health numbers
+_SEPARATORS = re.compile(r"[\s\-]+")
+_OHIP_FORMAT = re.compile(r"(\d{10})([A-Z]{2})?")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_ohip(ohip: Optional[str]) -> Optional[dict]:
+    """Normalize OHIP number to 10 digits + optional 2-letter version code."""
+    if not ohip:
+        return None
+
+    match = _OHIP_FORMAT.fullmatch(_SEPARATORS.sub("", str(ohip)).upper())
+    if not match:
+        return None
+
+    return {
+        "number": match.group(1),
+        "version_code": match.group(2) or None,
+    }
+
+
+def validate_ohip(ohip: str) -> bool:
+    """Validate OHIP number format: 10 digits + optional 2-letter version code."""
+    return _OHIP_FORMAT.fullmatch(_SEPARATORS.sub("", str(ohip)).upper()) is not None
+
+
+class OhipCheck:
+    """Outcome of check_ohip, with the normalized number when valid."""
+
+    __slots__ = ("ohip", "valid", "number", "version_code")
+
+    def __init__(self, ohip, valid: bool, number: Optional[str] = None, version_code: Optional[str] = None):
+        self.ohip = ohip
+        self.valid = valid
+        self.number = number
+        self.version_code = version_code
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def check_ohip(ohip) -> OhipCheck:
+    """Validate and normalize one OHIP number in a single pass."""
+    normalized = normalize_ohip(ohip)
+    if normalized is None:
+        return OhipCheck(ohip, False)
+    return OhipCheck(ohip, True, normalized["number"], normalized["version_code"])
+
+
+def normalize_ramq(ramq: Optional[str]) -> Optional[str]:
+    """Normalize RAMQ to 4 letters + 8 digits when possible."""
+    if not ramq:
+        return None
+
+    # The first well-formed number in the text, which is all of it when already normalized
+    match = _RAMQ_FORMAT.search(_WHITESPACE.sub("", str(ramq)).upper())
+    return match.group(0) if match else None
+
+
+# Dates the model writes: year first (Y-m-d, Y/m/d) or year last, read as
+# day first then month first (d-m-Y, m-d-Y), both fields separated alike.
+# The fields use strptime's own %Y, %m and %d patterns, so the same strings
+# are accepted (%Y takes any Unicode digit, %m only ASCII ones).
+_DATE_YEAR = r"\d\d\d\d"
+_DATE_MONTH = r"1[0-2]|0[1-9]|[1-9]"
+_DATE_DAY = r"3[01]|[12]\d|0[1-9]|[1-9]| [1-9]"
+_DATE_FIELDS = re.compile(
+    rf"({_DATE_YEAR})([-/])({_DATE_MONTH})\2({_DATE_DAY})"
+    rf"|({_DATE_DAY})([-/])({_DATE_DAY})\6({_DATE_YEAR})"
+)
+# Strings %m matches whole
+_DATE_MONTHS = frozenset([str(month) for month in range(1, 10)] + [f"{month:02d}" for month in range(1, 13)])
+
+
+def parse_date_string(date_text: Optional[str]) -> Optional[datetime]:
+    """Parse date from model output in Y-m-d, d-m-Y or m-d-Y order ('-' or '/').
+
+    One match splits the fields and tells whether the year comes first. A
+    year-last date is read day first, then month first when the day-first
+    reading is out of range (so 05/13/1990 is read month first).
+    """
+    if not date_text:
+        return None
+
+    match = _DATE_FIELDS.fullmatch(str(date_text).strip())
+    if match is None:
+        return None
+    try:
+        if match.group(1) is not None:
+            return datetime(int(match.group(1)), int(match.group(3)), int(match.group(4)))
+    except ValueError:
+        return None
+
+    first, second, year = match.group(5), match.group(7), int(match.group(8))
+    if second in _DATE_MONTHS:
+        try:
+            return datetime(year, int(second), int(first))
+        except ValueError:
+            pass
+    if first in _DATE_MONTHS:
+        try:
+            return datetime(year, int(first), int(second))
+        except ValueError:
+            pass
+    return None
+
+
+def extract_birth_info_from_ramq(ramq: str):
+    """Return (dob, gender, is_valid_ramq) for a normalized RAMQ."""
+    year = int(ramq[4:6])
+    month = int(ramq[6:8])
+    day = int(ramq[8:10])
+
+    current_year = datetime.now().year
+    year += 1900 if year > 50 else 2000
+    if year > current_year:
+        year -= 100
+
+    if month > 50:
+        gender = "female"
+        month -= 50
+    else:
+        gender = "male"
+
+    try:
+        dob = datetime(year, month, day)
+    except ValueError:
+        dob = None
+
+    return dob, gender, validate_ramq(ramq)
+
+
+# Letter/digit shapes OCR commonly confuses, by the kind of RAMQ position they
+# were read in. Only a character of the wrong kind is replaced: a digit read as
+# another digit cannot be told apart from a different number.
+_RAMQ_DIGIT_CONFUSIONS = {
+    "O": "0", "D": "0", "Q": "0", "U": "0", "I": "1", "L": "1", "|": "1", "Z": "2",
+    "S": "5", "G": "6", "T": "7", "B": "8",
+}
+_RAMQ_LETTER_CONFUSIONS = {"0": "O", "1": "I", "2": "Z", "5": "S", "6": "G", "8": "B"}
+
+_NON_LETTERS = re.compile(r"[^A-Z]")
+_LETTER_RUNS = re.compile(r"[A-Z]+")
+
+
+def ramq_name_prefix(last_name: Optional[str], first_name: Optional[str]) -> Optional[str]:
+    """The 4 letters a RAMQ starts with: 3 of the last name (X-padded) and the first initial."""
+    def letters(name):
+        ascii_name = unicodedata.normalize("NFKD", name or "").encode("ascii", "ignore").decode()
+        return _NON_LETTERS.sub("", ascii_name.upper())
+
+    last, first = letters(last_name), letters(first_name)
+    if not last or not first:
+        return None
+    return (last[:3] + "XX")[:3] + first[0]
+
+
+def _ramq_substitutions(compact: str, max_edits: int):
+    """Yield (candidate, edits) for well-formed readings within max_edits confusions."""
+    options = []
+    for index, char in enumerate(compact):
+        if index < 4:
+            keep = char if "A" <= char <= "Z" else None
+            alternatives = _RAMQ_LETTER_CONFUSIONS.get(char, "")
+        else:
+            keep = char if char.isdigit() else None
+            alternatives = _RAMQ_DIGIT_CONFUSIONS.get(char, "")
+        options.append((keep, alternatives))
+
+    def expand(index, prefix, edits):
+        if index == len(options):
+            yield prefix, edits
+            return
+        keep, alternatives = options[index]
+        if keep is not None:
+            yield from expand(index + 1, prefix + keep, edits)
+        if edits < max_edits:
+            for alternative in alternatives:
+                yield from expand(index + 1, prefix + alternative, edits + 1)
+
+    yield from expand(0, "", 0)
+
+
+def repair_ramq(raw_ramq: Optional[str], last_name: Optional[str] = None, first_name: Optional[str] = None,
+                date_of_birth: Optional[datetime] = None, max_edits: int = 2) -> Optional[str]:
+    """Correct a RAMQ misread by OCR without asking the model again.
+
+    Candidates replace at most max_edits letters read in digit positions (or
+    digits read in letter positions) with their look-alikes (O/0, I/1, S/5,
+    B/8, ...). A candidate must pass the check digit and agree with the
+    extracted date of birth; the one with the fewest edits wins, then the best
+    match with the name letters. The name and date of birth never supply
+    characters. A number that already validates is returned as is. Returns
+    None when nothing passes or the best candidates tie.
+    """
+    if not raw_ramq:
+        return None
+    compact = _SEPARATORS.sub("", str(raw_ramq)).upper()
+    if len(compact) != 12:
+        return None
+    if _RAMQ_FORMAT.fullmatch(compact) and validate_ramq(compact):
+        return compact
+
+    candidates = dict(_ramq_substitutions(compact, max_edits))
+    prefix = ramq_name_prefix(last_name, first_name)
+
+    scored = []
+    for candidate, edits in candidates.items():
+        if edits == 0 or not validate_ramq(candidate):
+            continue
+        dob, _, _ = extract_birth_info_from_ramq(candidate)
+        if dob is None:
+            continue
+        if date_of_birth is not None and (dob.year % 100, dob.month, dob.day) != (
+                date_of_birth.year % 100, date_of_birth.month, date_of_birth.day):
+            continue
+        name_matches = sum(a == b for a, b in zip(candidate[:4], prefix)) if prefix else 0
+        scored.append(((edits, -name_matches), candidate))
+
+    if not scored:
+        return None
+    scored.sort()
+    if len(scored) > 1 and scored[0][0] == scored[1][0]:
+        return None
+    return scored[0][1]
+
+
+# Surname particles the registration clerk may have dropped before taking 3 letters
+_RAMQ_NAME_PARTICLES = ("DE", "DU", "DES", "LA", "LE", "LES", "D", "L", "ST", "STE", "SAINT", "SAINTE", "VAN", "VON", "MC", "MAC")
+
+
+def _name_words(name: Optional[str]) -> List[str]:
+    ascii_name = unicodedata.normalize("NFKD", name or "").encode("ascii", "ignore").decode()
+    return _LETTER_RUNS.findall(ascii_name.upper())
+
+
+@lru_cache(maxsize=65536)
+def ramq_name_prefixes(last_name: Optional[str], first_name: Optional[str]) -> Tuple[str, ...]:
+    """Every 4-letter NAM start a card could carry for this name.
+
+    The first is ramq_name_prefix. Variants cover compound surnames (first
+    word only) and leading particles (De, La, St...) left out.
+    """
+    words, first = _name_words(last_name), _name_words(first_name)
+    if not words or not first:
+        return ()
+    initial = first[0][0]
+    stripped = words
+    while len(stripped) > 1 and stripped[0] in _RAMQ_NAME_PARTICLES:
+        stripped = stripped[1:]
+    prefixes = []
+    for letters in ("".join(words), words[0], "".join(stripped), stripped[0]):
+        prefix = (letters[:3] + "XX")[:3] + initial
+        if prefix not in prefixes:
+            prefixes.append(prefix)
+    return tuple(prefixes)
+
+
+def ramq_birth_digits(date_of_birth: datetime, sex: Optional[str] = None) -> Tuple[str, ...]:
+    """The YYMMDD a NAM encodes for a birth date (month + 50 for women); both sexes when unknown."""
+    year, day = date_of_birth.year % 100, date_of_birth.day
+    months = {"male": (date_of_birth.month,), "female": (date_of_birth.month + 50,)}.get(
+        sex, (date_of_birth.month, date_of_birth.month + 50))
+    return tuple(f"{year:02d}{month:02d}{day:02d}" for month in months)
+
+
+def expected_ramq_prefixes(last_name: Optional[str], first_name: Optional[str],
+                           date_of_birth: datetime, sex: Optional[str] = None) -> Tuple[str, ...]:
+    """The 10-character NAM starts (letters and birth digits) expected for a person."""
+    return tuple(letters + digits for letters in ramq_name_prefixes(last_name, first_name)
+                 for digits in ramq_birth_digits(date_of_birth, sex))
+
+
+class RamqConsistency(NamedTuple):
+    """How well a RAMQ agrees with the name, birth date and sex read beside it.
+
+    dob_match and sex_match are None when the value was not available.
+    """
+    valid: bool
+    name_match: bool
+    dob_match: Optional[bool]
+    sex_match: Optional[bool]
+    score: float
+
+    @property
+    def consistent(self) -> bool:
+        return self.valid and self.name_match and self.dob_match is not False and self.sex_match is not False
+
+
+def score_ramq_consistency(ramq: Optional[str], last_name: Optional[str] = None, first_name: Optional[str] = None,
+                           date_of_birth: Optional[datetime] = None, sex: Optional[str] = None) -> RamqConsistency:
+    """Cross-check a RAMQ against the rest of an extraction without a model call.
+
+    score is 0 for a malformed or invalid number, otherwise the share of the
+    available checks (name letters counted per letter, birth date, sex) that agree.
+    """
+    ramq = normalize_ramq(ramq)
+    if ramq is None or not validate_ramq(ramq):
+        return RamqConsistency(False, False, None, None, 0.0)
+
+    prefixes = ramq_name_prefixes(last_name, first_name)
+    letters = max((sum(a == b for a, b in zip(ramq[:4], prefix)) for prefix in prefixes), default=0)
+    checks = [letters / 4]
+    dob_match = sex_match = None
+    if date_of_birth is not None:
+        dob_match = ramq[4:10] in ramq_birth_digits(date_of_birth)
+        checks.append(float(dob_match))
+    if sex in ("male", "female"):
+        sex_match = (int(ramq[6:8]) > 50) == (sex == "female")
+        checks.append(float(sex_match))
+    return RamqConsistency(True, letters == 4, dob_match, sex_match, sum(checks) / len(checks))
+
+
+class RamqPrefixIndex:
+    """In-memory index from expected NAM prefixes to registry keys.
+
+    Each person is stored under every (name variant, birth date, sex) NAM
+    start, so checking an extracted RAMQ against a registry is a dict lookup
+    on its first 10 characters.
+    """
+
+    def __init__(self):
+        self._keys = {}
+
+    def add(self, key, last_name: Optional[str], first_name: Optional[str],
+            date_of_birth: datetime, sex: Optional[str] = None) -> None:
+        for prefix in expected_ramq_prefixes(last_name, first_name, date_of_birth, sex):
+            keys = self._keys.setdefault(prefix, [])
+            if key not in keys:
+                keys.append(key)
+
+    @classmethod
+    def build(cls, records) -> "RamqPrefixIndex":
+        """Index (key, last_name, first_name, date_of_birth[, sex]) tuples."""
+        index = cls()
+        for record in records:
+            index.add(*record)
+        return index
+
+    def lookup(self, ramq: Optional[str]) -> List:
+        """Keys of the people whose expected NAM start matches this RAMQ."""
+        ramq = normalize_ramq(ramq)
+        if ramq is None:
+            return []
+        return list(self._keys.get(ramq[:10], ()))
+
+    def __len__(self) -> int:
+        return len(self._keys)